@@ -0,0 +1,71 @@
+"""
+Production gunicorn profile: ``gunicorn -c gunicorn.conf.py``.
+
+Every setting can be overridden from the environment. With the default
+gthread workers the live presence page falls back to one snapshot per
+reconnect. ``GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker`` serves the
+ASGI application instead, so Server-Sent Events stream.
+
+The app is preloaded in the master, and loading it runs ``rosary.warmup``,
+which primes its caches before any worker is forked, so workers start warm.
+Start-up, warm-up and each worker's first request are logged.
+"""
+import os
+import time
+
+STARTED = time.monotonic()
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "prayer_site.settings")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "True").lower() in ("true", "1")
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+if "uvicorn" in worker_class.lower():
+    wsgi_app = "prayer_site.asgi:application"
+else:
+    wsgi_app = "prayer_site.wsgi:application"
+
+
+def _log_warm_up(log, who):
+    from rosary import warmup
+
+    if warmup.results is not None:
+        log.info("%s warm-up: %s", who, warmup.format_timings(warmup.results))
+
+
+def when_ready(server):
+    # Runs before the first worker is forked.
+    if preload_app:
+        _log_warm_up(server.log, "Master")
+    server.log.info("Master ready in %.2fs (preload=%s)", time.monotonic() - STARTED, preload_app)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+    worker.first_request_started = None
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s booted in %.1fms", worker.pid, (time.monotonic() - worker.forked_at) * 1000)
+    if not preload_app:
+        _log_warm_up(worker.log, f"Worker {worker.pid}")
+
+
+def pre_request(worker, req):
+    if worker.first_request_started is None:
+        worker.first_request_started = time.monotonic()
+
+
+def post_request(worker, req, environ, resp):
+    started = worker.first_request_started
+    if started is not None and started is not False:
+        worker.first_request_started = False
+        worker.log.info(
+            "Worker %s first request %s %s took %.1fms, %.2fs after fork",
+            worker.pid, req.method, req.path, (time.monotonic() - started) * 1000, started - worker.forked_at,
+        )
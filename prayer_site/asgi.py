@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'prayer_site.settings')
 
 application = get_asgi_application()
+
+# Prime the per-process caches before the first request; see rosary.warmup.
+from rosary import warmup  # noqa: E402
+
+warmup.warm_up()
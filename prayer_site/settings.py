@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 import dj_database_url
 
+from rosary import db_tuning
+
 # --- Core Paths ---
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -39,6 +41,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files in production
+    'rosary.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,15 +58,23 @@ WSGI_APPLICATION = 'prayer_site.wsgi.application'
 # --- Templates ---
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with render times reported to rosary.metrics.
+        'BACKEND': 'rosary.metrics.InstrumentedTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compiled templates are kept per process; the dev server's
+            # autoreloader clears them when a template changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -76,10 +87,60 @@ DATABASES = {
     )
 }
 
+# --- Read Replica ---
+# Stats and presence views read from this database when set (rosary.routers).
+# For local testing use a second SQLite file kept current by manage.py sync_replica.
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL", "")
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = {
+        **dj_database_url.parse(DATABASE_REPLICA_URL, conn_max_age=600),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['rosary.routers.ReplicaRouter']
+# Seconds a user's reads stay on the primary after they complete a rosary;
+# keep it above the replica's usual lag.
+ROSARY_REPLICA_PIN_SECONDS = int(os.environ.get("ROSARY_REPLICA_PIN_SECONDS", "60"))
+
+# --- Database Tuning (rosary.db_tuning) ---
+# SQLite: WAL, synchronous=NORMAL, busy timeout (seconds), mmap window (bytes)
+# and page cache (negative = KiB), applied on every new connection.
+ROSARY_SQLITE_TUNING = os.environ.get("ROSARY_SQLITE_TUNING", "True").lower() in ("true", "1")
+ROSARY_SQLITE_SYNCHRONOUS = os.environ.get("ROSARY_SQLITE_SYNCHRONOUS", "NORMAL")
+ROSARY_SQLITE_BUSY_TIMEOUT = float(os.environ.get("ROSARY_SQLITE_BUSY_TIMEOUT", "5"))
+ROSARY_SQLITE_MMAP_SIZE = int(os.environ.get("ROSARY_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+ROSARY_SQLITE_CACHE_SIZE = int(os.environ.get("ROSARY_SQLITE_CACHE_SIZE", "-32000"))
+# PostgreSQL: Django's native pool when psycopg_pool is installed, sized per worker process.
+ROSARY_PG_POOL = os.environ.get("ROSARY_PG_POOL", "True").lower() in ("true", "1")
+ROSARY_PG_POOL_MIN_SIZE = int(os.environ.get("ROSARY_PG_POOL_MIN_SIZE", "2"))
+ROSARY_PG_POOL_MAX_SIZE = int(os.environ.get("ROSARY_PG_POOL_MAX_SIZE", "10"))
+ROSARY_PG_POOL_TIMEOUT = float(os.environ.get("ROSARY_PG_POOL_TIMEOUT", "10"))
+DATABASES = {
+    alias: db_tuning.tune(
+        database,
+        sqlite={
+            'synchronous': ROSARY_SQLITE_SYNCHRONOUS,
+            'busy_timeout': ROSARY_SQLITE_BUSY_TIMEOUT,
+            'mmap_size': ROSARY_SQLITE_MMAP_SIZE,
+            'cache_size': ROSARY_SQLITE_CACHE_SIZE,
+        } if ROSARY_SQLITE_TUNING else None,
+        postgres_pool={
+            'min_size': ROSARY_PG_POOL_MIN_SIZE,
+            'max_size': ROSARY_PG_POOL_MAX_SIZE,
+            'timeout': ROSARY_PG_POOL_TIMEOUT,
+        } if ROSARY_PG_POOL else None,
+    )
+    for alias, database in DATABASES.items()
+}
+
 # --- Static Files ---
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# collectstatic fingerprints every file and writes .gz and .br (with Brotli
+# installed) copies; WhiteNoise serves fingerprinted names as immutable.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
 
 # --- Auth ---
 LOGIN_REDIRECT_URL = '/dashboard/'
@@ -109,3 +170,106 @@ USE_TZ = True
 
 # --- Default Auto Field ---
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# --- Activity Heartbeats ---
+# "sync" writes PrayerActivity during the request; "buffered" coalesces
+# heartbeats per user and writes them in bulk from a background thread.
+ROSARY_ACTIVITY_MODE = os.environ.get("ROSARY_ACTIVITY_MODE", "sync")
+# Seconds during which a user's last_active is considered fresh enough to skip a write.
+ROSARY_ACTIVITY_MIN_INTERVAL = int(os.environ.get("ROSARY_ACTIVITY_MIN_INTERVAL", "60"))
+ROSARY_ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("ROSARY_ACTIVITY_FLUSH_INTERVAL", "5"))
+ROSARY_ACTIVITY_BATCH_SIZE = int(os.environ.get("ROSARY_ACTIVITY_BATCH_SIZE", "500"))
+# Buffered users kept while writes fail; heartbeats past it are dropped and counted.
+ROSARY_ACTIVITY_MAX_PENDING = int(os.environ.get("ROSARY_ACTIVITY_MAX_PENDING", "10000"))
+
+# --- GeoIP ---
+# Swap for 'rosary.geo.StubResolver' to run without a MaxMind database.
+ROSARY_GEOIP_RESOLVER = os.environ.get("ROSARY_GEOIP_RESOLVER", "rosary.geo.GeoIPResolver")
+ROSARY_GEOIP_DB_PATH = os.environ.get("ROSARY_GEOIP_DB_PATH", str(BASE_DIR / "geo" / "GeoLite2-City.mmdb"))
+ROSARY_GEOIP_CACHE_SIZE = int(os.environ.get("ROSARY_GEOIP_CACHE_SIZE", "10000"))
+ROSARY_GEOIP_CACHE_TTL = int(os.environ.get("ROSARY_GEOIP_CACHE_TTL", "3600"))
+
+# --- Presence ---
+# Minutes of per-region presence kept in memory; must cover the longest live window.
+ROSARY_PRESENCE_HORIZON = int(os.environ.get("ROSARY_PRESENCE_HORIZON", "60"))
+# Seconds between reloads from PrayerActivity to pick up other workers' heartbeats.
+ROSARY_PRESENCE_REBUILD_INTERVAL = int(os.environ.get("ROSARY_PRESENCE_REBUILD_INTERVAL", "60"))
+# Per-worker counts by default; 'rosary.shared_presence.SharedPresenceRegistry'
+# shares them between all workers on a host through a memory-mapped file.
+ROSARY_PRESENCE_BACKEND = os.environ.get("ROSARY_PRESENCE_BACKEND", "rosary.presence.PresenceAggregator")
+# Defaults to a file in the temp directory keyed by the database name.
+ROSARY_PRESENCE_SHARED_PATH = os.environ.get("ROSARY_PRESENCE_SHARED_PATH", "")
+# Users tracked at once (rounded down to a power of two) and distinct regions.
+ROSARY_PRESENCE_SHARED_CAPACITY = int(os.environ.get("ROSARY_PRESENCE_SHARED_CAPACITY", "65536"))
+ROSARY_PRESENCE_SHARED_REGIONS = int(os.environ.get("ROSARY_PRESENCE_SHARED_REGIONS", "256"))
+
+# --- Heatmap Tiles ---
+# Deepest zoom binned; the map scales those tiles up when zoomed further in.
+ROSARY_HEATMAP_MAX_ZOOM = int(os.environ.get("ROSARY_HEATMAP_MAX_ZOOM", "8"))
+# Cells per tile side (a power of two): 32 gives 8px cells on 256px tiles.
+ROSARY_HEATMAP_TILE_BINS = int(os.environ.get("ROSARY_HEATMAP_TILE_BINS", "32"))
+ROSARY_HEATMAP_REBUILD_INTERVAL = int(os.environ.get("ROSARY_HEATMAP_REBUILD_INTERVAL", "30"))
+
+# --- Live Updates (Server-Sent Events, served under ASGI) ---
+ROSARY_LIVE_INTERVAL = float(os.environ.get("ROSARY_LIVE_INTERVAL", "5"))
+# Events buffered per client before a slow client is disconnected.
+ROSARY_LIVE_QUEUE_SIZE = int(os.environ.get("ROSARY_LIVE_QUEUE_SIZE", "16"))
+ROSARY_LIVE_KEEPALIVE = float(os.environ.get("ROSARY_LIVE_KEEPALIVE", "15"))
+ROSARY_LIVE_RETRY_MS = int(os.environ.get("ROSARY_LIVE_RETRY_MS", "15000"))
+
+# --- Compiled Sequences (rosary.sequence) ---
+# Seconds a worker may serve prayer text compiled before another worker's
+# admin edit; each worker checks the shared content version this often.
+ROSARY_SEQUENCE_VERSION_CHECK_INTERVAL = float(os.environ.get("ROSARY_SEQUENCE_VERSION_CHECK_INTERVAL", "5"))
+
+# --- Rosary Progress ---
+# Progress is kept in a signed cookie; checkpoints also persist it to the
+# database at decade boundaries for signed-in users.
+ROSARY_PROGRESS_MAX_AGE = int(os.environ.get("ROSARY_PROGRESS_MAX_AGE", str(60 * 60 * 24)))
+ROSARY_PROGRESS_CHECKPOINTS = os.environ.get("ROSARY_PROGRESS_CHECKPOINTS", "True").lower() in ("true", "1")
+
+# --- Offline Prayer ---
+# Rosaries completed offline are queued in the browser and uploaded in batches.
+ROSARY_COMPLETIONS_MAX_BATCH = int(os.environ.get("ROSARY_COMPLETIONS_MAX_BATCH", "50"))
+# Older queued completions are rejected rather than backdated.
+ROSARY_COMPLETIONS_MAX_AGE_DAYS = int(os.environ.get("ROSARY_COMPLETIONS_MAX_AGE_DAYS", "30"))
+
+# --- HTTP Caching ---
+# Part of every page ETag; set per deploy (Render provides the commit) so
+# browsers refetch pages after a release. Falls back to a per-process id.
+ROSARY_RELEASE = os.environ.get("ROSARY_RELEASE", os.environ.get("RENDER_GIT_COMMIT", ""))
+
+# --- Stats ---
+# Days of daily prayer counts charted on the stats page.
+ROSARY_STATS_DAYS = int(os.environ.get("ROSARY_STATS_DAYS", "365"))
+
+# --- Retention (manage.py apply_retention) ---
+# Activity rows for users unseen this many days are deleted.
+ROSARY_RETENTION_ACTIVITY_DAYS = int(os.environ.get("ROSARY_RETENTION_ACTIVITY_DAYS", "90"))
+# Sessions older than this are folded into MonthlyPrayerSummary and deleted.
+ROSARY_RETENTION_SESSION_DAYS = int(os.environ.get("ROSARY_RETENTION_SESSION_DAYS", "730"))
+ROSARY_RETENTION_CHUNK_SIZE = int(os.environ.get("ROSARY_RETENTION_CHUNK_SIZE", "1000"))
+# Seconds to sleep between chunks so live writers are not starved.
+ROSARY_RETENTION_PAUSE = float(os.environ.get("ROSARY_RETENTION_PAUSE", "0.1"))
+# Directory for gzipped NDJSON copies of deleted rows; empty disables archiving.
+ROSARY_RETENTION_ARCHIVE_DIR = os.environ.get("ROSARY_RETENTION_ARCHIVE_DIR", "")
+
+# --- Metrics (served at /metrics/) ---
+ROSARY_METRICS_ENABLED = os.environ.get("ROSARY_METRICS_ENABLED", "True").lower() in ("true", "1")
+# Share of requests that also count their queries and template time.
+ROSARY_METRICS_SAMPLE_RATE = float(os.environ.get("ROSARY_METRICS_SAMPLE_RATE", "1.0"))
+# Bearer token for scrapers; without one the endpoint is open to staff only.
+ROSARY_METRICS_TOKEN = os.environ.get("ROSARY_METRICS_TOKEN", "")
+
+# --- Slow Query Log (manage.py slow_queries) ---
+# Queries at or above this many milliseconds are logged with their EXPLAIN plan; 0 disables.
+ROSARY_SLOW_QUERY_MS = float(os.environ.get("ROSARY_SLOW_QUERY_MS", "250"))
+ROSARY_SLOW_QUERY_EXPLAIN = os.environ.get("ROSARY_SLOW_QUERY_EXPLAIN", "True").lower() in ("true", "1")
+# Entries kept in memory per process.
+ROSARY_SLOW_QUERY_BUFFER = int(os.environ.get("ROSARY_SLOW_QUERY_BUFFER", "200"))
+# NDJSON file shared by all workers, created owner-only; defaults to a private
+# directory for this user under the temp directory.
+ROSARY_SLOW_QUERY_LOG = os.environ.get("ROSARY_SLOW_QUERY_LOG", "")
+# Parameters can hold session keys and password hashes; logged only when enabled.
+ROSARY_SLOW_QUERY_LOG_PARAMS = os.environ.get("ROSARY_SLOW_QUERY_LOG_PARAMS", "False").lower() in ("true", "1")
+ROSARY_SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("ROSARY_SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
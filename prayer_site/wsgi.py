@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'prayer_site.settings')
 
 application = get_wsgi_application()
+
+# Prime the per-process caches before the first request; see rosary.warmup.
+from rosary import warmup  # noqa: E402
+
+warmup.warm_up()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RosaryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rosary'
+
+    def ready(self):
+        from . import signals  # noqa: F401
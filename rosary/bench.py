@@ -0,0 +1,340 @@
+"""
+Traffic replay benchmarks for the prayer flow and the live views.
+
+Scenarios drive either the in-process test client (with per-request query
+counts) or a running server over HTTP. Results are keyed by URL name and can
+be saved as JSON baselines and diffed against earlier runs.
+
+By default requests are replayed one at a time, so the rates are serial
+throughput: they show how latency adds up, not how much load the server
+takes. Against ``--base-url``, ``--concurrency`` splits the signed-in clients
+over that many threads, each replaying its share of the traffic, so the rates
+measure the server under concurrent load.
+"""
+import http.cookiejar
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+
+BENCH_PASSWORD = "bench-pass-123"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def url_name(path):
+    try:
+        return resolve(urllib.parse.urlsplit(path).path).url_name or path
+    except Resolver404:
+        return path
+
+
+class Recorder:
+    def __init__(self, concurrency=1):
+        self.concurrency = concurrency
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def add(self, path, status, elapsed, queries=None):
+        name = url_name(path)
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if queries is not None:
+                self.queries[name].append(queries)
+            if status >= 400:
+                self.errors[name] += 1
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        urls = {}
+        for name, latencies in sorted(self.latencies.items()):
+            queries = self.queries.get(name)
+            urls[name] = {
+                'requests': len(latencies),
+                'rps': len(latencies) / wall if wall else None,
+                'errors': self.errors.get(name, 0),
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'queries_per_request': sum(queries) / len(queries) if queries else None,
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            'wall_seconds': wall,
+            'requests': total,
+            'concurrency': self.concurrency,
+            'rps': total / wall if wall else None,
+            'urls': urls,
+        }
+
+
+class InProcessClient:
+    """Django test client that records latency and query counts per request."""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.client = Client()
+
+    def request(self, method, path, data=None, json_body=None):
+        kwargs = {}
+        if json_body is not None:
+            data = json.dumps(json_body)
+            kwargs['content_type'] = 'application/json'
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(self.client, method.lower())(path, data, **kwargs)
+            if getattr(response, 'streaming', False):
+                b"".join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        self.recorder.add(path, response.status_code, elapsed, len(captured))
+        return response.status_code, response.get('Location'), response.content if not response.streaming else b""
+
+    def login(self, username, password):
+        return self.client.login(username=username, password=password)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """Cookie-aware HTTP client against a running server; no query counts."""
+
+    def __init__(self, recorder, base_url):
+        self.recorder = recorder
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect()
+        )
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        return ''
+
+    def request(self, method, path, data=None, json_body=None):
+        url = self.base_url + path
+        headers = {}
+        body = None
+        if method == 'POST':
+            headers = {'X-CSRFToken': self._csrf_token(), 'Referer': url}
+            if json_body is not None:
+                body = json.dumps(json_body).encode()
+                headers['Content-Type'] = 'application/json'
+            else:
+                body = urllib.parse.urlencode(data or {}).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                status, location, content = response.status, response.headers.get('Location'), response.read()
+        except urllib.error.HTTPError as exc:
+            status, location, content = exc.code, exc.headers.get('Location'), exc.read()
+        self.recorder.add(path, status, time.perf_counter() - started)
+        return status, location, content
+
+    def login(self, username, password):
+        self.request('GET', '/accounts/login/')
+        status, _, _ = self.request(
+            'POST', '/accounts/login/', {'username': username, 'password': password}
+        )
+        return status == 302
+
+
+def walkthrough(client, **kwargs):
+    """Dashboard -> start -> the form-based flow, one bead at a time."""
+    client.request('GET', '/dashboard/')
+    client.request('POST', '/dashboard/')
+    client.request('GET', '/start/')
+    client.request('GET', '/pray/')
+    for _ in range(200):
+        status, _, content = client.request('GET', '/pray/flow/')
+        if status != 200 or b'completed the Rosary' in content:
+            break
+        client.request('POST', '/pray/flow/')
+
+
+def api_walkthrough(client, **kwargs):
+    """The JavaScript flow: one sequence fetch and a handful of progress syncs."""
+    client.request('POST', '/dashboard/')
+    client.request('GET', '/start/')
+    status, _, content = client.request('GET', '/pray/live/')
+    if status != 200:
+        return
+    marker = b'id="rosary-config" type="application/json">'
+    config = json.loads(content.split(marker, 1)[1].split(b'</script>', 1)[0])
+    _, _, payload = client.request('GET', config['sequenceUrl'])
+    total = json.loads(payload)['total']
+    for position in list(range(0, total, 13)) + [total]:
+        client.request('POST', config['progressUrl'], json_body={
+            'set_id': config['setId'], 'position': position,
+        })
+
+
+def heatmap_polling(client, polls=10, **kwargs):
+    client.request('GET', '/map/')
+    for _ in range(polls):
+        # The world at zoom 2 between roughly 67N and 67S.
+        for x in range(4):
+            for y in (1, 2):
+                client.request('GET', f'/map/tiles/2/{x}/{y}.json')
+        client.request('GET', '/active/')
+
+
+def stats(client, **kwargs):
+    client.request('GET', '/stats/')
+    client.request('GET', '/')
+
+
+def registration(client, sequence_number=0, **kwargs):
+    client.request('GET', '/register/')
+    username = f"bench-reg-{sequence_number}-{random.randrange(10 ** 9)}"
+    client.request('POST', '/register/', {
+        'username': username, 'password1': BENCH_PASSWORD, 'password2': BENCH_PASSWORD,
+    })
+
+
+SCENARIOS = {
+    'walkthrough': walkthrough,
+    'api': api_walkthrough,
+    'heatmap': heatmap_polling,
+    'stats': stats,
+    'register': registration,
+}
+DEFAULT_MIX = {'walkthrough': 1, 'api': 2, 'heatmap': 5, 'stats': 3, 'register': 1}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def run(make_client, usernames, mix, rounds, seed=0, concurrency=1):
+    """Replay ``rounds`` of the traffic mix, shuffled, one client per user.
+
+    With ``concurrency`` above one, client ``i`` is driven by thread
+    ``i % concurrency``, so no client is used by two threads at once.
+    """
+    if not 1 <= concurrency <= len(usernames):
+        raise ValueError("Concurrency must be between 1 and the number of users.")
+    random.seed(seed)
+    recorder = Recorder()
+    clients = []
+    for username in usernames:
+        client = make_client(recorder)
+        client.login(username, BENCH_PASSWORD)
+        clients.append(client)
+
+    plan = [name for name, weight in mix.items() for _ in range(weight)]
+    work = [[] for _ in range(concurrency)]
+    for round_number in range(rounds):
+        random.shuffle(plan)
+        for step, name in enumerate(plan):
+            index = (round_number + step) % len(clients)
+            work[index % concurrency].append((clients[index], name, round_number * len(plan) + step))
+
+    def replay(steps):
+        for client, name, sequence_number in steps:
+            SCENARIOS[name](client, sequence_number=sequence_number)
+
+    # Logins are setup, not traffic.
+    recorder = Recorder(concurrency)
+    for client in clients:
+        client.recorder = recorder
+    if concurrency == 1:
+        replay(work[0])
+    else:
+        threads = [threading.Thread(target=replay, args=(steps,)) for steps in work]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return recorder.summary()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(target):
+    return {
+        'revision': git_revision(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'target': target,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+    }
+
+
+def format_report(results, baseline=None):
+    header = (
+        f"{'url name':<24}{'reqs':>6}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'q/req':>7}"
+    )
+    lines = [header, '-' * len(header)]
+
+    def fmt(value, width):
+        return f"{value:>{width}.1f}" if value is not None else f"{'-':>{width}}"
+
+    for name, row in results['urls'].items():
+        line = (
+            f"{name:<24}{row['requests']:>6}{fmt(row['rps'], 8)}{fmt(row['p50_ms'], 9)}"
+            f"{fmt(row['p95_ms'], 9)}{fmt(row['p99_ms'], 9)}"
+            f"{fmt(row['mean_ms'], 9)}{fmt(row['queries_per_request'], 7)}"
+        )
+        old = (baseline or {}).get('results', {}).get('urls', {}).get(name)
+        if old and old.get('p95_ms'):
+            change = (row['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+            line += f"  p95 {change:+.0f}%"
+            if row['queries_per_request'] is not None and old.get('queries_per_request') is not None:
+                line += f" q {row['queries_per_request'] - old['queries_per_request']:+.1f}"
+        lines.append(line)
+    lines.append('-' * len(header))
+    if results['concurrency'] == 1:
+        pace = f"one at a time ({results['rps']:.1f} req/s serial)"
+    else:
+        pace = f"{results['concurrency']} at a time ({results['rps']:.1f} req/s)"
+    lines.append(f"{results['requests']} requests in {results['wall_seconds']:.2f}s, {pace}")
+    if baseline:
+        lines.append(f"compared with {baseline['meta'].get('revision')} recorded {baseline['meta'].get('recorded_at')}")
+    return '\n'.join(lines)
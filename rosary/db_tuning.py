@@ -0,0 +1,78 @@
+"""
+Per-backend connection tuning, applied to ``DATABASES`` from settings.py.
+
+SQLite connections run a set of pragmas when they are opened, through
+Django's ``init_command`` option:
+
+* WAL journaling, so readers no longer wait for the heartbeat writes;
+* ``synchronous=NORMAL``, which is durable under WAL except on power loss;
+* a busy timeout;
+* a memory-mapped read window and a larger page cache.
+
+Write transactions start ``IMMEDIATE``, so two writers queue on the busy
+timeout instead of failing when one of them upgrades a read lock.
+
+PostgreSQL connections use Django's connection pool (psycopg_pool) when it
+is installed, sized per worker process, with connections checked before
+they are handed out. Pooling replaces persistent connections, so
+``CONN_MAX_AGE`` drops to 0. Without the pool, persistent connections keep
+``CONN_HEALTH_CHECKS`` on instead.
+
+This module is imported by settings.py and must not import Django models.
+"""
+import importlib.util
+
+
+def sqlite_options(wal=True, synchronous='NORMAL', busy_timeout=5.0, mmap_size=0, cache_size=0,
+                   transaction_mode='IMMEDIATE'):
+    pragmas = []
+    if wal:
+        pragmas.append("PRAGMA journal_mode=WAL")
+    if synchronous:
+        pragmas.append(f"PRAGMA synchronous={synchronous}")
+    if mmap_size:
+        pragmas.append(f"PRAGMA mmap_size={int(mmap_size)}")
+    if cache_size:
+        pragmas.append(f"PRAGMA cache_size={int(cache_size)}")
+    options = {'timeout': busy_timeout, 'init_command': '; '.join(pragmas)}
+    if transaction_mode:
+        options['transaction_mode'] = transaction_mode
+    return options
+
+
+def pool_available():
+    return importlib.util.find_spec('psycopg_pool') is not None
+
+
+def postgres_pool_options(min_size=2, max_size=10, timeout=10.0, max_idle=300.0, max_lifetime=3600.0):
+    options = {
+        'min_size': min_size,
+        'max_size': max_size,
+        'timeout': timeout,
+        'max_idle': max_idle,
+        'max_lifetime': max_lifetime,
+    }
+    from psycopg_pool import ConnectionPool
+    if hasattr(ConnectionPool, 'check_connection'):  # psycopg_pool 3.2+
+        options['check'] = ConnectionPool.check_connection
+    return options
+
+
+def tune(database, sqlite=None, postgres_pool=None):
+    """Return a copy of one ``DATABASES`` entry with the options for its engine.
+
+    ``sqlite`` and ``postgres_pool`` are keyword arguments for
+    ``sqlite_options`` and ``postgres_pool_options``. None leaves that backend
+    alone. Options already present in the entry take precedence.
+    """
+    database = {**database, 'OPTIONS': dict(database.get('OPTIONS', {}))}
+    engine = database.get('ENGINE', '')
+    if engine.endswith('sqlite3') and sqlite is not None:
+        database['OPTIONS'] = {**sqlite_options(**sqlite), **database['OPTIONS']}
+    elif engine.endswith('postgresql'):
+        if postgres_pool is not None and pool_available():
+            database['OPTIONS'].setdefault('pool', postgres_pool_options(**postgres_pool))
+            database['CONN_MAX_AGE'] = 0
+        else:
+            database['CONN_HEALTH_CHECKS'] = True
+    return database
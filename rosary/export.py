@@ -0,0 +1,115 @@
+"""
+Streaming export of ``PrayerSession`` history as CSV or NDJSON.
+
+Rows are read with ``.iterator(chunk_size=...)`` and encoded one at a time
+into output chunks of about ``BUFFER_SIZE`` bytes, so memory stays flat
+however many sessions are exported. Used by the export views and
+``manage.py export_sessions``.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import sequence
+from .models import PrayerSession
+
+FIELDS = ('id', 'user_id', 'started_at', 'mystery_set_id', 'mystery_set', 'decades', 'completed')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+
+def parse_day(value):
+    """A ``YYYY-MM-DD`` filter value, or None when empty. Raises ValueError when invalid."""
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f"Invalid date {value!r}; expected YYYY-MM-DD.")
+    return day
+
+
+def parse_set(value):
+    """A mystery set id filter, or None when empty. Raises ValueError for an unknown set."""
+    if not value:
+        return None
+    try:
+        set_id = int(value)
+    except ValueError:
+        set_id = None
+    if set_id not in sequence.get_catalog().sets:
+        raise ValueError(f"Unknown mystery set {value!r}.")
+    return set_id
+
+
+def sessions(user=None, since=None, until=None, mystery_set_id=None):
+    """Sessions started on the local days from ``since`` to ``until`` inclusive, oldest first."""
+    queryset = PrayerSession.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if mystery_set_id is not None:
+        queryset = queryset.filter(mystery_set_id=mystery_set_id)
+    # Datetime bounds rather than __date lookups, so the started_at indexes apply.
+    if since is not None:
+        queryset = queryset.filter(started_at__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    if until is not None:
+        queryset = queryset.filter(
+            started_at__lt=timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min))
+        )
+    return queryset.order_by('started_at', 'id')
+
+
+def rows(queryset, chunk_size=CHUNK_SIZE):
+    set_names = sequence.get_catalog().sets
+    values = queryset.values_list('id', 'user_id', 'started_at', 'mystery_set_id', 'decades', 'completed')
+    for session_id, user_id, started_at, set_id, decades, completed in values.iterator(chunk_size=chunk_size):
+        yield (
+            session_id, user_id, started_at.isoformat(), set_id,
+            set_names.get(set_id, ''), decades, completed,
+        )
+
+
+class _Echo:
+    """A file-like object for ``csv.writer`` that hands back each line."""
+
+    def write(self, value):
+        return value
+
+
+def encode_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def encode_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(FIELDS, row)), separators=(',', ':')) + '\n'
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson}
+
+
+def _buffered(lines, size=BUFFER_SIZE):
+    """Join lines into chunks of roughly ``size`` bytes."""
+    buffer, length = [], 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer).encode()
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def stream(queryset, fmt, chunk_size=CHUNK_SIZE):
+    """Encoded byte chunks for ``queryset`` in ``fmt`` ('csv' or 'ndjson')."""
+    return _buffered(ENCODERS[fmt](rows(queryset, chunk_size)))
@@ -0,0 +1,159 @@
+"""
+IP -> (region, lat, lng) resolution for activity tracking.
+
+Resolvers keep a bounded LRU cache with a TTL in front of the actual lookup,
+so repeat visitors cost a dict hit. ``GeoIPResolver`` opens the MaxMind
+database lazily, memory-mapped, on the first miss; ``StubResolver`` answers
+from a fixed mapping and is meant for tests and local development.
+"""
+import abc
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Location(NamedTuple):
+    region: str
+    lat: Optional[float]
+    lng: Optional[float]
+
+
+UNKNOWN = Location("Unknown", None, None)
+
+
+class CachingResolver(abc.ABC):
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, ip):
+        if not ip:
+            return UNKNOWN
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(ip)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        started = time.perf_counter()
+        location = self.lookup(ip)
+        metrics.GEOIP_SECONDS.observe(time.perf_counter() - started)
+        with self._lock:
+            self._cache[ip] = (now + self.ttl, location)
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return location
+
+    @abc.abstractmethod
+    def lookup(self, ip):
+        """The ``Location`` of ``ip``, without caching."""
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+
+class GeoIPResolver(CachingResolver):
+    def __init__(self, db_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path or settings.ROSARY_GEOIP_DB_PATH
+        self._reader = None
+        self._unavailable = False
+        self._open_lock = threading.RLock()  # held again by _disable when open() fails
+
+    def open(self):
+        if self._reader is not None or self._unavailable:
+            return self._reader
+        with self._open_lock:
+            if self._reader is None and not self._unavailable:
+                try:
+                    import geoip2.database
+                    self._reader = geoip2.database.Reader(
+                        str(self.db_path), mode=geoip2.database.MODE_MMAP
+                    )
+                # A corrupt file raises maxminddb.InvalidDatabaseError, a
+                # RuntimeError, or a TypeError for unreadable metadata.
+                except (ImportError, OSError, ValueError, TypeError, RuntimeError) as exc:
+                    self._disable(exc)
+        return self._reader
+
+    def _disable(self, exc):
+        """Answer UNKNOWN from now on rather than retrying a broken database on every miss."""
+        with self._open_lock:
+            if self._unavailable:
+                return
+            # Dropped rather than closed: other threads may still be reading it.
+            self._unavailable = True
+            self._reader = None
+        logger.warning("GeoIP lookups disabled, cannot read %s: %s", self.db_path, exc)
+
+    def lookup(self, ip):
+        reader = self.open()
+        if reader is None:
+            return UNKNOWN
+        from geoip2.errors import GeoIP2Error
+        try:
+            geo = reader.city(ip)
+        except (GeoIP2Error, ValueError):
+            return UNKNOWN
+        except RuntimeError as exc:  # the database is corrupt past its header
+            self._disable(exc)
+            return UNKNOWN
+        region = geo.subdivisions.most_specific.name or geo.country.name or UNKNOWN.region
+        return Location(region, geo.location.latitude, geo.location.longitude)
+
+
+class StubResolver(CachingResolver):
+    def __init__(self, locations=None, default=UNKNOWN, **kwargs):
+        super().__init__(**kwargs)
+        self.locations = {ip: Location(*loc) for ip, loc in (locations or {}).items()}
+        self.default = default
+
+    def lookup(self, ip):
+        return self.locations.get(ip, self.default)
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                resolver_class = import_string(settings.ROSARY_GEOIP_RESOLVER)
+                _resolver = resolver_class(
+                    maxsize=settings.ROSARY_GEOIP_CACHE_SIZE,
+                    ttl=settings.ROSARY_GEOIP_CACHE_TTL,
+                )
+    return _resolver
+
+
+def set_resolver(resolver):
+    global _resolver
+    with _resolver_lock:
+        _resolver = resolver
+
+
+metrics.register_cache('geoip', lambda: get_resolver().stats())
@@ -0,0 +1,210 @@
+"""
+Activity heartbeats for ``TrackUserActivityMiddleware``.
+
+``SyncHeartbeatWriter`` writes ``PrayerActivity`` inline. ``BufferedHeartbeatWriter``
+coalesces heartbeats per user in memory and writes them in bulk from a
+background thread. Both skip users whose activity was refreshed less than
+``ROSARY_ACTIVITY_MIN_INTERVAL`` seconds ago.
+
+A buffered batch that fails to write is put back and retried with the next
+flush. While the database stays down the buffer holds at most
+``ROSARY_ACTIVITY_MAX_PENDING`` users; the oldest heartbeats beyond that are
+dropped and counted in ``rosary_heartbeats_dropped_total``.
+"""
+import abc
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics
+from .models import PrayerActivity
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat(NamedTuple):
+    region: str
+    lat: Optional[float]
+    lng: Optional[float]
+    last_active: datetime
+
+
+def write_heartbeats(heartbeats, batch_size):
+    """Upsert a ``{user_id: Heartbeat}`` mapping in batches."""
+    activities = [
+        PrayerActivity(user_id=user_id, **heartbeat._asdict())
+        for user_id, heartbeat in heartbeats.items()
+    ]
+    PrayerActivity.objects.bulk_create(
+        activities,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['region', 'lat', 'lng', 'last_active'],
+    )
+
+
+class HeartbeatWriter(abc.ABC):
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._refreshed = {}  # user_id -> monotonic time of the last accepted heartbeat
+        self._last_prune = time.monotonic()
+
+    def is_fresh(self, user_id):
+        refreshed = self._refreshed.get(user_id)
+        return refreshed is not None and time.monotonic() - refreshed < self.min_interval
+
+    def record(self, user_id, region, lat=None, lng=None, when=None):
+        if self.is_fresh(user_id):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._refreshed[user_id] = now
+            if now - self._last_prune > self.min_interval:
+                self._prune(now)
+        self.write(user_id, Heartbeat(region, lat, lng, when or timezone.now()))
+        return True
+
+    def _prune(self, now):
+        self._refreshed = {
+            user_id: refreshed for user_id, refreshed in self._refreshed.items()
+            if now - refreshed < self.min_interval
+        }
+        self._last_prune = now
+
+    @abc.abstractmethod
+    def write(self, user_id, heartbeat):
+        """Store or queue one accepted heartbeat."""
+
+    def flush(self):
+        return 0
+
+
+class SyncHeartbeatWriter(HeartbeatWriter):
+    def write(self, user_id, heartbeat):
+        write_heartbeats({user_id: heartbeat}, batch_size=1)
+
+
+class BufferedHeartbeatWriter(HeartbeatWriter):
+    def __init__(self, min_interval, flush_interval, batch_size, max_pending=10000):
+        super().__init__(min_interval)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def write(self, user_id, heartbeat):
+        with self._lock:
+            if user_id not in self._pending and len(self._pending) >= self.max_pending:
+                metrics.HEARTBEATS_DROPPED.inc()
+                return
+            self._pending[user_id] = heartbeat
+            pending = len(self._pending)
+        self._ensure_thread()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a pre-forked worker starts its own.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="rosary-heartbeat-flush", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush activity heartbeats")
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            write_heartbeats(pending, self.batch_size)
+        except Exception:
+            self._requeue(pending)
+            raise
+        return len(pending)
+
+    def _requeue(self, failed):
+        """Put back a batch that failed to write, under heartbeats queued since."""
+        with self._lock:
+            pending = {**failed, **self._pending}
+            dropped = len(pending) - self.max_pending
+            if dropped > 0:
+                for user_id in sorted(pending, key=lambda user_id: pending[user_id].last_active)[:dropped]:
+                    del pending[user_id]
+                metrics.HEARTBEATS_DROPPED.inc(amount=dropped)
+            self._pending = pending
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _build_writer()
+    return _writer
+
+
+def _build_writer():
+    mode = settings.ROSARY_ACTIVITY_MODE
+    if mode == "sync":
+        return SyncHeartbeatWriter(settings.ROSARY_ACTIVITY_MIN_INTERVAL)
+    if mode == "buffered":
+        return BufferedHeartbeatWriter(
+            settings.ROSARY_ACTIVITY_MIN_INTERVAL,
+            settings.ROSARY_ACTIVITY_FLUSH_INTERVAL,
+            settings.ROSARY_ACTIVITY_BATCH_SIZE,
+            settings.ROSARY_ACTIVITY_MAX_PENDING,
+        )
+    raise ImproperlyConfigured(
+        f"Unknown ROSARY_ACTIVITY_MODE {mode!r}; expected 'sync' or 'buffered'."
+    )
+
+
+@atexit.register
+def flush():
+    """Write out any buffered heartbeats, e.g. when a worker shuts down."""
+    writer = _writer
+    if writer is None:
+        return 0
+    return writer.flush()
+
+
+def reset():
+    global _writer
+    flush()
+    with _writer_lock:
+        _writer = None
@@ -0,0 +1,165 @@
+"""
+Server-Sent Events for live presence.
+
+A single ``Broadcaster`` per event loop reads the presence counts once per
+tick and fans the changes out to every connected client, so N open map tabs
+cost one aggregation per tick instead of N polls. Each client gets a bounded
+queue; a client that falls that far behind is disconnected and reconnects
+through EventSource with a fresh snapshot. A tick that fails is logged and
+skipped; clients keep their last state and get keepalives until the next one.
+
+Sync workers cannot hold a stream open and send one snapshot per reconnect
+instead; ``latest_snapshot`` shares one build per tick between those requests.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import presence
+
+logger = logging.getLogger(__name__)
+
+
+def build_snapshot():
+    """People active now in total and per region, and per region over the heatmap window."""
+    aggregator = presence.get_aggregator()
+    active = aggregator.counts(presence.ACTIVE_WINDOW_MINUTES)
+    regions = aggregator.counts(presence.HEATMAP_WINDOW_MINUTES)
+    return {
+        'active': sum(active.values()),
+        'active_regions': dict(active),
+        'regions': dict(regions),
+    }
+
+
+_latest = None  # (built at, snapshot)
+_latest_lock = threading.Lock()
+
+
+def latest_snapshot():
+    """``build_snapshot()``, reused for ``ROSARY_LIVE_INTERVAL`` seconds."""
+    global _latest
+    with _latest_lock:
+        if _latest is None or time.monotonic() - _latest[0] >= settings.ROSARY_LIVE_INTERVAL:
+            _latest = (time.monotonic(), build_snapshot())
+        return _latest[1]
+
+
+def reset():
+    global _latest
+    with _latest_lock:
+        _latest = None
+
+
+def diff_snapshots(previous, current):
+    """Changed values; per-region counts list only the regions that changed, 0 once gone."""
+    delta = {}
+    for key, value in current.items():
+        if isinstance(value, dict):
+            old = previous.get(key, {})
+            changed = {
+                region: value.get(region, 0)
+                for region in old.keys() | value.keys()
+                if old.get(region) != value.get(region)
+            }
+            if changed:
+                delta[key] = changed
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def encode_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Broadcaster:
+    def __init__(self, interval, queue_size):
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._snapshot = None
+        self._task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        if self._snapshot is not None:
+            queue.put_nowait(encode_event('snapshot', self._snapshot))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _run(self):
+        try:
+            while self._subscribers:
+                try:
+                    snapshot = await sync_to_async(build_snapshot)()
+                except Exception:
+                    logger.exception("Live presence snapshot failed; retrying next tick")
+                    await asyncio.sleep(self.interval)
+                    continue
+                if self._snapshot is None:
+                    self.publish(encode_event('snapshot', snapshot))
+                else:
+                    delta = diff_snapshots(self._snapshot, snapshot)
+                    if delta:
+                        self.publish(encode_event('delta', delta))
+                self._snapshot = snapshot
+                await asyncio.sleep(self.interval)
+        finally:
+            # Idle broadcasters forget their state; the next subscriber starts fresh.
+            self._snapshot = None
+
+
+_broadcasters = {}
+
+
+def get_broadcaster():
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        for stale in [other for other in _broadcasters if other.is_closed()]:
+            del _broadcasters[stale]
+        broadcaster = _broadcasters[loop] = Broadcaster(
+            settings.ROSARY_LIVE_INTERVAL, settings.ROSARY_LIVE_QUEUE_SIZE
+        )
+    return broadcaster
+
+
+async def event_stream(broadcaster, keepalive):
+    queue = broadcaster.subscribe()
+    try:
+        yield f"retry: {settings.ROSARY_LIVE_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                break
+            yield event
+    finally:
+        broadcaster.unsubscribe(queue)
@@ -0,0 +1,83 @@
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rosary import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stale prayer activity and compact old prayer sessions into monthly summaries, "
+        "in small throttled chunks. Defaults come from the ROSARY_RETENTION_* settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change and exit")
+        parser.add_argument(
+            '--activity-days', type=int, default=settings.ROSARY_RETENTION_ACTIVITY_DAYS,
+            help="Delete activity for users unseen this many days (default: %(default)s)",
+        )
+        parser.add_argument(
+            '--session-days', type=int, default=settings.ROSARY_RETENTION_SESSION_DAYS,
+            help="Compact sessions older than this many days (default: %(default)s)",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.ROSARY_RETENTION_CHUNK_SIZE,
+            help="Rows deleted per transaction (default: %(default)s)",
+        )
+        parser.add_argument(
+            '--pause', type=float, default=settings.ROSARY_RETENTION_PAUSE,
+            help="Seconds to sleep between chunks (default: %(default)s)",
+        )
+        parser.add_argument(
+            '--archive-dir', default=settings.ROSARY_RETENTION_ARCHIVE_DIR,
+            help="Write deleted rows to gzipped NDJSON files in this directory",
+        )
+        parser.add_argument('--skip-activity', action='store_true', help="Leave PrayerActivity alone")
+        parser.add_argument('--skip-sessions', action='store_true', help="Leave PrayerSession alone")
+
+    def handle(self, *args, dry_run, activity_days, session_days, chunk_size, pause, archive_dir,
+               skip_activity, skip_sessions, **options):
+        now = timezone.now()
+        activity_cutoff = now - timedelta(days=activity_days)
+        session_cutoff = now - timedelta(days=session_days)
+
+        if dry_run:
+            plan = retention.report(activity_cutoff, session_cutoff)
+            if not skip_activity:
+                self.stdout.write(
+                    f"Would delete {plan['activity']} activity row(s) last seen before {activity_cutoff:%Y-%m-%d}"
+                )
+            if not skip_sessions:
+                self.stdout.write(
+                    f"Would compact {plan['sessions']} session(s) started before {session_cutoff:%Y-%m-%d} "
+                    f"into {plan['summaries']} monthly summary row(s)"
+                )
+                if plan['sessions_pending_rollup']:
+                    self.stdout.write(self.style.WARNING(
+                        f"{plan['sessions_pending_rollup']} older session(s) are not rolled up yet and will be "
+                        "kept; run reconcile_rollups first"
+                    ))
+            return
+
+        with ExitStack() as stack:
+            def archive(name):
+                if not archive_dir:
+                    return None
+                return stack.enter_context(retention.Archive(archive_dir, name))
+
+            if not skip_activity:
+                activity_archive = archive('activity')
+                deleted = retention.prune_activity(activity_cutoff, chunk_size, pause, activity_archive)
+                self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} stale activity row(s)"))
+                if deleted and activity_archive:
+                    self.stdout.write(f"Archived to {activity_archive.path}")
+            if not skip_sessions:
+                session_archive = archive('sessions')
+                compacted = retention.compact_sessions(session_cutoff, chunk_size, pause, session_archive)
+                self.stdout.write(self.style.SUCCESS(f"Compacted {compacted} session(s) into monthly summaries"))
+                if compacted and session_archive:
+                    self.stdout.write(f"Archived to {session_archive.path}")
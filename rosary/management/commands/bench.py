@@ -0,0 +1,94 @@
+import io
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from rosary import bench
+
+
+class Command(BaseCommand):
+    help = "Replay realistic traffic against the prayer flow and live views and report latency per URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mix', default=','.join(f"{name}={weight}" for name, weight in bench.DEFAULT_MIX.items()),
+            help="Scenario weights per round, e.g. 'walkthrough=1,heatmap=5' "
+                 f"(scenarios: {', '.join(bench.SCENARIOS)})",
+        )
+        parser.add_argument('--rounds', type=int, default=3, help="Times the mix is replayed (default: 3)")
+        parser.add_argument('--users', type=int, default=5, help="Signed-in clients sharing the traffic (default: 5)")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the traffic order")
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help="Threads replaying traffic at once, at most --users; needs --base-url (default: 1)",
+        )
+        parser.add_argument(
+            '--base-url',
+            help="Benchmark a running server over HTTP instead of the in-process client. "
+                 "Bench users are registered through the site; query counts are not available.",
+        )
+        parser.add_argument('--output', help="Save the results as a JSON baseline")
+        parser.add_argument('--compare', help="Show p95 and query changes against a saved baseline")
+
+    def handle(self, *args, mix, rounds, users, seed, concurrency, base_url, output, compare, **options):
+        try:
+            mix = bench.parse_mix(mix)
+        except ValueError as exc:
+            raise CommandError(exc)
+        if not 1 <= concurrency <= users:
+            raise CommandError("--concurrency must be between 1 and --users.")
+        if concurrency > 1 and not base_url:
+            # The test client runs in this interpreter against the test database.
+            raise CommandError("--concurrency needs --base-url; in-process runs are serial.")
+        baseline = None
+        if compare:
+            with open(compare) as fh:
+                baseline = json.load(fh)
+
+        usernames = [f"bench-user-{i}" for i in range(users)]
+        if base_url:
+            results = self.run_http(base_url, usernames, mix, rounds, seed, concurrency)
+        else:
+            results = self.run_in_process(usernames, mix, rounds, seed)
+
+        report = {'meta': bench.metadata(base_url or 'in-process'), 'results': results}
+        self.stdout.write(bench.format_report(results, baseline))
+        if output:
+            with open(output, 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {output}"))
+
+    def run_in_process(self, usernames, mix, rounds, seed):
+        # Always run against throwaway test databases, never the configured ones.
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            # Plain static storage: the in-process run must not depend on collectstatic.
+            storages = {
+                **settings.STORAGES,
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            }
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], STORAGES=storages):
+                call_command('seed_rosary_data', stdout=io.StringIO())
+                call_command('seed_activity', stdout=io.StringIO())
+                for username in usernames:
+                    User.objects.create_user(username, password=bench.BENCH_PASSWORD)
+                return bench.run(bench.InProcessClient, usernames, mix, rounds, seed)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_http(self, base_url, usernames, mix, rounds, seed, concurrency):
+        for username in usernames:
+            client = bench.HTTPClient(bench.Recorder(), base_url)
+            client.request('GET', '/register/')
+            client.request('POST', '/register/', {
+                'username': username,
+                'password1': bench.BENCH_PASSWORD,
+                'password2': bench.BENCH_PASSWORD,
+            })
+        return bench.run(
+            lambda recorder: bench.HTTPClient(recorder, base_url), usernames, mix, rounds, seed, concurrency,
+        )
@@ -0,0 +1,177 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import dj_database_url
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from rosary import db_tuning
+from rosary.bench import percentile
+from rosary.models import PrayerActivity
+
+ALIAS = 'bench_db'
+PROFILES = ('baseline', 'tuned')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent heartbeat writes and presence reads on a scratch database, "
+        "with the default connection options and with rosary.db_tuning applied"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help="Writer threads (default: %(default)s)")
+        parser.add_argument('--readers', type=int, default=4, help="Reader threads (default: %(default)s)")
+        parser.add_argument('--seconds', type=float, default=5, help="Duration per profile (default: %(default)s)")
+        parser.add_argument('--users', type=int, default=500, help="Users with activity rows (default: %(default)s)")
+        parser.add_argument(
+            '--url',
+            help="Scratch database URL; its rosary tables are written to. "
+                 "Default: a new temporary SQLite file per profile.",
+        )
+
+    def handle(self, *args, writers, readers, seconds, users, url, **options):
+        if writers < 1 and readers < 1:
+            raise CommandError("Nothing to run: --writers and --readers are both 0")
+        self.users = users
+        self.stdout.write(f"{'profile':<10} {'writes/s':>9} {'reads/s':>9} {'write p95':>10} "
+                          f"{'read p95':>9} {'errors':>7}")
+        for profile in PROFILES:
+            with self.scratch_database(url, profile) as user_ids:
+                result = self.run(user_ids, writers, readers, seconds)
+            self.stdout.write(
+                f"{profile:<10} {result['writes'] / seconds:>9.1f} {result['reads'] / seconds:>9.1f} "
+                f"{self.ms(result['write_p95']):>10} {self.ms(result['read_p95']):>9} {result['errors']:>7}"
+            )
+            for message, count in sorted(result['error_messages'].items()):
+                self.stdout.write(f"  {count} x {message}")
+
+    @staticmethod
+    def ms(seconds):
+        return '-' if seconds is None else f"{seconds * 1000:.1f}ms"
+
+    def config(self, url, profile, path):
+        database = dj_database_url.parse(url) if url else {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': path,
+        }
+        if profile == 'baseline':
+            # What DATABASES held before tuning: library defaults and persistent connections.
+            if database['ENGINE'].endswith('sqlite3'):
+                database['OPTIONS'] = {'init_command': "PRAGMA journal_mode=DELETE"}
+            return database
+        return db_tuning.tune(
+            database,
+            sqlite={
+                'synchronous': settings.ROSARY_SQLITE_SYNCHRONOUS,
+                'busy_timeout': settings.ROSARY_SQLITE_BUSY_TIMEOUT,
+                'mmap_size': settings.ROSARY_SQLITE_MMAP_SIZE,
+                'cache_size': settings.ROSARY_SQLITE_CACHE_SIZE,
+            },
+            postgres_pool={
+                'min_size': settings.ROSARY_PG_POOL_MIN_SIZE,
+                'max_size': settings.ROSARY_PG_POOL_MAX_SIZE,
+                'timeout': settings.ROSARY_PG_POOL_TIMEOUT,
+            },
+        )
+
+    @contextmanager
+    def scratch_database(self, url, profile):
+        path = None
+        if not url:
+            fd, path = tempfile.mkstemp(prefix='rosary-bench-', suffix='.sqlite3')
+            os.close(fd)
+        database = self.config(url, profile, path)
+        connections.settings[ALIAS] = connections.configure_settings({
+            'default': settings.DATABASES['default'], ALIAS: database,
+        })[ALIAS]
+        try:
+            call_command('migrate', database=ALIAS, verbosity=0)
+            yield self.seed()
+        finally:
+            connection = connections[ALIAS]
+            connection.close()
+            if hasattr(connection, 'close_pool'):
+                connection.close_pool()
+            del connections[ALIAS]
+            del connections.settings[ALIAS]
+            for suffix in ('', '-wal', '-shm', '-journal') if path else ():
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def seed(self):
+        users = User.objects.using(ALIAS)
+        users.filter(username__startswith='bench-db-').delete()
+        users.bulk_create([User(username=f"bench-db-{i}") for i in range(self.users)])
+        user_ids = list(users.filter(username__startswith='bench-db-').values_list('pk', flat=True))
+        now = timezone.now()
+        PrayerActivity.objects.using(ALIAS).bulk_create([
+            PrayerActivity(user_id=user_id, region=f"Region {user_id % 20}", last_active=now)
+            for user_id in user_ids
+        ])
+        connections[ALIAS].close()
+        return user_ids
+
+    def run(self, user_ids, writers, readers, seconds):
+        lock = threading.Lock()
+        result = {'writes': 0, 'reads': 0, 'errors': 0, 'error_messages': {}}
+        timings = {'write': [], 'read': []}
+        deadline = time.monotonic() + seconds
+
+        def write(rng):
+            user_id = rng.choice(user_ids)
+            with transaction.atomic(using=ALIAS):
+                # The same upsert as heartbeat.write_heartbeats.
+                PrayerActivity.objects.using(ALIAS).bulk_create(
+                    [PrayerActivity(user_id=user_id, region=f"Region {rng.randrange(20)}",
+                                    last_active=timezone.now())],
+                    update_conflicts=True,
+                    unique_fields=['user'],
+                    update_fields=['region', 'lat', 'lng', 'last_active'],
+                )
+
+        def read(rng):
+            # The presence rebuild: active users per region in the window.
+            since = timezone.now() - timedelta(minutes=5)
+            list(PrayerActivity.objects.using(ALIAS).filter(last_active__gte=since)
+                 .values('region').annotate(count=Count('id')))
+
+        def worker(kind, operation, seed):
+            rng = random.Random(seed)
+            samples, errors = [], {}
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    operation(rng)
+                except OperationalError as exc:
+                    errors[str(exc)] = errors.get(str(exc), 0) + 1
+                else:
+                    samples.append(time.perf_counter() - started)
+                finally:
+                    # End of request: close, or hand back to the pool.
+                    connections[ALIAS].close()
+            with lock:
+                result[f'{kind}s'] += len(samples)
+                timings[kind].extend(samples)
+                for message, count in errors.items():
+                    result['errors'] += count
+                    result['error_messages'][message] = result['error_messages'].get(message, 0) + count
+
+        threads = [threading.Thread(target=worker, args=('write', write, i)) for i in range(writers)]
+        threads += [threading.Thread(target=worker, args=('read', read, 1000 + i)) for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result['write_p95'] = percentile(timings['write'], 95)
+        result['read_p95'] = percentile(timings['read'], 95)
+        return result
@@ -0,0 +1,49 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import compress_sequence
+
+from rosary import export
+
+
+class Command(BaseCommand):
+    help = "Stream prayer sessions as CSV or NDJSON, oldest first"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='fmt', choices=sorted(export.CONTENT_TYPES), default='csv')
+        parser.add_argument('--since', help="First day to include, YYYY-MM-DD")
+        parser.add_argument('--until', help="Last day to include, YYYY-MM-DD")
+        parser.add_argument('--user', help="Only this username's sessions")
+        parser.add_argument('--set', dest='mystery_set', help="Only sessions of this mystery set id")
+        parser.add_argument('--output', help="File to write (default: stdout)")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip")
+        parser.add_argument(
+            '--chunk-size', type=int, default=export.CHUNK_SIZE,
+            help="Rows fetched from the database at a time (default: %(default)s)",
+        )
+
+    def handle(self, *args, fmt, since, until, user, mystery_set, output, gzip, chunk_size, **options):
+        try:
+            since, until = export.parse_day(since), export.parse_day(until)
+            mystery_set = export.parse_set(mystery_set)
+        except ValueError as exc:
+            raise CommandError(exc)
+        if user is not None:
+            try:
+                user = User.objects.get(username=user)
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {user!r}")
+
+        chunks = export.stream(export.sessions(user, since, until, mystery_set), fmt, chunk_size)
+        if gzip:
+            chunks = compress_sequence(chunks)
+        destination = open(output, 'wb') if output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                destination.write(chunk)
+        finally:
+            if output:
+                destination.close()
+            else:
+                destination.flush()
@@ -0,0 +1,184 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from rosary import rollups
+from rosary.management.commands.seed_activity import REGIONS
+from rosary.models import (
+    DailyPrayerCount, MysterySet, PrayerActivity, PrayerSession, RollupWatermark,
+    UserDailyPrayerCount,
+)
+
+PASSWORD = "synthetic-pass-123"
+ALL_DECADES = 0b11111
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def insert_rows(model, fields, rows, batch_size):
+    """INSERT plain tuples with executemany, skipping model instances.
+
+    Building and compiling a model instance per row costs far more than the
+    write itself at hundreds of millions of sessions; values must already be
+    in database form.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})"
+    count = 0
+    with connection.cursor() as cursor:
+        for batch in batched(rows, batch_size):
+            cursor.executemany(sql, batch)
+            count += len(batch)
+    return count
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a large synthetic dataset of users, prayer activity and prayer sessions. "
+        "Rows are streamed in chunks, so memory stays flat however many users are asked for. "
+        "Safe to re-run: existing users are reused and only users without sessions get new ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help="Number of synthetic users (default: 10000)")
+        parser.add_argument(
+            '--sessions-per-user', type=int, default=20,
+            help="Prayer sessions generated for each user (default: 20)",
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help="Spread sessions and last activity over this many past days (default: 365)",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Users written per transaction (default: 1000)",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Rows per INSERT statement (default: 5000)",
+        )
+        parser.add_argument('--prefix', default='synthetic', help="Username prefix (default: synthetic)")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+
+    def handle(self, *args, users, sessions_per_user, days, chunk_size, batch_size, prefix, seed, **options):
+        if users < 1 or chunk_size < 1 or batch_size < 1 or days < 1 or sessions_per_user < 0:
+            raise CommandError("--users, --days, --chunk-size and --batch-size must be positive")
+        rng = random.Random(seed)
+        # Hashing is deliberately slow; every synthetic user shares one hash.
+        password = make_password(PASSWORD)
+        mystery_sets = list(MysterySet.objects.values_list('id', flat=True)) or [None]
+        today = timezone.localdate()
+        day_starts = [rollups.day_bounds(today - timedelta(days=offset)) for offset in range(days)]
+
+        watermark, _ = RollupWatermark.objects.get_or_create(name=rollups.SESSION_WATERMARK)
+        last_session_id = PrayerSession.objects.aggregate(last=Max('id'))['last'] or 0
+        rollups_current = watermark.last_session_id >= last_session_id
+
+        daily = Counter()
+        created_sessions = 0
+        started = time.monotonic()
+        for first in range(0, users, chunk_size):
+            usernames = [f"{prefix}-{i:09d}" for i in range(first, min(first + chunk_size, users))]
+            with transaction.atomic():
+                created_sessions += self.write_chunk(
+                    usernames, password, rng, mystery_sets, day_starts, sessions_per_user, batch_size, daily,
+                )
+            done = first + len(usernames)
+            self.stdout.write(
+                f"{done}/{users} users, {created_sessions} sessions ({time.monotonic() - started:.0f}s)"
+            )
+
+        with transaction.atomic():
+            for day, count in daily.items():
+                rows = DailyPrayerCount.objects.filter(day=day)
+                if not rows.update(count=F('count') + count, updated_at=timezone.now()):
+                    DailyPrayerCount.objects.create(day=day, count=count)
+            # The rollups were written alongside the sessions. Only move the watermark
+            # when nothing older was waiting; otherwise reconcile_rollups recomputes.
+            if rollups_current:
+                RollupWatermark.objects.filter(pk=watermark.pk).update(
+                    last_session_id=PrayerSession.objects.aggregate(last=Max('id'))['last'] or 0,
+                    updated_at=timezone.now(),
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {users} users and {created_sessions} sessions in {time.monotonic() - started:.0f}s"
+        ))
+
+    def write_chunk(self, usernames, password, rng, mystery_sets, day_starts, sessions_per_user, batch_size, daily):
+        User.objects.bulk_create(
+            [User(username=username, password=password) for username in usernames],
+            ignore_conflicts=True, batch_size=batch_size,
+        )
+        # Usernames are zero-padded, so the chunk is one range scan of the unique index.
+        user_ids = list(
+            User.objects.filter(username__range=(usernames[0], usernames[-1]))
+            .order_by('username').values_list('id', flat=True)
+        )
+
+        now = timezone.now()
+        horizon = len(day_starts) * 24 * 60
+        activity = []
+        for user_id in user_ids:
+            region, lat, lng = rng.choice(REGIONS)
+            activity.append(PrayerActivity(
+                user_id=user_id, region=region, lat=lat, lng=lng,
+                last_active=now - timedelta(minutes=rng.randrange(horizon)),
+            ))
+        PrayerActivity.objects.bulk_create(
+            activity, batch_size=batch_size, update_conflicts=True, unique_fields=['user'],
+            update_fields=['region', 'lat', 'lng', 'last_active'],
+        )
+
+        if not sessions_per_user:
+            return 0
+        seeded = set(
+            PrayerSession.objects.filter(user_id__gte=min(user_ids), user_id__lte=max(user_ids))
+            .values_list('user_id', flat=True).distinct()
+        )
+        per_user = Counter()
+        adapt = connection.ops.adapt_datetimefield_value
+
+        def sessions():
+            for user_id in user_ids:
+                if user_id in seeded:
+                    continue
+                for _ in range(sessions_per_user):
+                    day_start, _ = rng.choice(day_starts)
+                    mystery_set_id = rng.choice(mystery_sets)
+                    per_user[user_id, day_start, mystery_set_id] += 1
+                    started_at = adapt(day_start + timedelta(seconds=rng.randrange(86400)))
+                    yield user_id, mystery_set_id, ALL_DECADES, True, started_at
+
+        created = insert_rows(
+            PrayerSession, ['user', 'mystery_set', 'decades', 'completed', 'started_at'], sessions(), batch_size,
+        )
+
+        updated_at = adapt(timezone.now())
+        days = {day_start: timezone.localdate(day_start) for day_start, _ in day_starts}
+        for (_, day_start, _), count in per_user.items():
+            daily[days[day_start]] += count
+        insert_rows(
+            UserDailyPrayerCount, ['user', 'day', 'mystery_set', 'count', 'updated_at'],
+            (
+                (user_id, connection.ops.adapt_datefield_value(days[day_start]), mystery_set_id, count, updated_at)
+                for (user_id, day_start, mystery_set_id), count in per_user.items()
+            ),
+            batch_size,
+        )
+        return created
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rosary import rollups
+
+
+class Command(BaseCommand):
+    help = "Backfill and reconcile the daily prayer rollups from PrayerSession rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Sessions read per transaction (default: 1000)",
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Drop all rollups and rebuild them from the first session; "
+                 "refused once apply_retention has compacted sessions",
+        )
+
+    def handle(self, *args, chunk_size, full, **kwargs):
+        try:
+            sessions, days = rollups.reconcile(chunk_size=chunk_size, full=full)
+        except rollups.CompactedHistory as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {days} day(s) from {sessions} new session(s)"
+        ))
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import transaction
 from rosary.models import PrayerActivity
 from django.utils.timezone import now, timedelta
 import random
@@ -21,20 +23,28 @@ class Command(BaseCommand):
     help = "Seed prayer activity with fake user locations"
 
     def handle(self, *args, **kwargs):
-        for i, (region, lat, lng) in enumerate(REGIONS):
-            username = f"testuser{i+1}"
-            user, created = User.objects.get_or_create(username=username)
-            if created:
-                user.set_password("testpass123")
-                user.save()
-
-            PrayerActivity.objects.update_or_create(
-                user=user,
-                defaults={
-                    'region': region,
-                    'lat': lat,
-                    'lng': lng,
-                    'last_active': now() - timedelta(minutes=random.randint(1, 14)),
-                }
+        usernames = [f"testuser{i+1}" for i in range(len(REGIONS))]
+        # One hash for every new user; existing users keep their password.
+        password = make_password("testpass123")
+        with transaction.atomic():
+            User.objects.bulk_create(
+                [User(username=username, password=password) for username in usernames],
+                ignore_conflicts=True,
+            )
+            user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+            PrayerActivity.objects.bulk_create(
+                [
+                    PrayerActivity(
+                        user_id=user_ids[username],
+                        region=region,
+                        lat=lat,
+                        lng=lng,
+                        last_active=now() - timedelta(minutes=random.randint(1, 14)),
+                    )
+                    for username, (region, lat, lng) in zip(usernames, REGIONS)
+                ],
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['region', 'lat', 'lng', 'last_active'],
             )
-        self.stdout.write(self.style.SUCCESS("Seeded 10 fake prayer activities"))
+        self.stdout.write(self.style.SUCCESS(f"Seeded {len(REGIONS)} fake prayer activities"))
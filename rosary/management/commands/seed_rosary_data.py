@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
-from django.utils.timezone import now
+from django.db import transaction
+
+from rosary import sequence
 from rosary.models import Prayer, MysterySet, Mystery, DecadeStep, PrayerSequence, PrayerSequenceStep
 
 
@@ -92,74 +94,90 @@ MYSTERY_SETS = {
     }
 }
 
+DECADE_STEPS = [
+    ("Our Father", 1),
+    ("Hail Mary", 10),
+    ("Glory Be", 1),
+    ("Fatima Prayer", 1),
+]
+
+SEQUENCES = {
+    sequence.INTRO_SEQUENCE: [
+        ("Sign of the Cross", 1),
+        ("Apostles' Creed", 1),
+        ("Our Father", 1),
+        ("Hail Mary", 3),
+        ("Glory Be", 1),
+        ("Fatima Prayer", 1),
+    ],
+    sequence.CONCLUSION_SEQUENCE: [
+        ("Hail Holy Queen", 1),
+        ("Closing Prayer", 1),
+        ("Sign of the Cross", 1),
+    ],
+}
+
 class Command(BaseCommand):
     help = "Seeds the Rosary prayers and mysteries using full text."
 
     def handle(self, *args, **kwargs):
-        # Create all base prayers
-        prayer_objs = {}
-        for name, text in PRAYERS.items():
-            prayer, _ = Prayer.objects.get_or_create(name=name, defaults={"text": text})
-            prayer_objs[name] = prayer
-
-        self.stdout.write(self.style.SUCCESS("✅ Core prayers created."))
+        # Every table is written with one bulk insert. Existing prayers, sets and
+        # mysteries are kept as they are; the steps are brought back in line.
+        with transaction.atomic():
+            Prayer.objects.bulk_create(
+                [Prayer(name=name, text=text) for name, text in PRAYERS.items()],
+                ignore_conflicts=True,
+            )
+            prayer_ids = dict(Prayer.objects.filter(name__in=PRAYERS).values_list('name', 'id'))
 
-        # Create Mystery Sets and their Mysteries
-        for set_name, set_data in MYSTERY_SETS.items():
-            mystery_set, _ = MysterySet.objects.get_or_create(name=set_name, defaults={"days": set_data["days"]})
+            MysterySet.objects.bulk_create(
+                [MysterySet(name=name, days=data["days"]) for name, data in MYSTERY_SETS.items()],
+                ignore_conflicts=True,
+            )
+            set_ids = dict(MysterySet.objects.filter(name__in=MYSTERY_SETS).values_list('name', 'id'))
 
-            for idx, (title, reference) in enumerate(set_data["mysteries"], start=1):
-                mystery, _ = Mystery.objects.get_or_create(
-                    set=mystery_set,
-                    title=title,
-                    defaults={"scripture_reference": reference}
-                )
+            Mystery.objects.bulk_create(
+                [
+                    Mystery(set_id=set_ids[set_name], title=title, scripture_reference=reference)
+                    for set_name, data in MYSTERY_SETS.items()
+                    for title, reference in data["mysteries"]
+                ],
+                ignore_conflicts=True,
+            )
+            mystery_ids = Mystery.objects.filter(set_id__in=set_ids.values()).values_list('id', flat=True)
 
-                # Add decade structure
-                DecadeStep.objects.update_or_create(
-                    mystery=mystery, order=1,
-                    defaults={"prayer": prayer_objs["Our Father"], "repeat": 1}
-                )
-                DecadeStep.objects.update_or_create(
-                    mystery=mystery, order=2,
-                    defaults={"prayer": prayer_objs["Hail Mary"], "repeat": 10}
-                )
-                DecadeStep.objects.update_or_create(
-                    mystery=mystery, order=3,
-                    defaults={"prayer": prayer_objs["Glory Be"], "repeat": 1}
-                )
-                DecadeStep.objects.update_or_create(
-                    mystery=mystery, order=4,
-                    defaults={"prayer": prayer_objs["Fatima Prayer"], "repeat": 1}
-                )
-                        # Introductory sequence
-        intro_sequence, _ = PrayerSequence.objects.get_or_create(name="Introductory Prayers")
-        intro_steps = [
-            ("Sign of the Cross", 1),
-            ("Apostles' Creed", 1),
-            ("Our Father", 1),
-            ("Hail Mary", 3),
-            ("Glory Be", 1),
-            ("Fatima Prayer", 1)
-        ]
-        for order, (prayer_name, repeat) in enumerate(intro_steps, start=1):
-            PrayerSequenceStep.objects.update_or_create(
-                sequence=intro_sequence, order=order,
-                defaults={"prayer": prayer_objs[prayer_name], "repeat": repeat}
+            DecadeStep.objects.bulk_create(
+                [
+                    DecadeStep(mystery_id=mystery_id, order=order, prayer_id=prayer_ids[name], repeat=repeat)
+                    for mystery_id in mystery_ids
+                    for order, (name, repeat) in enumerate(DECADE_STEPS, start=1)
+                ],
+                update_conflicts=True,
+                unique_fields=['mystery', 'order'],
+                update_fields=['prayer', 'repeat'],
             )
+        self.stdout.write(self.style.SUCCESS("✅ Core prayers created."))
 
-        # Concluding sequence
-        conclusion_sequence, _ = PrayerSequence.objects.get_or_create(name="Concluding Prayers")
-        conclusion_steps = [
-            ("Hail Holy Queen", 1),
-            ("Closing Prayer", 1),
-            ("Sign of the Cross", 1)
-        ]
-        for order, (prayer_name, repeat) in enumerate(conclusion_steps, start=1):
-            PrayerSequenceStep.objects.update_or_create(
-                sequence=conclusion_sequence, order=order,
-                defaults={"prayer": prayer_objs[prayer_name], "repeat": repeat}
+        with transaction.atomic():
+            PrayerSequence.objects.bulk_create(
+                [PrayerSequence(name=name) for name in SEQUENCES],
+                ignore_conflicts=True,
+            )
+            sequence_ids = dict(PrayerSequence.objects.filter(name__in=SEQUENCES).values_list('name', 'id'))
+            PrayerSequenceStep.objects.bulk_create(
+                [
+                    PrayerSequenceStep(
+                        sequence_id=sequence_ids[sequence_name], order=order,
+                        prayer_id=prayer_ids[name], repeat=repeat,
+                    )
+                    for sequence_name, steps in SEQUENCES.items()
+                    for order, (name, repeat) in enumerate(steps, start=1)
+                ],
+                update_conflicts=True,
+                unique_fields=['sequence', 'order'],
+                update_fields=['prayer', 'repeat'],
             )
 
+        # bulk_create skips the post_save signals that normally drop the compiled sequences.
+        sequence.content_changed()
         self.stdout.write(self.style.SUCCESS("✅ Intro and conclusion sequences created."))
-
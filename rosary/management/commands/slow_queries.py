@@ -0,0 +1,46 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from rosary import slow_queries
+
+
+class Command(BaseCommand):
+    help = "Show the slowest statements from the slow query log, worst first"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help="Statements to show (default: %(default)s)")
+        parser.add_argument('--log', help="Log file to read (default: ROSARY_SLOW_QUERY_LOG)")
+        parser.add_argument('--json', dest='as_json', action='store_true', help="Print the groups as JSON")
+        parser.add_argument('--clear', action='store_true', help="Delete the log after reading it")
+
+    def handle(self, *args, limit, log, as_json, clear, **options):
+        path = log or slow_queries.log_path()
+        groups = slow_queries.worst(slow_queries.read_log(path), limit)
+        if as_json:
+            self.stdout.write(json.dumps(
+                [{**group, 'origins': sorted(group['origins'])} for group in groups], indent=2
+            ))
+        else:
+            self.report(path, groups)
+        if clear:
+            for name in (path, f"{path}.1"):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def report(self, path, groups):
+        if not groups:
+            self.stdout.write(f"No slow queries logged in {path}")
+        for rank, group in enumerate(groups, start=1):
+            worst = group['worst']
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"#{rank}  max {worst['ms']:.1f} ms  avg {group['total_ms'] / group['count']:.1f} ms  "
+                f"x{group['count']}"
+            ))
+            self.stdout.write(f"  {group['sql']}")
+            self.stdout.write(f"  params: {worst['params']}  at {worst['at']}")
+            for origin in sorted(group['origins']):
+                self.stdout.write(f"  from {origin}")
+            for line in worst.get('plan') or ():
+                self.stdout.write(f"    {line}")
@@ -0,0 +1,50 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from rosary.routers import REPLICA, replica_configured
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the default SQLite database onto the SQLite replica named by DATABASE_REPLICA_URL. "
+        "For local testing of replica routing; real replicas use the database's own replication."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep copying every this many seconds, simulating replication lag (default: copy once)",
+        )
+
+    def handle(self, *args, interval, **options):
+        if not replica_configured():
+            raise CommandError("DATABASE_REPLICA_URL is not set")
+        source, target = settings.DATABASES['default'], settings.DATABASES[REPLICA]
+        if connections['default'].vendor != 'sqlite' or connections[REPLICA].vendor != 'sqlite':
+            raise CommandError("sync_replica only copies SQLite to SQLite")
+        if str(source['NAME']) == str(target['NAME']):
+            raise CommandError("The replica must be a different file from the default database")
+
+        while True:
+            started = time.monotonic()
+            self.copy(str(source['NAME']), str(target['NAME']))
+            self.stdout.write(f"Copied {source['NAME']} to {target['NAME']} in {time.monotonic() - started:.2f}s")
+            if not interval:
+                return
+            time.sleep(interval)
+
+    @staticmethod
+    def copy(source, target):
+        # The online backup API takes a consistent snapshot while the primary
+        # keeps serving writes, and replaces the replica's pages in place so
+        # open replica connections see the new data.
+        src, dst = sqlite3.connect(source), sqlite3.connect(target, timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
@@ -0,0 +1,71 @@
+import re
+import urllib.request
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+# Pinned front-end libraries, copied into rosary/static/rosary/vendor/.
+# collectstatic then fingerprints them and writes .gz/.br next to each file.
+# The committed leaflet-heat.js carries the weights fix from Leaflet.heat
+# PR #78; re-vendoring it from npm drops that patch.
+CDN = "https://cdn.jsdelivr.net/npm"
+ASSETS = {
+    'bootstrap/bootstrap.min.css': f"{CDN}/bootstrap@5.3.8/dist/css/bootstrap.min.css",
+    'bootstrap/bootstrap.min.js': f"{CDN}/bootstrap@5.3.8/dist/js/bootstrap.min.js",
+    'leaflet/leaflet.css': f"{CDN}/leaflet@1.9.3/dist/leaflet.css",
+    'leaflet/leaflet.js': f"{CDN}/leaflet@1.9.3/dist/leaflet.js",
+    'leaflet/images/layers.png': f"{CDN}/leaflet@1.9.3/dist/images/layers.png",
+    'leaflet/images/layers-2x.png': f"{CDN}/leaflet@1.9.3/dist/images/layers-2x.png",
+    'leaflet/images/marker-icon.png': f"{CDN}/leaflet@1.9.3/dist/images/marker-icon.png",
+    'leaflet/images/marker-icon-2x.png': f"{CDN}/leaflet@1.9.3/dist/images/marker-icon-2x.png",
+    'leaflet/images/marker-shadow.png': f"{CDN}/leaflet@1.9.3/dist/images/marker-shadow.png",
+    'leaflet.heat/leaflet-heat.js': f"{CDN}/leaflet.heat@0.2.0/dist/leaflet-heat.js",
+    'chartjs/chart.umd.js': f"{CDN}/chart.js@4.4.0/dist/chart.umd.js",
+}
+
+# Source maps are not vendored, and the manifest storage fails on references to missing files.
+SOURCE_MAP = re.compile(r'\n?(?://# sourceMappingURL=[^\n]*|/\*# sourceMappingURL=[^*]*\*/)\s*$')
+CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s*([{};,>])\s*')
+
+
+def strip_source_map(text):
+    return SOURCE_MAP.sub('', text)
+
+
+def minify_css(text):
+    """Drop comments (keeping /*! licences) and the whitespace around punctuation."""
+    text = CSS_COMMENT.sub('', text)
+    text = re.sub(r'\s+', ' ', text)
+    return CSS_SPACE.sub(r'\1', text).replace(';}', '}').strip() + '\n'
+
+
+def prepare(name, data):
+    if not name.endswith(('.js', '.css')):
+        return data
+    text = strip_source_map(data.decode('utf-8'))
+    if name.endswith('.css') and '.min.' not in name:
+        text = minify_css(text)
+    return text.encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = "Download the pinned front-end libraries into rosary/static/rosary/vendor"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Only these files, e.g. chartjs/chart.umd.js")
+
+    def handle(self, *args, names, **options):
+        unknown = set(names) - set(ASSETS)
+        if unknown:
+            raise CommandError(f"Unknown asset(s): {', '.join(sorted(unknown))}")
+        root = Path(apps.get_app_config('rosary').path) / 'static' / 'rosary' / 'vendor'
+        for name in names or ASSETS:
+            with urllib.request.urlopen(ASSETS[name], timeout=30) as response:
+                data = prepare(name, response.read())
+            path = root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            self.stdout.write(f"{name}: {len(data)} bytes")
+        self.stdout.write(self.style.SUCCESS("Vendored assets updated; run collectstatic to fingerprint them."))
@@ -0,0 +1,249 @@
+"""
+In-process performance metrics in the Prometheus text format.
+
+``RequestMetricsMiddleware`` times every request, labelled by URL name. A
+sampled share of requests (``ROSARY_METRICS_SAMPLE_RATE``) also collects its
+database queries and template render time. Queries are counted by an
+execute wrapper that every connection gets on creation, which reads the
+current request from a context variable, so queries run by sync views under
+ASGI are attributed too. ``InstrumentedTemplates`` times top-level template
+renders. Cache hit ratios are read from the caches' own counters when the
+endpoint is scraped.
+
+Metrics are kept per process: with several gunicorn workers each scrape
+reports the worker that served it.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Any other request method is labelled "other", so clients cannot grow the label set.
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+_lock = threading.Lock()
+_metrics = []
+_caches = {}
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in sorted(self._values.items()):
+            yield self.name, _labels(self.labels, label_values), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = _labels(self.labels, label_values, [('le', _number(bound))])
+                yield f'{self.name}_bucket', labels, cumulative
+            labels = _labels(self.labels, label_values)
+            yield f'{self.name}_sum', labels, series[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+REQUEST_SECONDS = Histogram(
+    'rosary_http_request_duration_seconds', "Time to produce a response.", ('view', 'method'),
+)
+RESPONSES = Counter('rosary_http_responses_total', "Responses by status code.", ('view', 'status'))
+REQUEST_QUERIES = Histogram(
+    'rosary_http_request_db_queries', "Database queries per sampled request.", ('view',), QUERY_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    'rosary_http_request_db_seconds', "Database time per sampled request.", ('view',),
+)
+REQUEST_TEMPLATE_SECONDS = Histogram(
+    'rosary_http_request_template_seconds', "Template render time per sampled request.", ('view',),
+)
+TEMPLATE_SECONDS = Histogram('rosary_template_render_seconds', "Top-level template render time.", ('template',))
+GEOIP_SECONDS = Histogram('rosary_geoip_lookup_seconds', "GeoIP lookups that missed the cache.")
+HEARTBEAT_SECONDS = Histogram(
+    'rosary_heartbeat_record_seconds', "Resolving and recording an activity heartbeat.",
+)
+HEARTBEATS_DROPPED = Counter(
+    'rosary_heartbeats_dropped_total', "Buffered heartbeats dropped because writes kept failing.",
+)
+HEATMAP_BUILD_SECONDS = Histogram(
+    'rosary_heatmap_build_seconds', "Rebuilding the heatmap tile pyramid from activity.",
+)
+SEQUENCE_COMPILE_SECONDS = Histogram(
+    'rosary_sequence_compile_seconds', "Compiling a rosary sequence that missed the cache.",
+)
+
+
+def register_cache(name, stats):
+    """Report ``stats() -> {'hits', 'misses', 'size'}`` as cache metrics."""
+    _caches[name] = stats
+
+
+def _cache_samples():
+    requests, entries = [], []
+    for name, stats in sorted(_caches.items()):
+        values = stats()
+        requests.append(('rosary_cache_requests_total', _labels(('cache', 'result'), (name, 'hit')), values['hits']))
+        requests.append(('rosary_cache_requests_total', _labels(('cache', 'result'), (name, 'miss')), values['misses']))
+        entries.append(('rosary_cache_entries', _labels(('cache',), (name,)), values['size']))
+    return [
+        ('rosary_cache_requests_total', 'counter', "Lookups in in-process caches.", requests),
+        ('rosary_cache_entries', 'gauge', "Entries held by in-process caches.", entries),
+    ]
+
+
+def render():
+    families = [(m.name, m.kind, m.documentation, list(m.samples())) for m in _metrics]
+    families.extend(_cache_samples())
+    lines = []
+    for name, kind, documentation, samples in families:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{sample}{labels} {_number(value)}' for sample, labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+# --- per-request collection ---
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+_current = ContextVar('rosary_request_stats', default=None)
+# Templates being rendered; includes and inclusion tags render inside their parent.
+_template_depth = ContextVar('rosary_template_depth', default=0)
+
+
+def start_request():
+    """Begin collecting for this request if it is sampled; returns a reset token."""
+    rate = settings.ROSARY_METRICS_SAMPLE_RATE
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None, None
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(request, response, started, stats, token):
+    elapsed = time.perf_counter() - started
+    if token is not None:
+        _current.reset(token)
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else '<unresolved>'
+    method = request.method if request.method in METHODS else 'other'
+    REQUEST_SECONDS.observe(elapsed, view, method)
+    RESPONSES.inc(view, str(response.status_code))
+    if stats is not None:
+        REQUEST_QUERIES.observe(stats.queries, view)
+        REQUEST_DB_SECONDS.observe(stats.db_seconds, view)
+        REQUEST_TEMPLATE_SECONDS.observe(stats.template_seconds, view)
+
+
+def query_timer(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def install_query_timer(connection):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        depth = _template_depth.get()
+        token = _template_depth.set(depth + 1)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            elapsed = time.perf_counter() - started
+            _template_depth.reset(token)
+            # Nested renders are already inside their parent's time.
+            if depth == 0:
+                TEMPLATE_SECONDS.observe(elapsed, self.template.template.name or '<string>')
+                stats = _current.get()
+                if stats is not None:
+                    stats.template_seconds += elapsed
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """The Django template backend, with renders timed per template."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -1,29 +1,87 @@
-import geoip2.database
-from django.utils.timezone import now
-from .models import PrayerActivity
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import cc_delim_re
+
+from . import geo, heartbeat, metrics, presence
+
+
+class RequestMetricsMiddleware:
+    """Feeds ``rosary.metrics``; disabled by ``ROSARY_METRICS_ENABLED = False``."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.ROSARY_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        response = self.get_response(request)
+        metrics.finish_request(request, response, started, stats, token)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        response = await self.get_response(request)
+        metrics.finish_request(request, response, started, stats, token)
+        return response
 
-GEOIP_DB_PATH = 'geo/GeoLite2-City.mmdb'  # You’ll download this below
 
 class TrackUserActivityMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-        self.reader = geoip2.database.Reader(GEOIP_DB_PATH)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         response = self.get_response(request)
-        if request.user.is_authenticated:
-            ip = get_client_ip(request)
-            region = "Unknown"
-            try:
-                geo = self.reader.city(ip)
-                region = geo.subdivisions.most_specific.name or geo.country.name
-            except:
-                pass
-            PrayerActivity.objects.update_or_create(
-                user=request.user,
-                defaults={'region': region, 'last_active': now()}
-            )
+        if is_shared(response):
+            return response
+        user = request.user
+        if user.is_authenticated and not heartbeat.get_writer().is_fresh(user.pk):
+            self.record(request, user)
         return response
 
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if is_shared(response):
+            return response
+        user = await request.auser()
+        if user.is_authenticated and not heartbeat.get_writer().is_fresh(user.pk):
+            await sync_to_async(self.record)(request, user)
+        return response
+
+    def record(self, request, user):
+        started = time.perf_counter()
+        location = geo.get_resolver().resolve(get_client_ip(request))
+        heartbeat.get_writer().record(user.pk, location.region, location.lat, location.lng)
+        presence.get_aggregator().record(user.pk, location.region)
+        metrics.HEARTBEAT_SECONDS.observe(time.perf_counter() - started)
+
+def is_shared(response):
+    """Whether a shared cache may store the response.
+
+    Those are not heartbeats: looking up the user reads the session, which
+    would make the response vary on the cookie and defeat the cache.
+    """
+    return 'public' in cc_delim_re.split(response.get('Cache-Control', ''))
+
 def get_client_ip(request):
     return request.META.get('REMOTE_ADDR', '')
@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_activity(apps, schema_editor):
+    # Keep only the most recent activity row per user so the one-to-one
+    # constraint in the next migration can be applied.
+    activity = apps.get_model('rosary', 'PrayerActivity').objects.using(schema_editor.connection.alias)
+    duplicated = (
+        activity.values('user_id')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in list(duplicated):
+        rows = activity.filter(user_id=user_id).order_by('-last_active', '-id')
+        keep = rows.values_list('id', flat=True)[0]
+        rows.exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0006_dailyprayercount_rollupwatermark_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0007_dedupe_prayeractivity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='prayeractivity',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='prayeractivity',
+            index=models.Index(fields=['last_active'], name='activity_last_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prayersession',
+            index=models.Index(fields=['user', 'started_at'], name='session_user_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prayersession',
+            index=models.Index(fields=['started_at'], name='session_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userdailyprayercount',
+            index=models.Index(fields=['day'], name='user_daily_count_day_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0009_rosarycheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='prayeractivity',
+            name='last_active',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name='decadestep',
+            constraint=models.UniqueConstraint(fields=('mystery', 'order'), name='unique_decade_step_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='mystery',
+            constraint=models.UniqueConstraint(fields=('set', 'title'), name='unique_mystery_per_set'),
+        ),
+        migrations.AddConstraint(
+            model_name='prayersequencestep',
+            constraint=models.UniqueConstraint(fields=('sequence', 'order'), name='unique_sequence_step_order'),
+        ),
+    ]
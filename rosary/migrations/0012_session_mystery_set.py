@@ -0,0 +1,41 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0011_monthlyprayersummary'),
+    ]
+
+    operations = [
+        # Rows whose labels name the same set are merged by the next migration.
+        migrations.RemoveConstraint(
+            model_name='userdailyprayercount',
+            name='unique_user_day_mystery',
+        ),
+        migrations.RemoveConstraint(
+            model_name='monthlyprayersummary',
+            name='unique_user_month_mystery',
+        ),
+        migrations.AddField(
+            model_name='prayersession',
+            name='mystery_set',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='rosary.mysteryset'),
+        ),
+        migrations.AddField(
+            model_name='prayersession',
+            name='decades',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userdailyprayercount',
+            name='mystery_set',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='rosary.mysteryset'),
+        ),
+        migrations.AddField(
+            model_name='monthlyprayersummary',
+            name='mystery_set',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='rosary.mysteryset'),
+        ),
+    ]
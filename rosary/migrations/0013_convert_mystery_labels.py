@@ -0,0 +1,85 @@
+from django.db import migrations, transaction
+from django.db.models import Count, Min, Sum
+
+CHUNK_SIZE = 5000
+# Every session recorded so far finished all five decades.
+ALL_DECADES = 0b11111
+
+
+def _chunked_update(model, db, set_ids, extra=None):
+    """Point ``mystery_set`` at the set named by ``mystery``, one id range per transaction.
+
+    Labels that name no set ("Full Rosary") are left null.
+    """
+    last_id = 0
+    while True:
+        ids = list(model.objects.using(db).filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:CHUNK_SIZE])
+        if not ids:
+            return
+        chunk = model.objects.using(db).filter(id__gte=ids[0], id__lte=ids[-1])
+        last_id = ids[-1]
+        with transaction.atomic(using=db):
+            for label in chunk.values_list('mystery', flat=True).distinct():
+                set_id = set_ids.get(label.strip().lower())
+                if set_id is not None:
+                    chunk.filter(mystery=label).update(mystery_set_id=set_id)
+            if extra:
+                extra(chunk)
+
+
+def _merge_duplicates(model, db, period):
+    """Labels that mapped to the same set leave several rows per key; fold them into one."""
+    keys = ['user_id', period, 'mystery_set_id']
+    duplicated = (
+        model.objects.using(db).values(*keys)
+        .annotate(rows=Count('id'), total=Sum('count'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for group in list(duplicated):
+        with transaction.atomic(using=db):
+            rows = model.objects.using(db).filter(**{key: group[key] for key in keys})
+            rows.exclude(id=group['keep']).delete()
+            rows.update(count=group['total'])
+
+
+def convert_labels(apps, schema_editor):
+    MysterySet = apps.get_model('rosary', 'MysterySet')
+    PrayerSession = apps.get_model('rosary', 'PrayerSession')
+    UserDailyPrayerCount = apps.get_model('rosary', 'UserDailyPrayerCount')
+    MonthlyPrayerSummary = apps.get_model('rosary', 'MonthlyPrayerSummary')
+    db = schema_editor.connection.alias
+    set_ids = {
+        name.strip().lower(): set_id for set_id, name in MysterySet.objects.using(db).values_list('id', 'name')
+    }
+
+    _chunked_update(
+        PrayerSession, db, set_ids,
+        extra=lambda chunk: chunk.filter(completed=True).update(decades=ALL_DECADES),
+    )
+    _chunked_update(UserDailyPrayerCount, db, set_ids)
+    _chunked_update(MonthlyPrayerSummary, db, set_ids)
+    _merge_duplicates(UserDailyPrayerCount, db, 'day')
+    _merge_duplicates(MonthlyPrayerSummary, db, 'month')
+
+
+def restore_labels(apps, schema_editor):
+    MysterySet = apps.get_model('rosary', 'MysterySet')
+    db = schema_editor.connection.alias
+    for model_name in ('PrayerSession', 'UserDailyPrayerCount', 'MonthlyPrayerSummary'):
+        model = apps.get_model('rosary', model_name)
+        model.objects.using(db).filter(mystery_set__isnull=True).update(mystery="Full Rosary")
+        for set_id, name in MysterySet.objects.using(db).values_list('id', 'name'):
+            model.objects.using(db).filter(mystery_set_id=set_id).update(mystery=name)
+
+
+class Migration(migrations.Migration):
+    # Each chunk commits on its own so a large table is never locked for the whole run.
+    atomic = False
+
+    dependencies = [
+        ('rosary', '0012_session_mystery_set'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_labels, restore_labels),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0013_convert_mystery_labels'),
+    ]
+
+    operations = [
+        # A default lets the labels be re-added when migrating backwards.
+        *[
+            migrations.AlterField(
+                model_name=model_name,
+                name='mystery',
+                field=models.CharField(default='Full Rosary', max_length=50),
+            )
+            for model_name in ('prayersession', 'userdailyprayercount', 'monthlyprayersummary')
+        ],
+        migrations.RemoveField(
+            model_name='prayersession',
+            name='mystery',
+        ),
+        migrations.RemoveField(
+            model_name='userdailyprayercount',
+            name='mystery',
+        ),
+        migrations.RemoveField(
+            model_name='monthlyprayersummary',
+            name='mystery',
+        ),
+        migrations.AddConstraint(
+            model_name='userdailyprayercount',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'mystery_set'), name='unique_user_day_mystery_set'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyprayersummary',
+            constraint=models.UniqueConstraint(fields=('user', 'month', 'mystery_set'), name='unique_user_month_mystery_set'),
+        ),
+    ]
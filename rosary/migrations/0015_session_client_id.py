@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0014_remove_mystery_labels'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prayersession',
+            name='client_id',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='prayersession',
+            constraint=models.UniqueConstraint(fields=('user', 'client_id'), name='unique_user_session_client_id'),
+        ),
+    ]
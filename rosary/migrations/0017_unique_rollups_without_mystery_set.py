@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_rows_without_mystery_set(apps, schema_editor):
+    # Concurrent first increments could create several set-less rows for the
+    # same user and period; fold them into one so the constraints apply.
+    db = schema_editor.connection.alias
+    for model_name, period in (('UserDailyPrayerCount', 'day'), ('MonthlyPrayerSummary', 'month')):
+        objects = apps.get_model('rosary', model_name).objects.using(db)
+        duplicated = (
+            objects.filter(mystery_set__isnull=True)
+            .values('user_id', period)
+            .annotate(rows=Count('id'), total=Sum('count'))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+        for group in list(duplicated):
+            rows = objects.filter(mystery_set__isnull=True, user_id=group['user_id'], **{period: group[period]})
+            keep = rows.order_by('id').values_list('id', flat=True)[0]
+            rows.exclude(id=keep).delete()
+            objects.filter(id=keep).update(count=group['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosary', '0016_contentversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_rows_without_mystery_set, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='monthlyprayersummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('mystery_set__isnull', True)), fields=('user', 'month'), name='unique_user_month_without_mystery_set'),
+        ),
+        migrations.AddConstraint(
+            model_name='userdailyprayercount',
+            constraint=models.UniqueConstraint(condition=models.Q(('mystery_set__isnull', True)), fields=('user', 'day'), name='unique_user_day_without_mystery_set'),
+        ),
+    ]
@@ -3,17 +3,36 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 
 class PrayerActivity(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    last_active = models.DateTimeField(auto_now=True)
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    last_active = models.DateTimeField(default=timezone.now)
     region = models.CharField(max_length=100)
     lat = models.FloatField(null=True)
     lng = models.FloatField(null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_active'], name='activity_last_active_idx'),
+        ]
+
 class PrayerSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    mystery = models.CharField(max_length=50)
+    # Null for sessions recorded before the set was stored. Not indexed: sessions
+    # are only ever looked up by user or time.
+    mystery_set = models.ForeignKey('MysterySet', on_delete=models.SET_NULL, null=True, db_index=False)
+    decades = models.PositiveSmallIntegerField(default=0)  # bit n set once decade n + 1 was prayed
     completed = models.BooleanField(default=False)
     started_at = models.DateTimeField(default=timezone.now)
+    # Chosen by the browser for completions uploaded in bulk, so a retried upload is not counted twice.
+    client_id = models.UUIDField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'started_at'], name='session_user_started_idx'),
+            models.Index(fields=['started_at'], name='session_started_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'client_id'], name='unique_user_session_client_id'),
+        ]
 
 class Prayer(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -36,6 +55,11 @@ class Mystery(models.Model):
     title = models.CharField(max_length=100)
     scripture_reference = models.CharField(max_length=100, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['set', 'title'], name='unique_mystery_per_set'),
+        ]
+
     def __str__(self):
         return f"{self.set.name} - {self.title}"
 
@@ -48,6 +72,9 @@ class DecadeStep(models.Model):
 
     class Meta:
         ordering = ['order']
+        constraints = [
+            models.UniqueConstraint(fields=['mystery', 'order'], name='unique_decade_step_order'),
+        ]
 
     def __str__(self):
         return f"{self.mystery.title} - Step {self.order}: {self.prayer.name} x{self.repeat}"
@@ -66,6 +93,91 @@ class PrayerSequenceStep(models.Model):
 
     class Meta:
         ordering = ['order']
+        constraints = [
+            models.UniqueConstraint(fields=['sequence', 'order'], name='unique_sequence_step_order'),
+        ]
 
     def __str__(self):
         return f"{self.sequence.name} - Step {self.order}: {self.prayer.name} x{self.repeat}"
+
+
+class DailyPrayerCount(models.Model):
+    day = models.DateField(unique=True)
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.day}: {self.count}"
+
+
+class UserDailyPrayerCount(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    mystery_set = models.ForeignKey(MysterySet, on_delete=models.SET_NULL, null=True, db_index=False)
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'mystery_set'], name='unique_user_day_mystery_set'),
+            # NULLs never collide in the constraint above. nulls_distinct=False
+            # would cover them, but SQLite cannot enforce it.
+            models.UniqueConstraint(
+                fields=['user', 'day'], condition=models.Q(mystery_set__isnull=True),
+                name='unique_user_day_without_mystery_set',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='user_daily_count_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.day} {self.mystery_set}: {self.count}"
+
+
+class RollupWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_session_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_session_id}"
+
+
+class ContentVersion(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)  # bumped on every change, checked by each process
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class RosaryCheckpoint(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    mystery_set = models.ForeignKey(MysterySet, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} - {self.mystery_set} @ {self.position}"
+
+
+class MonthlyPrayerSummary(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()  # first day of the month
+    mystery_set = models.ForeignKey(MysterySet, on_delete=models.SET_NULL, null=True, db_index=False)
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'mystery_set'], name='unique_user_month_mystery_set'),
+            models.UniqueConstraint(
+                fields=['user', 'month'], condition=models.Q(mystery_set__isnull=True),
+                name='unique_user_month_without_mystery_set',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.month:%Y-%m} {self.mystery_set}: {self.count}"
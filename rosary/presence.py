@@ -0,0 +1,167 @@
+"""
+Rolling-window presence counts per region.
+
+Each user is counted once, in the minute bucket of their latest heartbeat, so
+the number of people seen in the last N minutes is the sum of the last N
+buckets. Buckets live in a ring of ``ROSARY_PRESENCE_HORIZON`` minutes and a
+read for any window costs O(window * regions) instead of a query over
+``PrayerActivity``.
+
+Heartbeats only reach the aggregator of the worker that served them, so the
+state is also rebuilt from ``PrayerActivity`` on cold start and at most every
+``ROSARY_PRESENCE_REBUILD_INTERVAL`` seconds afterwards. With several workers
+per host, ``ROSARY_PRESENCE_BACKEND`` can point at
+``rosary.shared_presence.SharedPresenceRegistry`` to share one table instead.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import PrayerActivity
+
+ACTIVE_WINDOW_MINUTES = 10
+HEATMAP_WINDOW_MINUTES = 15
+
+def minute_of(when):
+    return int(when.timestamp() // 60)
+
+
+class PresenceAggregator:
+    def __init__(self, horizon=60, rebuild_interval=60):
+        self.horizon = horizon
+        self.rebuild_interval = rebuild_interval
+        self.version = 0
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._rebuilt_at = None
+        self._reset()
+
+    def _reset(self):
+        self._buckets = [Counter() for _ in range(self.horizon)]
+        self._stamps = [None] * self.horizon  # minute currently held by each slot
+        self._users = {}  # user_id -> (minute, region)
+        self._recent = {}  # heartbeats recorded here since the last rebuild
+        self._pruned = None
+
+    def _slot(self, minute, create=False):
+        index = minute % self.horizon
+        stamp = self._stamps[index]
+        if stamp == minute:
+            return self._buckets[index]
+        if create and (stamp is None or stamp < minute):
+            self._buckets[index] = Counter()
+            self._stamps[index] = minute
+            return self._buckets[index]
+        return None
+
+    def record(self, user_id, region, when=None):
+        now = minute_of(timezone.now())
+        minute = minute_of(when) if when else now
+        with self._lock:
+            self._record(user_id, region, minute, now)
+            # A late heartbeat must not replace a newer one at the next rebuild.
+            if self._recent.get(user_id, (minute,))[0] <= minute:
+                self._recent[user_id] = (minute, region)
+
+    def _record(self, user_id, region, minute, now):
+        if minute <= now - self.horizon:
+            return
+        previous = self._users.get(user_id)
+        if previous is not None:
+            if previous[0] > minute or previous == (minute, region):
+                return
+            bucket = self._slot(previous[0])
+            if bucket is not None:
+                bucket[previous[1]] -= 1
+                if bucket[previous[1]] <= 0:
+                    del bucket[previous[1]]
+        self._slot(minute, create=True)[region] += 1
+        self._users[user_id] = (minute, region)
+        self.version += 1
+        if self._pruned != now:
+            self._prune(now)
+
+    def _prune(self, now):
+        oldest = now - self.horizon
+        self._users = {
+            user_id: entry for user_id, entry in self._users.items() if entry[0] > oldest
+        }
+        self._pruned = now
+
+    def counts(self, window_minutes):
+        """Return a ``Counter`` of region -> people seen in the last ``window_minutes``."""
+        if window_minutes > self.horizon:
+            raise ValueError(
+                f"Window of {window_minutes} minutes exceeds the {self.horizon} minute horizon."
+            )
+        self.ensure_fresh()
+        now = minute_of(timezone.now())
+        totals = Counter()
+        with self._lock:
+            for minute in range(now - window_minutes + 1, now + 1):
+                bucket = self._slot(minute)
+                if bucket:
+                    totals.update(bucket)
+        return totals
+
+    def ensure_fresh(self):
+        rebuilt_at = self._rebuilt_at
+        if rebuilt_at is not None and time.monotonic() - rebuilt_at < self.rebuild_interval:
+            return
+        # Only one thread refreshes; the others keep serving the current counts
+        # unless there is nothing to serve yet.
+        if self._rebuild_lock.acquire(blocking=rebuilt_at is None):
+            try:
+                if self._rebuilt_at == rebuilt_at:
+                    self.rebuild()
+            finally:
+                self._rebuild_lock.release()
+
+    def rebuild(self):
+        """Reload the ring from ``PrayerActivity``, keeping newer local heartbeats."""
+        now = timezone.now()
+        rows = list(
+            PrayerActivity.objects
+            .filter(last_active__gte=now - timedelta(minutes=self.horizon))
+            .values_list('user_id', 'region', 'last_active')
+        )
+        current = minute_of(now)
+        with self._lock:
+            recent = self._recent
+            self._reset()
+            for user_id, region, last_active in rows:
+                self._record(user_id, region, minute_of(last_active), current)
+            # Heartbeats may still be buffered rather than written.
+            for user_id, (minute, region) in recent.items():
+                self._record(user_id, region, minute, current)
+            self.version += 1
+            self._rebuilt_at = time.monotonic()
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator():
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = import_string(settings.ROSARY_PRESENCE_BACKEND)(
+                    horizon=settings.ROSARY_PRESENCE_HORIZON,
+                    rebuild_interval=settings.ROSARY_PRESENCE_REBUILD_INTERVAL,
+                )
+    return _aggregator
+
+
+def reset():
+    global _aggregator
+    with _aggregator_lock:
+        if hasattr(_aggregator, 'close'):
+            _aggregator.close()
+        _aggregator = None
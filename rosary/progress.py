@@ -0,0 +1,121 @@
+"""
+Where someone is in their rosary.
+
+Progress lives in a signed cookie so stepping through beads never writes a
+session row. For signed-in users it is also checkpointed to
+``RosaryCheckpoint`` whenever they enter a new part of the rosary (the
+introduction, each decade, the conclusion), so resuming without the cookie
+loses at most one decade.
+"""
+from django.conf import settings
+
+from . import sequence
+from .models import RosaryCheckpoint
+
+COOKIE_NAME = 'rosary_progress'
+COOKIE_SALT = 'rosary.progress'
+
+
+class RosaryProgress:
+    def __init__(self, mystery_set_id=None, position=None):
+        self.mystery_set_id = mystery_set_id
+        self.position = position
+
+    @property
+    def active(self):
+        return self.position is not None
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RosaryProgress)
+            and (self.mystery_set_id, self.position) == (other.mystery_set_id, other.position)
+        )
+
+    @classmethod
+    def load(cls, request):
+        if not hasattr(request, '_rosary_progress'):
+            cookie = cls._from_cookie(request)
+            if cookie is not None and cookie.active:
+                request._rosary_progress = cookie
+            else:
+                # A cookie that only names the set (set by /start/) still defers
+                # to a checkpoint for that set.
+                checkpoint = cls._from_checkpoint(request)
+                if checkpoint is not None and (cookie is None or checkpoint.mystery_set_id == cookie.mystery_set_id):
+                    request._rosary_progress = checkpoint
+                else:
+                    request._rosary_progress = cookie or cls()
+        return request._rosary_progress
+
+    @classmethod
+    def _from_cookie(cls, request):
+        value = request.get_signed_cookie(
+            COOKIE_NAME, default=None, salt=COOKIE_SALT,
+            max_age=settings.ROSARY_PROGRESS_MAX_AGE,
+        )
+        if not value:
+            return None
+        set_id, _, position = value.partition(':')
+        try:
+            return cls(int(set_id) if set_id else None, int(position) if position else None)
+        except ValueError:
+            return None
+
+    @classmethod
+    def _from_checkpoint(cls, request):
+        if not (settings.ROSARY_PROGRESS_CHECKPOINTS and request.user.is_authenticated):
+            return None
+        checkpoint = RosaryCheckpoint.objects.filter(user=request.user).first()
+        if checkpoint is None:
+            return None
+        return cls(checkpoint.mystery_set_id, checkpoint.position)
+
+    def resumes(self, mystery_set_id):
+        """Whether this is a rosary of ``mystery_set_id`` still under way."""
+        return self.active and self.mystery_set_id == mystery_set_id
+
+    def save(self, request, response):
+        previous = RosaryProgress.load(request)
+        if self != previous:
+            response.set_signed_cookie(
+                COOKIE_NAME,
+                f"{self.mystery_set_id or ''}:{'' if self.position is None else self.position}",
+                salt=COOKIE_SALT,
+                max_age=settings.ROSARY_PROGRESS_MAX_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+            if self._enters_new_part(previous):
+                self._checkpoint(request)
+        request._rosary_progress = self
+
+    def finish(self, request, response):
+        """Forget the progress once the rosary has been completed."""
+        response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        if settings.ROSARY_PROGRESS_CHECKPOINTS and request.user.is_authenticated:
+            RosaryCheckpoint.objects.filter(user=request.user).delete()
+        request._rosary_progress = RosaryProgress(self.mystery_set_id)
+
+    def part(self):
+        beads = sequence.get_sequence(self.mystery_set_id).beads
+        if self.position is None or self.position >= len(beads):
+            return None
+        return beads[self.position].part
+
+    def _enters_new_part(self, previous):
+        if not self.active or self.mystery_set_id is None:
+            return False
+        part = self.part()
+        if part is None:
+            return False
+        if not previous.active or previous.mystery_set_id != self.mystery_set_id:
+            return True
+        return part != previous.part()
+
+    def _checkpoint(self, request):
+        if settings.ROSARY_PROGRESS_CHECKPOINTS and request.user.is_authenticated:
+            RosaryCheckpoint.objects.update_or_create(
+                user=request.user,
+                defaults={'mystery_set_id': self.mystery_set_id, 'position': self.position},
+            )
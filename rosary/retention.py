@@ -0,0 +1,161 @@
+"""
+Retention for ``PrayerActivity`` and ``PrayerSession``.
+
+Activity rows for users who have not been seen within the window are deleted.
+Sessions older than their window are folded into per-user, per-month
+``MonthlyPrayerSummary`` rows and then deleted. Only sessions at or below the
+rollup watermark are compacted, so the daily rollups behind the stats page
+already count them. ``reconcile_rollups --full`` would rebuild the daily
+rollups from the sessions that remain, so it refuses to run once any summary
+exists.
+
+The summaries are the only per-user record of compacted sessions and nothing
+reads them yet: the stats page reads the daily rollups, which keep counting
+compacted days, and exports cover the sessions that remain.
+
+Work happens in short transactions of ``chunk_size`` rows with a pause
+between them, so live heartbeats and completions are never queued behind a
+long delete. Rows can be copied to gzipped NDJSON before they are deleted.
+Archiving is at-least-once: a chunk whose transaction fails is already in the
+file and will be written again by the next run.
+"""
+import gzip
+import json
+import os
+import time
+from collections import Counter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import DateField
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import rollups
+from .models import MonthlyPrayerSummary, PrayerActivity, PrayerSession, RollupWatermark
+
+ACTIVITY_FIELDS = ['id', 'user_id', 'region', 'lat', 'lng', 'last_active']
+SESSION_FIELDS = ['id', 'user_id', 'mystery_set_id', 'decades', 'completed', 'started_at']
+
+
+class Archive:
+    """Gzipped NDJSON file, opened on the first write."""
+
+    def __init__(self, directory, name):
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%S')
+        self.path = os.path.join(directory, f"{name}-{stamp}.ndjson.gz")
+        self._file = None
+
+    def write(self, rows):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        for row in rows:
+            self._file.write(json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')))
+            self._file.write('\n')
+        # On disk before the rows are deleted.
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def stale_activity(cutoff):
+    return PrayerActivity.objects.filter(last_active__lt=cutoff)
+
+
+def rollup_watermark():
+    return (
+        RollupWatermark.objects.filter(name=rollups.SESSION_WATERMARK)
+        .values_list('last_session_id', flat=True).first()
+    ) or 0
+
+
+def compactable_sessions(cutoff):
+    return PrayerSession.objects.filter(started_at__lt=cutoff, id__lte=rollup_watermark())
+
+
+def _chunks(queryset, fields, chunk_size, pause, archive):
+    """Yield each chunk of rows inside its own transaction, then pause.
+
+    The caller deletes the chunk by its id range. The range is re-filtered
+    through ``queryset``, so rows that stopped matching are left alone.
+    """
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:chunk_size])
+            if not rows:
+                return
+            first_id, last_id = rows[0]['id'], rows[-1]['id']
+            if archive is not None:
+                archive.write(rows)
+            yield rows, queryset.filter(id__gte=first_id, id__lte=last_id)
+        if pause:
+            time.sleep(pause)
+
+
+def prune_activity(cutoff, chunk_size=1000, pause=0, archive=None):
+    """Delete activity last seen before ``cutoff``. Returns the rows deleted."""
+    deleted = 0
+    for _, chunk in _chunks(stale_activity(cutoff), ACTIVITY_FIELDS, chunk_size, pause, archive):
+        deleted += chunk.delete()[0]
+    return deleted
+
+
+def month_of(when):
+    return timezone.localdate(when).replace(day=1)
+
+
+def _fold(counts):
+    """Add ``{(user_id, month, mystery_set_id): n}`` onto the monthly summaries."""
+    existing = MonthlyPrayerSummary.objects.select_for_update().filter(
+        user_id__in={user_id for user_id, _, _ in counts},
+        month__in={month for _, month, _ in counts},
+    )
+    now = timezone.now()
+    updated = []
+    for summary in existing:
+        key = (summary.user_id, summary.month, summary.mystery_set_id)
+        if key in counts:
+            summary.count += counts.pop(key)
+            summary.updated_at = now
+            updated.append(summary)
+    MonthlyPrayerSummary.objects.bulk_update(updated, ['count', 'updated_at'])
+    MonthlyPrayerSummary.objects.bulk_create([
+        MonthlyPrayerSummary(user_id=user_id, month=month, mystery_set_id=mystery_set_id, count=count)
+        for (user_id, month, mystery_set_id), count in counts.items()
+    ])
+
+
+def compact_sessions(cutoff, chunk_size=1000, pause=0, archive=None):
+    """Fold rolled-up sessions started before ``cutoff`` into monthly summaries
+    and delete them. Returns the sessions deleted."""
+    deleted = 0
+    for rows, chunk in _chunks(compactable_sessions(cutoff), SESSION_FIELDS, chunk_size, pause, archive):
+        _fold(Counter((row['user_id'], month_of(row['started_at']), row['mystery_set_id']) for row in rows))
+        deleted += chunk.delete()[0]
+    return deleted
+
+
+def report(activity_cutoff, session_cutoff):
+    """What a run with these cutoffs would do, without changing anything."""
+    sessions = compactable_sessions(session_cutoff)
+    return {
+        'activity': stale_activity(activity_cutoff).count(),
+        'sessions': sessions.count(),
+        'summaries': (
+            sessions.annotate(month=TruncMonth('started_at', output_field=DateField()))
+            .values('user_id', 'month', 'mystery_set').distinct().count()
+        ),
+        'sessions_pending_rollup': PrayerSession.objects.filter(
+            started_at__lt=session_cutoff, id__gt=rollup_watermark()
+        ).count(),
+    }
@@ -0,0 +1,146 @@
+"""
+Daily prayer rollups.
+
+``DailyPrayerCount`` and ``UserDailyPrayerCount`` are bumped in the same
+transaction that records a completed ``PrayerSession``. ``reconcile`` walks
+sessions past the stored watermark and recomputes every day they touch from
+the raw rows, which both backfills history and repairs any drift.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import (
+    DailyPrayerCount, MonthlyPrayerSummary, PrayerSession, RollupWatermark, UserDailyPrayerCount
+)
+
+SESSION_WATERMARK = "prayer_sessions"
+
+
+def _increment(model, **lookup):
+    rows = model.objects.filter(**lookup)
+    if rows.update(count=F('count') + 1, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=1, **lookup)
+    except IntegrityError:
+        # Another request created the row first.
+        rows.update(count=F('count') + 1, updated_at=timezone.now())
+
+
+def record_session(session):
+    day = timezone.localdate(session.started_at)
+    _increment(DailyPrayerCount, day=day)
+    _increment(UserDailyPrayerCount, user_id=session.user_id, day=day, mystery_set_id=session.mystery_set_id)
+
+
+def record_completed_session(user, mystery_set_id, decades, started_at=None, client_id=None):
+    """Record a completed session and count it. With a ``client_id`` the user already
+    has a session for, nothing is recorded and None is returned."""
+    try:
+        with transaction.atomic():
+            session = PrayerSession.objects.create(
+                user=user, mystery_set_id=mystery_set_id, decades=decades, completed=True,
+                started_at=started_at or timezone.now(), client_id=client_id,
+            )
+            record_session(session)
+    except IntegrityError:
+        if client_id is None:
+            raise
+        return None  # a retried upload; the first one was counted
+    return session
+
+
+def detach_mystery_set(mystery_set_id):
+    """Fold a mystery set's per-user counts into the counts without a set.
+
+    Called before the set is deleted: its rows would otherwise be set to NULL
+    next to an existing set-less row for the same user and period.
+    """
+    for model, period in ((UserDailyPrayerCount, 'day'), (MonthlyPrayerSummary, 'month')):
+        for row in model.objects.filter(mystery_set_id=mystery_set_id):
+            merged = model.objects.filter(
+                user_id=row.user_id, mystery_set__isnull=True, **{period: getattr(row, period)}
+            ).update(count=F('count') + row.count, updated_at=timezone.now())
+            if merged:
+                row.delete()
+            else:
+                row.mystery_set = None
+                row.save(update_fields=['mystery_set', 'updated_at'])
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def recompute_day(day):
+    start, end = day_bounds(day)
+    per_user = (
+        PrayerSession.objects
+        .filter(started_at__gte=start, started_at__lt=end)
+        .values_list('user_id', 'mystery_set_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    rows = [
+        UserDailyPrayerCount(user_id=user_id, day=day, mystery_set_id=mystery_set_id, count=count)
+        for user_id, mystery_set_id, count in per_user
+    ]
+    UserDailyPrayerCount.objects.filter(day=day).delete()
+    UserDailyPrayerCount.objects.bulk_create(rows)
+    total = sum(row.count for row in rows)
+    if total:
+        DailyPrayerCount.objects.update_or_create(day=day, defaults={'count': total})
+    else:
+        DailyPrayerCount.objects.filter(day=day).delete()
+
+
+class CompactedHistory(Exception):
+    """A full rebuild would lose the days whose sessions were compacted."""
+
+
+def reconcile(chunk_size=1000, full=False):
+    """Recompute the rollups for every day touched by sessions past the watermark.
+
+    ``full`` drops the rollups and rebuilds them from every session; it raises
+    ``CompactedHistory`` once retention has folded sessions into monthly
+    summaries, since those days can no longer be rebuilt.
+
+    Returns ``(sessions_seen, days_recomputed)``.
+    """
+    if full and MonthlyPrayerSummary.objects.exists():
+        raise CompactedHistory(
+            "Sessions have been compacted into monthly summaries; a full rebuild would lose their days."
+        )
+    watermark, _ = RollupWatermark.objects.get_or_create(name=SESSION_WATERMARK)
+    if full:
+        with transaction.atomic():
+            UserDailyPrayerCount.objects.all().delete()
+            DailyPrayerCount.objects.all().delete()
+            watermark.last_session_id = 0
+            watermark.save(update_fields=['last_session_id', 'updated_at'])
+
+    last_id = watermark.last_session_id
+    sessions_seen = days_recomputed = 0
+    while True:
+        chunk = list(
+            PrayerSession.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'started_at')[:chunk_size]
+        )
+        if not chunk:
+            break
+        days = sorted({timezone.localdate(started_at) for _, started_at in chunk})
+        with transaction.atomic():
+            for day in days:
+                recompute_day(day)
+            last_id = chunk[-1][0]
+            watermark.last_session_id = last_id
+            watermark.save(update_fields=['last_session_id', 'updated_at'])
+        sessions_seen += len(chunk)
+        days_recomputed += len(days)
+    return sessions_seen, days_recomputed
@@ -0,0 +1,77 @@
+"""
+Read-replica routing.
+
+With ``DATABASE_REPLICA_URL`` set, views wrapped in ``reads_from_replica``
+(stats, active users, heatmap) send their reads to the ``replica`` alias, and
+everything else, including all writes, stays on ``default``. The choice is a
+context variable set for the duration of the view, so ORM code does not need
+``using()`` calls. Users and sessions are always read from the primary.
+
+A user who has just completed a rosary gets a short-lived pin cookie
+(``ROSARY_REPLICA_PIN_SECONDS``). While it is set, their reads stay on the
+primary, so their own stats include the rosary even if the replica lags.
+
+Locally, point ``DATABASE_REPLICA_URL`` at a second SQLite file and refresh it
+with ``manage.py sync_replica``.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+REPLICA = 'replica'
+PIN_COOKIE = 'rosary_primary'
+
+_use_replica = ContextVar('rosary_use_replica', default=False)
+
+# Read from the primary even inside replica views: a new account or a fresh
+# login may not have replicated yet.
+PRIMARY_APPS = {'auth', 'sessions'}
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and model._meta.app_label not in PRIMARY_APPS:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary.
+        return db != REPLICA
+
+
+def reads_from_replica(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replica_configured() or request.COOKIES.get(PIN_COOKIE):
+            return view(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+def pin_to_primary(response):
+    """Keep this client's reads on the primary until the replica has caught up."""
+    if replica_configured():
+        response.set_cookie(
+            PIN_COOKIE, '1',
+            max_age=settings.ROSARY_REPLICA_PIN_SECONDS,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite='Lax',
+        )
+    return response
@@ -0,0 +1,228 @@
+"""
+Compiled rosary sequences.
+
+A rosary is the same ~79 beads for every visitor on a given mystery set, so
+the bead list is built once per set from the content tables and kept in a
+per-process cache. The model signals in ``rosary.signals`` drop it whenever
+the underlying content changes and bump a ``ContentVersion`` row; the other
+worker processes compare that row with the version their cache was built
+from at most every ``ROSARY_SEQUENCE_VERSION_CHECK_INTERVAL`` seconds, and
+drop their cache when it has moved.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import router
+from django.db.models import F
+
+from . import metrics
+from .models import ContentVersion, MysterySet, Mystery, PrayerSequence
+
+INTRO_SEQUENCE = "Introductory Prayers"
+CONCLUSION_SEQUENCE = "Concluding Prayers"
+VERSION_NAME = "sequences"
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+class Bead(NamedTuple):
+    prayer_id: int
+    name: str
+    text: str
+    part: str
+    mystery_title: Optional[str]
+
+
+class Segment(NamedTuple):
+    part: str  # "intro", "mystery-<n>" or "conclusion"
+    title: Optional[str]
+    start: int
+    end: int  # index just past the segment's last bead
+
+
+class CompiledSequence(NamedTuple):
+    set_id: Optional[int]
+    set_name: Optional[str]
+    beads: tuple
+    payload: bytes  # JSON served by the rosary API
+    etag: str
+    segments: tuple  # intro, one per decade, conclusion
+
+    @property
+    def decades(self):
+        return [segment for segment in self.segments if segment.part.startswith("mystery-")]
+
+    def decades_prayed(self, position):
+        """Bitmask of the decades finished before ``position``; bit 0 is the first."""
+        return sum(1 << n for n, decade in enumerate(self.decades) if decade.end <= position)
+
+
+class Catalog(NamedTuple):
+    sets: dict  # mystery set id -> name
+    weekdays: dict  # weekday name -> mystery set id
+
+
+_lock = threading.Lock()
+_sequences = {}
+_catalog = None
+# Bumped on every invalidation so a compile that raced with a content change
+# is not stored over the fresh state.
+_generation = 0
+_stats = {'hits': 0, 'misses': 0}
+# The shared content version last seen, and when it was read (monotonic).
+_seen_version = None
+_checked_at = None
+
+
+def _expand(steps, part, mystery_title=None):
+    beads = []
+    for step in steps:
+        prayer = step.prayer
+        bead = Bead(prayer.id, prayer.name, prayer.text, part, mystery_title)
+        beads.extend([bead] * step.repeat)
+    return beads
+
+
+def compile_sequence(mystery_set_id):
+    sequences = {
+        seq.name: seq
+        for seq in PrayerSequence.objects.filter(
+            name__in=[INTRO_SEQUENCE, CONCLUSION_SEQUENCE]
+        ).prefetch_related('steps__prayer')
+    }
+    for name in (INTRO_SEQUENCE, CONCLUSION_SEQUENCE):
+        if name not in sequences:
+            raise PrayerSequence.DoesNotExist(f"Missing prayer sequence {name!r}")
+
+    beads = _expand(sequences[INTRO_SEQUENCE].steps.all(), "intro")
+    segments = [Segment("intro", None, 0, len(beads))]
+
+    set_name = None
+    mysteries = (
+        Mystery.objects.filter(set_id=mystery_set_id)
+        .select_related('set')
+        .prefetch_related('steps__prayer')
+        .order_by('id')
+    )
+    for idx, mystery in enumerate(mysteries, start=1):
+        set_name = mystery.set.name
+        start = len(beads)
+        beads.extend(_expand(mystery.steps.all(), f"mystery-{idx}", mystery.title))
+        segments.append(Segment(f"mystery-{idx}", mystery.title, start, len(beads)))
+
+    start = len(beads)
+    beads.extend(_expand(sequences[CONCLUSION_SEQUENCE].steps.all(), "conclusion"))
+    segments.append(Segment("conclusion", None, start, len(beads)))
+    payload = _payload(mystery_set_id, set_name, beads)
+    etag = hashlib.sha256(payload).hexdigest()[:32]
+    return CompiledSequence(mystery_set_id, set_name, tuple(beads), payload, etag, tuple(segments))
+
+
+def _payload(set_id, set_name, beads):
+    # Prayer texts are sent once and beads refer to them by id.
+    prayers = {}
+    for bead in beads:
+        prayers.setdefault(str(bead.prayer_id), {"name": bead.name, "text": bead.text})
+    return json.dumps({
+        "set": {"id": set_id, "name": set_name},
+        "prayers": prayers,
+        "beads": [[bead.prayer_id, bead.part, bead.mystery_title] for bead in beads],
+        "total": len(beads),
+    }, separators=(",", ":")).encode()
+
+
+def content_version():
+    # Read from the primary; a lagging replica would hide the change.
+    versions = ContentVersion.objects.using(router.db_for_write(ContentVersion))
+    return versions.filter(name=VERSION_NAME).values_list('version', flat=True).first() or 0
+
+
+def bump_version():
+    """Tell every process that the content changed."""
+    versions = ContentVersion.objects.using(router.db_for_write(ContentVersion))
+    if not versions.filter(name=VERSION_NAME).update(version=F('version') + 1):
+        _, created = versions.get_or_create(name=VERSION_NAME, defaults={'version': 1})
+        if not created:
+            versions.filter(name=VERSION_NAME).update(version=F('version') + 1)
+
+
+def _check_version():
+    """Drop the cache if another process changed the content since it was built."""
+    global _seen_version, _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < settings.ROSARY_SEQUENCE_VERSION_CHECK_INTERVAL:
+        return
+    _checked_at = now
+    version = content_version()
+    if _seen_version is not None and version != _seen_version:
+        invalidate()
+    _seen_version = version
+
+
+def get_sequence(mystery_set_id):
+    _check_version()
+    sequence = _sequences.get(mystery_set_id)
+    if sequence is not None:
+        _stats['hits'] += 1
+    else:
+        _stats['misses'] += 1
+        generation = _generation
+        started = time.perf_counter()
+        sequence = compile_sequence(mystery_set_id)
+        metrics.SEQUENCE_COMPILE_SECONDS.observe(time.perf_counter() - started)
+        with _lock:
+            if generation == _generation:
+                sequence = _sequences.setdefault(mystery_set_id, sequence)
+    return sequence
+
+
+def _build_catalog():
+    sets, weekdays = {}, {}
+    for set_id, name, days in MysterySet.objects.order_by('id').values_list('id', 'name', 'days'):
+        sets[set_id] = name
+        days = days.lower()
+        for weekday in WEEKDAYS:
+            if weekday.lower() in days:
+                weekdays.setdefault(weekday, set_id)
+    return Catalog(sets, weekdays)
+
+
+def get_catalog():
+    global _catalog
+    _check_version()
+    catalog = _catalog
+    if catalog is None:
+        generation = _generation
+        catalog = _build_catalog()
+        with _lock:
+            if generation == _generation:
+                _catalog = catalog
+    return catalog
+
+
+def mystery_set_for_day(weekday):
+    return get_catalog().weekdays.get(weekday)
+
+
+def stats():
+    return {**_stats, 'size': len(_sequences)}
+
+
+metrics.register_cache('sequence', stats)
+
+
+def invalidate():
+    global _catalog, _generation
+    with _lock:
+        _generation += 1
+        _sequences.clear()
+        _catalog = None
+
+
+def content_changed():
+    """Drop this process's cache now and the other processes' on their next check."""
+    bump_version()
+    invalidate()
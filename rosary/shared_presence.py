@@ -0,0 +1,363 @@
+"""
+Presence shared by every worker process on a host.
+
+``SharedPresenceRegistry`` keeps the same per-minute, per-region ring as
+``presence.PresenceAggregator``, but in a memory-mapped file, so a heartbeat
+served by one gunicorn worker is counted by all of them straight away. The
+file also holds a user table of user -> (minute, region). A heartbeat is one
+hash probe plus two counter updates, and a window count sums
+``window * regions`` integers. Entries expire once their minute leaves the
+horizon.
+
+The registry only counts presence. Heartbeats are still stored by
+``rosary.heartbeat`` and the heatmap tiles still read ``PrayerActivity``,
+which stays the durable copy. The first worker to find the registry stale
+reloads it from there, at most every ``ROSARY_PRESENCE_REBUILD_INTERVAL``
+seconds, which also picks up heartbeats served by other hosts, and drops
+expired users and unused regions from the tables. Access is serialised with
+``flock`` across processes and a lock within each process. POSIX only.
+
+Users are kept with their region but not their coordinates: nothing reads a
+user's position back, and the heatmap bins positions from ``PrayerActivity``.
+Region names longer than 64 bytes are cut to fit.
+
+Enable with ``ROSARY_PRESENCE_BACKEND = 'rosary.shared_presence.SharedPresenceRegistry'``.
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PrayerActivity
+from .presence import minute_of
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RPR2'
+# magic, horizon, capacity, max regions, regions used, generation, version, rebuilt at
+HEADER = struct.Struct('<4sIIIIIqd')
+HEADER_SIZE = 64
+REGIONS_USED = struct.Struct('<I'), 16
+GENERATION = struct.Struct('<I'), 20
+VERSION = struct.Struct('<q'), 24
+REBUILT_AT = struct.Struct('<d'), 32
+REGION_NAME_SIZE = 64
+UNKNOWN_REGION = 'Unknown'  # region 0, also used once the region table is full
+EMPTY = 0  # user id of a never-used slot
+REBUILD_ATTEMPTS = 3  # unlocked merges tried before merging under the exclusive lock
+USER_TABLE = ('user_ids', 'minutes', 'user_regions')
+
+
+def default_path():
+    database = str(settings.DATABASES['default'].get('NAME', ''))
+    key = hashlib.sha256(database.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"rosary-presence-{key}.bin")
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class SharedPresenceRegistry:
+    def __init__(self, horizon=60, rebuild_interval=60, path=None, capacity=None, max_regions=None):
+        self.horizon = horizon
+        self.rebuild_interval = rebuild_interval
+        self.path = path or settings.ROSARY_PRESENCE_SHARED_PATH or default_path()
+        # Open addressing works on a power-of-two table.
+        self.capacity = 1 << max(capacity or settings.ROSARY_PRESENCE_SHARED_CAPACITY, 2).bit_length() - 1
+        self.max_regions = max_regions or settings.ROSARY_PRESENCE_SHARED_REGIONS
+        self._lock = threading.Lock()
+        self._pid = None
+        self._full_warned = False
+
+        sizes = [
+            ('regions', REGION_NAME_SIZE * self.max_regions, None),
+            ('stamps', 8 * horizon, 'q'),
+            ('ring', 4 * horizon * self.max_regions, 'i'),
+            ('user_ids', 8 * self.capacity, 'q'),
+            ('minutes', 8 * self.capacity, 'q'),
+            ('user_regions', 4 * self.capacity, 'i'),
+        ]
+        offset = HEADER_SIZE
+        self._layout = []
+        for name, size, fmt in sizes:
+            self._layout.append((name, offset, size, fmt))
+            offset = _align(offset + size)
+        self.size = offset
+
+    # --- file handling ---
+
+    def _open(self):
+        """Map the file, (re)initialising it if its layout does not match."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(fd).st_size
+            header = os.pread(fd, HEADER.size, 0) if current >= HEADER_SIZE else b''
+            expected = (MAGIC, self.horizon, self.capacity, self.max_regions)
+            if current != self.size or HEADER.unpack(header)[:4] != expected:
+                generation = HEADER.unpack(header)[5] + 1 if len(header) == HEADER.size else 1
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, HEADER.pack(*expected, 1, generation, 0, 0.0), 0)
+                name = UNKNOWN_REGION.encode()
+                os.pwrite(fd, name, self._offset('regions'))
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size)
+        view = memoryview(self._map)
+        for name, offset, size, fmt in self._layout:
+            section = view[offset:offset + size]
+            setattr(self, f'_{name}', section.cast(fmt) if fmt else section)
+        self._region_ids = {}
+        self._generation = None
+        self._pid = os.getpid()
+
+    def _offset(self, section):
+        return next(offset for name, offset, _, _ in self._layout if name == section)
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        with self._lock:
+            # A forked worker must not share the parent's flock.
+            if self._pid != os.getpid():
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                # Another process re-initialised the file; region ids changed.
+                generation = self._read_header()[5]
+                if generation != self._generation:
+                    self._region_ids = {}
+                    self._generation = generation
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read_header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    def _get(self, field):
+        fmt, offset = field
+        return fmt.unpack_from(self._map, offset)[0]
+
+    def _set(self, field, value):
+        fmt, offset = field
+        fmt.pack_into(self._map, offset, value)
+
+    def _bump_version(self):
+        self._set(VERSION, self._get(VERSION) + 1)
+
+    @property
+    def version(self):
+        with self._locked(exclusive=False):
+            return self._get(VERSION)
+
+    # --- regions ---
+
+    def _region_name(self, index):
+        start = index * REGION_NAME_SIZE
+        return bytes(self._regions[start:start + REGION_NAME_SIZE]).rstrip(b'\0').decode('utf-8', 'replace')
+
+    def _region_index(self, region):
+        # Stored names are cut to the slot size on a character boundary, and
+        # looked up in that form so a long name keeps its slot.
+        region = region.encode('utf-8')[:REGION_NAME_SIZE].decode('utf-8', 'ignore')
+        index = self._region_ids.get(region)
+        if index is not None:
+            return index
+        used = self._get(REGIONS_USED)
+        names = {self._region_name(i): i for i in range(used)}
+        self._region_ids.update(names)
+        if region in names:
+            return names[region]
+        if used >= self.max_regions:
+            return 0
+        encoded = region.encode('utf-8')
+        start = used * REGION_NAME_SIZE
+        self._regions[start:start + len(encoded)] = encoded
+        self._set(REGIONS_USED, used + 1)
+        self._region_ids[region] = used
+        return used
+
+    # --- user table ---
+
+    def _probe(self, user_id, expired_before):
+        """Return ``(slot, found)``: the user's slot, or the best free slot."""
+        mask = self.capacity - 1
+        index = (user_id * 0x9E3779B97F4A7C15) & mask
+        reusable = None
+        for _ in range(self.capacity):
+            current = self._user_ids[index]
+            if current == user_id:
+                return index, True
+            if current == EMPTY:
+                return (index if reusable is None else reusable), False
+            if reusable is None and self._minutes[index] <= expired_before:
+                reusable = index
+            index = (index + 1) & mask
+        return reusable, False
+
+    def _bucket_row(self, minute, create=False):
+        index = minute % self.horizon
+        stamp = self._stamps[index]
+        if stamp == minute:
+            return index * self.max_regions
+        if create and stamp < minute:
+            start = index * self.max_regions
+            self._ring[start:start + self.max_regions] = memoryview(bytes(4 * self.max_regions)).cast('i')
+            self._stamps[index] = minute
+            return start
+        return None
+
+    def _record(self, user_id, region, minute, now):
+        if minute <= now - self.horizon:
+            return
+        region_id = self._region_index(region)
+        slot, found = self._probe(user_id, now - self.horizon)
+        if slot is None:
+            if not self._full_warned:
+                logger.warning("Shared presence table is full (%s users); raise ROSARY_PRESENCE_SHARED_CAPACITY",
+                               self.capacity)
+                self._full_warned = True
+            return
+        if found:
+            previous_minute, previous_region = self._minutes[slot], self._user_regions[slot]
+            if previous_minute > minute or (previous_minute, previous_region) == (minute, region_id):
+                return
+            row = self._bucket_row(previous_minute)
+            if row is not None and self._ring[row + previous_region] > 0:
+                self._ring[row + previous_region] -= 1
+        row = self._bucket_row(minute, create=True)
+        self._ring[row + region_id] += 1
+        self._user_ids[slot] = user_id
+        self._minutes[slot] = minute
+        self._user_regions[slot] = region_id
+        self._bump_version()
+
+    # --- aggregator interface ---
+
+    def record(self, user_id, region, when=None):
+        now = minute_of(timezone.now())
+        minute = minute_of(when) if when else now
+        with self._locked():
+            self._record(user_id, region, minute, now)
+
+    def counts(self, window_minutes):
+        """Return a ``Counter`` of region -> people seen in the last ``window_minutes``."""
+        if window_minutes > self.horizon:
+            raise ValueError(
+                f"Window of {window_minutes} minutes exceeds the {self.horizon} minute horizon."
+            )
+        self.ensure_fresh()
+        now = minute_of(timezone.now())
+        totals = Counter()
+        with self._locked(exclusive=False):
+            used = self._get(REGIONS_USED)
+            for minute in range(now - window_minutes + 1, now + 1):
+                row = self._bucket_row(minute)
+                if row is None:
+                    continue
+                for region_id, count in enumerate(self._ring[row:row + used]):
+                    if count:
+                        totals[region_id] += count
+            by_name = Counter()
+            for region_id, count in totals.items():
+                by_name[self._region_name(region_id)] += count
+            return by_name
+
+    def ensure_fresh(self):
+        if self._pid == os.getpid():
+            # Unlocked peek; claiming the rebuild below is done under the lock.
+            if time.time() - self._get(REBUILT_AT) < self.rebuild_interval:
+                return
+        with self._locked():
+            if time.time() - self._get(REBUILT_AT) < self.rebuild_interval:
+                return
+            self._set(REBUILT_AT, time.time())
+        self.rebuild()
+
+    def rebuild(self):
+        """Merge ``PrayerActivity`` into the registry and compact its tables.
+
+        The user table is copied under a shared lock and merged unlocked; the
+        exclusive lock is only held to write the live users back, which is
+        retried if a heartbeat landed in between.
+        """
+        now = timezone.now()
+        rows = list(
+            PrayerActivity.objects
+            .filter(last_active__gte=now - timedelta(minutes=self.horizon))
+            .values_list('user_id', 'region', 'last_active')
+        )
+        current = minute_of(now)
+        for _ in range(REBUILD_ATTEMPTS):
+            with self._locked(exclusive=False):
+                version, snapshot = self._get(VERSION), self._snapshot()
+            live = self._merge(snapshot, rows, current)
+            with self._locked():
+                if self._get(VERSION) == version:
+                    self._rewrite(live, current)
+                    break
+        else:
+            with self._locked():
+                live = self._merge(self._snapshot(), rows, current)
+                self._rewrite(live, current)
+        logger.debug("Rebuilt shared presence with %s live users", len(live))
+
+    def _snapshot(self):
+        """Copies of the user table and the region names; memcpy, so cheap under the lock."""
+        tables = tuple(bytes(getattr(self, f'_{name}')) for name in USER_TABLE)
+        return tables, [self._region_name(i) for i in range(self._get(REGIONS_USED))]
+
+    def _merge(self, snapshot, rows, current):
+        """``{user_id: (minute, region)}`` for the users live in the snapshot or the database."""
+        tables, names = snapshot
+        user_ids, minutes, user_regions = (
+            memoryview(table).cast(getattr(self, f'_{name}').format) for name, table in zip(USER_TABLE, tables)
+        )
+        oldest = current - self.horizon
+        live = {}
+        for slot, user_id in enumerate(user_ids):
+            if user_id != EMPTY and minutes[slot] > oldest:
+                live[user_id] = (minutes[slot], names[user_regions[slot]])
+        for user_id, region, last_active in rows:
+            minute = minute_of(last_active)
+            if user_id not in live or live[user_id][0] < minute:
+                live[user_id] = (minute, region)
+        return live
+
+    def _rewrite(self, live, current):
+        """Replace every table with just the ``live`` users and their regions."""
+        for name in (*USER_TABLE, 'stamps', 'ring', 'regions'):
+            section = getattr(self, f'_{name}')
+            section[:] = memoryview(bytes(section.nbytes)).cast(section.format)
+        name = UNKNOWN_REGION.encode()
+        self._regions[:len(name)] = name
+        self._set(REGIONS_USED, 1)
+        # Region ids are reassigned; other processes drop their cached ids.
+        self._generation = self._get(GENERATION) + 1
+        self._set(GENERATION, self._generation)
+        self._region_ids = {}
+        for user_id, (minute, region) in live.items():
+            self._record(user_id, region, minute, current)
+        self._bump_version()
+
+    def close(self):
+        if self._pid == os.getpid():
+            for name, _, _, _ in self._layout:
+                getattr(self, f'_{name}').release()
+            self._map.close()
+            os.close(self._fd)
+        self._pid = None
@@ -0,0 +1,64 @@
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import geo, heartbeat, live, metrics, presence, rollups, sequence, slow_queries, tiles
+from .models import (
+    Prayer, MysterySet, Mystery, DecadeStep, PrayerSequence, PrayerSequenceStep
+)
+
+# Any change to these rows can alter a compiled bead list or the weekday table.
+SEQUENCE_CONTENT_MODELS = (
+    Prayer, MysterySet, Mystery, DecadeStep, PrayerSequence, PrayerSequenceStep
+)
+
+
+def invalidate_compiled_sequences(sender, **kwargs):
+    sequence.content_changed()
+
+
+for model in SEQUENCE_CONTENT_MODELS:
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate_compiled_sequences, sender=model)
+
+
+@receiver(pre_delete, sender=MysterySet)
+def detach_rollups_from_mystery_set(sender, instance, **kwargs):
+    rollups.detach_mystery_set(instance.pk)
+
+
+@receiver(setting_changed)
+def reset_heartbeat_writer(setting, **kwargs):
+    if setting.startswith("ROSARY_ACTIVITY_"):
+        heartbeat.reset()
+
+
+@receiver(setting_changed)
+def reset_geoip_resolver(setting, **kwargs):
+    if setting.startswith("ROSARY_GEOIP_"):
+        geo.set_resolver(None)
+
+
+@receiver(setting_changed)
+def reset_presence_aggregator(setting, **kwargs):
+    if setting.startswith("ROSARY_PRESENCE_"):
+        presence.reset()
+
+
+@receiver(setting_changed)
+def reset_live_snapshot(setting, **kwargs):
+    if setting.startswith(("ROSARY_LIVE_", "ROSARY_PRESENCE_")):
+        live.reset()
+
+
+@receiver(setting_changed)
+def reset_heatmap_tiles(setting, **kwargs):
+    if setting.startswith("ROSARY_HEATMAP_"):
+        tiles.reset()
+
+
+@receiver(connection_created)
+def install_query_wrappers(connection, **kwargs):
+    metrics.install_query_timer(connection)
+    slow_queries.install(connection)
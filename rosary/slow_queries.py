@@ -0,0 +1,208 @@
+"""
+Slow-query log.
+
+Every connection gets ``capture`` as an execute wrapper, so ORM, raw and
+middleware queries are all covered. A query that beats the clock costs two
+``perf_counter`` calls. One that takes longer than ``ROSARY_SLOW_QUERY_MS`` is
+recorded with its SQL, parameters, calling code and EXPLAIN plan into an
+in-process ring buffer, and appended as a line of JSON to
+``ROSARY_SLOW_QUERY_LOG``. That file is shared by all workers and read by
+``manage.py slow_queries``. It is rotated once it grows past
+``ROSARY_SLOW_QUERY_LOG_MAX_BYTES``.
+
+Parameters are redacted unless ``ROSARY_SLOW_QUERY_LOG_PARAMS`` is on, since
+they include session keys and password hashes. The log is created readable by
+its owner only, without following symlinks, and by default lives in a
+directory private to the user the site runs as.
+
+The plan comes from EXPLAIN without ANALYZE, so the statement is not run
+again. On PostgreSQL inside a transaction it runs in a savepoint, so a failed
+EXPLAIN cannot abort the caller's transaction.
+"""
+import json
+import logging
+import os
+import re
+import stat
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+PARAMS_LIMIT = 500
+SQL_LIMIT = 10000
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Execute wrappers, never the code that issued the query.
+WRAPPER_FILES = {os.path.abspath(__file__), os.path.join(APP_DIR, 'metrics.py')}
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+_lock = threading.Lock()
+_buffer = None
+_local = threading.local()
+
+
+def private_dir():
+    """A directory under the temp directory that only this user can enter."""
+    path = os.path.join(tempfile.gettempdir(), f"rosary-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    # Someone else may have created it first, or left a symlink in its place.
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise OSError(f"{path} is not a private directory")
+    return path
+
+
+def default_path():
+    return os.path.join(private_dir(), "slow-queries.ndjson")
+
+
+def log_path():
+    return settings.ROSARY_SLOW_QUERY_LOG or default_path()
+
+
+def _open_log(path):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_NOFOLLOW, 0o600)
+    return os.fdopen(fd, 'a', encoding='utf-8')
+
+
+def fingerprint(sql):
+    """SQL with IN lists of any length collapsed, for grouping."""
+    return IN_LIST.sub('(...)', sql)
+
+
+def _origin():
+    """The innermost frame in this app's code outside this module, e.g. ``views.py:102 stats_page``."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename not in WRAPPER_FILES:
+            return f"{os.path.relpath(filename, APP_DIR)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    # Only PostgreSQL aborts the transaction when a statement fails; SQLite
+    # cannot open a savepoint while the slow query's cursor is still open.
+    use_savepoint = connection.in_atomic_block and connection.vendor == 'postgresql'
+    savepoint = connection.savepoint() if use_savepoint else None
+    # A backend cursor straight from the connection skips the execute wrappers.
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError as exc:
+        if savepoint:
+            connection.savepoint_rollback(savepoint)
+        return [f"EXPLAIN failed: {exc}"]
+    finally:
+        cursor.close()
+    if savepoint:
+        connection.savepoint_commit(savepoint)
+    return plan
+
+
+def _record(entry):
+    global _buffer
+    line = json.dumps(entry, default=str)
+    with _lock:
+        if _buffer is None or _buffer.maxlen != settings.ROSARY_SLOW_QUERY_BUFFER:
+            _buffer = deque(_buffer or (), maxlen=settings.ROSARY_SLOW_QUERY_BUFFER)
+        _buffer.append(entry)
+        path = None
+        try:
+            path = log_path()
+            if os.path.exists(path) and os.path.getsize(path) > settings.ROSARY_SLOW_QUERY_LOG_MAX_BYTES:
+                os.replace(path, f"{path}.1")
+            with _open_log(path) as log:
+                log.write(line + '\n')
+        except OSError as exc:
+            logger.warning("Cannot write slow query log %s: %s", path, exc)
+
+
+def capture(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        if elapsed * 1000 >= settings.ROSARY_SLOW_QUERY_MS and not getattr(_local, 'active', False):
+            _local.active = True
+            try:
+                connection = context['connection']
+                explained = settings.ROSARY_SLOW_QUERY_EXPLAIN and not many
+                _record({
+                    'at': timezone.now().isoformat(),
+                    'ms': round(elapsed * 1000, 3),
+                    'alias': connection.alias,
+                    'sql': sql[:SQL_LIMIT],
+                    'params': (
+                        repr(params)[:PARAMS_LIMIT] if settings.ROSARY_SLOW_QUERY_LOG_PARAMS
+                        else "<redacted>"
+                    ),
+                    'many': many,
+                    'origin': _origin(),
+                    'plan': explain(connection, sql, params) if explained else None,
+                })
+            except Exception:
+                logger.exception("Could not record a slow query")
+            finally:
+                _local.active = False
+
+
+def install(connection):
+    if settings.ROSARY_SLOW_QUERY_MS > 0 and capture not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture)
+
+
+def recent():
+    """Slow queries seen by this process, oldest first."""
+    with _lock:
+        return list(_buffer or ())
+
+
+def read_log(path=None):
+    """Entries from the shared log, including the rotated file."""
+    path = path or log_path()
+    entries = []
+    for name in (f"{path}.1", path):
+        try:
+            with open(name, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # a line cut short by a crash or a concurrent rotation
+        except FileNotFoundError:
+            continue
+    return entries
+
+
+def worst(entries, limit=10):
+    """Group entries by statement, worst maximum first."""
+    groups = {}
+    for entry in entries:
+        key = fingerprint(entry['sql'])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'sql': key, 'count': 0, 'total_ms': 0.0, 'origins': set(), 'worst': entry}
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        if entry.get('origin'):
+            group['origins'].add(entry['origin'])
+        if entry['ms'] > group['worst']['ms']:
+            group['worst'] = entry
+    return sorted(groups.values(), key=lambda group: group['worst']['ms'], reverse=True)[:limit]
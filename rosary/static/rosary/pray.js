@@ -0,0 +1,197 @@
+(function () {
+  const config = JSON.parse(document.getElementById('rosary-config').textContent);
+  const csrfToken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+  const SYNC_DELAY = 5000;
+  const QUEUE_KEY = 'rosary-completions';
+  let sequence = null;
+  let dots = [];
+  let position = config.position;
+  let synced = position;
+  let syncTimer = null;
+  let uploading = null;
+
+  // Offline, the cached page may be from another day: pray today's set.
+  if (!navigator.onLine) {
+    const today = config.weekdaySets[new Date().toLocaleDateString('en-US', {weekday: 'long'})];
+    if (today && config.sequenceUrls[today]) {
+      if (today !== config.setId) {
+        position = synced = 0;
+      }
+      config.setId = today;
+      config.sequenceUrl = config.sequenceUrls[today];
+    }
+  }
+
+  function sync(keepalive) {
+    clearTimeout(syncTimer);
+    syncTimer = null;
+    if (position === synced) {
+      return Promise.resolve();
+    }
+    const sent = position;
+    return fetch(config.progressUrl, {
+      method: 'POST',
+      credentials: 'same-origin',
+      keepalive: !!keepalive,
+      headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+      body: JSON.stringify({set_id: config.setId, position: sent}),
+    }).then(function (response) {
+      if (response.ok) {
+        synced = sent;
+      }
+    }).catch(function () {});  // offline: the next sync sends the latest position
+  }
+
+  // Completions are queued in localStorage under an id chosen here, and
+  // uploaded until the server has answered for them. Resending an id the
+  // server already has is harmless, so a retry never counts a rosary twice.
+  function loadQueue() {
+    try {
+      return JSON.parse(localStorage.getItem(QUEUE_KEY)) || [];
+    } catch (e) {
+      return [];
+    }
+  }
+
+  function saveQueue(queue) {
+    localStorage.setItem(QUEUE_KEY, JSON.stringify(queue));
+  }
+
+  function newId() {
+    if (window.crypto && crypto.randomUUID) {
+      return crypto.randomUUID();
+    }
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    const hex = Array.from(bytes, function (b) { return b.toString(16).padStart(2, '0'); }).join('');
+    return [hex.slice(0, 8), hex.slice(8, 12), hex.slice(12, 16), hex.slice(16, 20), hex.slice(20)].join('-');
+  }
+
+  function uploadCompletions() {
+    const batch = loadQueue().slice(0, config.completionsBatch);
+    if (uploading || !batch.length) {
+      return;
+    }
+    uploading = fetch(config.completionsUrl, {
+      method: 'POST',
+      credentials: 'same-origin',
+      keepalive: true,
+      headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+      body: JSON.stringify({completions: batch}),
+    }).then(function (response) {
+      return response.ok ? response.json() : Promise.reject(response);
+    }).then(function (data) {
+      // Every result is final, whether created, a duplicate or rejected.
+      const queue = loadQueue();
+      const remaining = queue.filter(function (item) { return !(item.client_id in data.results); });
+      saveQueue(remaining);
+      uploading = null;
+      if (remaining.length && remaining.length < queue.length) {
+        uploadCompletions();
+      }
+    }).catch(function () {
+      uploading = null;  // kept for the next attempt
+    });
+  }
+
+  function complete() {
+    if (!config.completionsUrl) {
+      sync(true);
+      return;
+    }
+    // The completion replaces the final progress sync, which would record it a second time.
+    clearTimeout(syncTimer);
+    synced = position;
+    const queue = loadQueue();
+    queue.push({client_id: newId(), set_id: config.setId, completed_at: new Date().toISOString()});
+    saveQueue(queue);
+    uploadCompletions();
+  }
+
+  function scheduleSync() {
+    if (syncTimer === null) {
+      syncTimer = setTimeout(sync, SYNC_DELAY);
+    }
+  }
+
+  function buildStrip() {
+    const groups = {};
+    let decade = null;
+    let decadeTitle;
+    sequence.beads.forEach(function (bead) {
+      const part = bead[1];
+      let container;
+      if (part === 'intro' || part === 'conclusion') {
+        container = document.querySelector('[data-part="' + part + '"]');
+      } else {
+        if (bead[2] !== decadeTitle) {
+          decadeTitle = bead[2];
+          const wrapper = document.createElement('div');
+          wrapper.className = 'mb-2 w-100';
+          const label = document.createElement('p');
+          label.className = 'text-center';
+          label.innerHTML = '<strong></strong>';
+          label.firstChild.textContent = decadeTitle;
+          decade = document.createElement('div');
+          decade.className = 'd-flex justify-content-center flex-wrap gap-1';
+          wrapper.append(label, decade);
+          document.querySelector('[data-part="decades"]').append(wrapper);
+        }
+        container = decade;
+      }
+      const dot = document.createElement('div');
+      dot.className = 'dot';
+      container.append(dot);
+      dots.push(dot);
+    });
+  }
+
+  function render() {
+    const bead = sequence.beads[position];
+    const prayer = sequence.prayers[bead[0]];
+    document.getElementById('rosary-prayer-name').textContent = prayer.name;
+    document.getElementById('rosary-prayer-text').textContent = prayer.text;
+    const mystery = document.getElementById('rosary-mystery');
+    mystery.hidden = !bead[2];
+    mystery.querySelector('strong').textContent = bead[2] || '';
+    dots.forEach(function (dot, i) {
+      dot.classList.toggle('done', i < position);
+      dot.classList.toggle('current', i === position);
+    });
+  }
+
+  function next() {
+    const part = sequence.beads[position][1];
+    position += 1;
+    if (position >= sequence.total) {
+      document.getElementById('rosary-praying').hidden = true;
+      document.getElementById('rosary-complete').hidden = false;
+      complete();
+      return;
+    }
+    render();
+    // Decade boundaries are synced straight away, other beads are debounced.
+    if (sequence.beads[position][1] !== part) {
+      sync();
+    } else {
+      scheduleSync();
+    }
+  }
+
+  fetch(config.sequenceUrl, {credentials: 'same-origin'})
+    .then(function (response) { return response.json(); })
+    .then(function (data) {
+      sequence = data;
+      buildStrip();
+      render();
+      document.getElementById('rosary-praying').hidden = false;
+      document.getElementById('rosary-next').addEventListener('click', next);
+      window.addEventListener('pagehide', function () { sync(true); });
+    });
+
+  if (config.completionsUrl) {
+    uploadCompletions();
+    window.addEventListener('online', uploadCompletions);
+  }
+})();
@@ -0,0 +1,76 @@
+// Service worker for praying offline, rendered by views.service_worker.
+// Static assets and every mystery set's sequence are stored on install; the
+// prayer page is stored each time it loads, and stands in for the pages that
+// lead to it when the network is down.
+const CACHE = 'rosary-{{ version }}';
+const ASSETS = {{ assets|safe }};
+const STATIC_URL = '{{ static_url }}';
+const PRAY_PAGE = '{{ pray_url }}';
+const PRAYER_PATHS = {{ prayer_paths|safe }};
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(CACHE)
+      .then(cache => Promise.all([
+        // One asset failing to load must not keep the others out of the cache.
+        Promise.allSettled(ASSETS.map(url => cache.add(url))),
+        // Keep the prayer page from the previous version until it is next loaded.
+        caches.match(PRAY_PAGE).then(page => page && cache.put(PRAY_PAGE, page)),
+      ]))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(
+        keys.filter(key => key.startsWith('rosary-') && key !== CACHE).map(key => caches.delete(key))
+      ))
+      .then(() => self.clients.claim())
+  );
+});
+
+function prayerPage(event) {
+  return fetch(event.request)
+    .then(response => {
+      if (new URL(event.request.url).pathname === PRAY_PAGE && response.ok) {
+        const copy = response.clone();
+        event.waitUntil(caches.open(CACHE).then(cache => cache.put(PRAY_PAGE, copy)));
+      }
+      return response;
+    })
+    .catch(() => caches.match(PRAY_PAGE, {cacheName: CACHE}).then(page => page || Response.error()));
+}
+
+function asset(event, path) {
+  return caches.open(CACHE).then(cache => cache.match(event.request).then(cached => {
+    // Static files are content-hashed; sequences are refreshed behind the cached copy.
+    if (cached && path.startsWith(STATIC_URL)) {
+      return cached;
+    }
+    const network = fetch(event.request).then(response => {
+      if (response.ok) {
+        cache.put(event.request, response.clone());
+      }
+      return response;
+    });
+    if (cached) {
+      event.waitUntil(network.catch(() => null));
+      return cached;
+    }
+    return network;
+  }));
+}
+
+self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  if (event.request.method !== 'GET' || url.origin !== self.location.origin) {
+    return;
+  }
+  if (event.request.mode === 'navigate' && PRAYER_PATHS.includes(url.pathname)) {
+    event.respondWith(prayerPage(event));
+  } else if (ASSETS.includes(url.pathname)) {
+    event.respondWith(asset(event, url.pathname));
+  }
+});
@@ -1,13 +1,56 @@
+import threading
+from collections import OrderedDict
+
 from django import template
+from django.template.loader import get_template
+
+from rosary import metrics
+
 register = template.Library()
 
-@register.filter
-def index(sequence, position):
-    try:
-        return sequence[position]
-    except IndexError:
-        return None
+STRIP_TEMPLATE = 'rosary/includes/bead_strip.html'
+# About 80 positions per mystery set, with room for a content change.
+STRIP_CACHE_SIZE = 1024
+
+_strips = OrderedDict()
+_strips_lock = threading.Lock()
+_strip_stats = {'hits': 0, 'misses': 0}
+
+
+def _states(segment, position):
+    return [
+        'done' if i < position else 'current' if i == position else 'todo'
+        for i in range(segment.start, segment.end)
+    ]
+
+
+def render_bead_strip(compiled, position):
+    segments = compiled.segments
+    return get_template(STRIP_TEMPLATE).render({
+        'intro': _states(segments[0], position),
+        'decades': [(decade.title, _states(decade, position)) for decade in compiled.decades],
+        'conclusion': _states(segments[-1], position),
+    })
+
+
+@register.simple_tag
+def bead_strip(compiled, position):
+    """The bead progress strip for a compiled sequence, highlighting the bead at
+    ``position`` (0-based). Rendered once per set, content version and position."""
+    key = (compiled.set_id, compiled.etag, position)
+    with _strips_lock:
+        html = _strips.get(key)
+        if html is not None:
+            _strips.move_to_end(key)
+            _strip_stats['hits'] += 1
+            return html
+        _strip_stats['misses'] += 1
+    html = render_bead_strip(compiled, position)
+    with _strips_lock:
+        _strips[key] = html
+        while len(_strips) > STRIP_CACHE_SIZE:
+            _strips.popitem(last=False)
+    return html
+
 
-@register.filter    
-def make_range(value):
-    return range(value)
+metrics.register_cache('bead_strip', lambda: {**_strip_stats, 'size': len(_strips)})
@@ -1,3 +1,1319 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib
+import io
+import json
+import os
+import random
+import re
+import stat
+import sys
+import tempfile
+import uuid
+from types import SimpleNamespace
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections
+from django.http import StreamingHttpResponse
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.template import engines
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    db_tuning, export, geo, heartbeat, live, metrics, presence, progress, retention, rollups, routers, sequence,
+    shared_presence, slow_queries, tiles, views, warmup,
+)
+from .models import (
+    DailyPrayerCount, MonthlyPrayerSummary, MysterySet, Prayer, PrayerActivity, PrayerSession,
+    RosaryCheckpoint, RollupWatermark, UserDailyPrayerCount,
+)
+from .rollups import day_bounds
+from .templatetags import rosary_extras
+
+PLAN_USERS = 2000
+PLAN_SESSIONS_PER_USER = 10
+PLAN_DAYS = 60
+
+
+class QueryPlanTests(TestCase):
+    """Run EXPLAIN on the hot queries and fail on full table scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        now = timezone.now()
+        today = timezone.localdate()
+        User.objects.bulk_create(
+            [User(username=f"plan{i}", password="!") for i in range(PLAN_USERS)],
+            batch_size=500,
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        cls.user_id = user_ids[0]
+
+        PrayerActivity.objects.bulk_create(
+            [
+                PrayerActivity(
+                    user_id=user_id,
+                    region=rng.choice(["England", "Ontario", "Nigeria", "California"]),
+                    last_active=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                )
+                for user_id in user_ids
+            ],
+            batch_size=500,
+        )
+        PrayerSession.objects.bulk_create(
+            [
+                PrayerSession(
+                    user_id=user_id,
+                    decades=0b11111,
+                    completed=True,
+                    started_at=now - timedelta(days=rng.randint(0, PLAN_DAYS)),
+                )
+                for user_id in user_ids
+                for _ in range(PLAN_SESSIONS_PER_USER)
+            ],
+            batch_size=500,
+        )
+        DailyPrayerCount.objects.bulk_create(
+            [DailyPrayerCount(day=today - timedelta(days=d), count=1) for d in range(PLAN_DAYS)]
+        )
+        UserDailyPrayerCount.objects.bulk_create(
+            [
+                UserDailyPrayerCount(
+                    user_id=user_id, day=today - timedelta(days=d), count=1
+                )
+                for user_id in user_ids
+                for d in range(0, PLAN_DAYS, 7)
+            ],
+            batch_size=500,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Any sequential scan left after this means no index can serve the query.
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def hot_queries(self):
+        now = timezone.now()
+        today = timezone.localdate()
+        since = today - timedelta(days=365)
+        start, end = day_bounds(today)
+        user_rollups = UserDailyPrayerCount.objects.filter(user_id=self.user_id)
+        return {
+            'presence rebuild': PrayerActivity.objects
+                .filter(last_active__gte=now - timedelta(minutes=60))
+                .values_list('user_id', 'region', 'last_active'),
+            'heartbeat lookup': PrayerActivity.objects.filter(user_id=self.user_id),
+            'stats user days': user_rollups.filter(day__gte=since)
+                .values('day').order_by('day'),
+            'stats user mysteries': user_rollups.values('mystery_set').order_by('mystery_set'),
+            'stats global days': DailyPrayerCount.objects.filter(day__gte=since)
+                .values('day', 'count').order_by('day'),
+            # The ETag aggregates read the same rows.
+            'stats user etag': user_rollups.values('updated_at'),
+            'stats global etag': DailyPrayerCount.objects.filter(day__gte=since).values('updated_at'),
+            'reconcile chunk': PrayerSession.objects.filter(id__gt=0)
+                .order_by('id').values_list('id', 'started_at')[:1000],
+            'reconcile day': PrayerSession.objects
+                .filter(started_at__gte=start, started_at__lt=end)
+                .values_list('user_id', 'mystery_set_id'),
+            'reconcile day rollups': UserDailyPrayerCount.objects.filter(day=today),
+            'user sessions': PrayerSession.objects.filter(user_id=self.user_id)
+                .order_by('started_at'),
+        }
+
+    def full_scans(self, plan):
+        if connection.vendor == 'sqlite':
+            # "SCAN <table>" without "USING ... INDEX" reads every row of the table.
+            return re.findall(r'\bSCAN (?:TABLE )?(\w+)(?![^\n]*\bUSING\b)', plan)
+        if connection.vendor == 'postgresql':
+            return re.findall(r'Seq Scan on (\w+)', plan)
+        self.skipTest(f"No plan check for {connection.vendor}")
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                self.assertEqual(self.full_scans(plan), [], f"{name}:\n{plan}")
+
+
+# Pages render without collectstatic's manifest.
+without_static_manifest = override_settings(STORAGES={
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+@without_static_manifest
+class RosaryTestCase(TestCase):
+    """Tests that need the prayers and mystery sets."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_rosary_data', stdout=io.StringIO())
+
+    def setUp(self):
+        # Compiled sequences are cached per process and keyed by set id.
+        sequence.invalidate()
+
+
+class RosaryResumeTests(RosaryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user('resume', password='!')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.set_id = sequence.mystery_set_for_day(timezone.now().strftime('%A'))
+        self.decade = sequence.get_sequence(self.set_id).decades[1]
+        self.client.get(reverse('rosary_start'))
+        # pray.js syncs straight away on entering a decade, then debounced.
+        for position in (self.decade.start, self.decade.start + 4):
+            self.client.post(
+                reverse('rosary_progress_api'),
+                json.dumps({'set_id': self.set_id, 'position': position}),
+                content_type='application/json',
+            )
+
+    def sync(self, set_id, position):
+        return self.client.post(
+            reverse('rosary_progress_api'), json.dumps({'set_id': set_id, 'position': position}),
+            content_type='application/json',
+        ).json()
+
+    def pray_position(self):
+        response = self.client.get(reverse('rosary_start'), follow=True)
+        self.assertEqual(response.redirect_chain[-1][0], reverse('rosary_pray'))
+        return response.context['rosary_config']['position']
+
+    def test_reload_resumes_where_the_cookie_left_off(self):
+        self.assertEqual(self.pray_position(), self.decade.start + 4)
+
+    def test_lost_cookie_resumes_at_start_of_decade(self):
+        del self.client.cookies[progress.COOKIE_NAME]
+        self.assertEqual(self.pray_position(), self.decade.start)
+
+    def test_completion_must_match_the_set_under_way(self):
+        other = next(set_id for set_id in sequence.get_catalog().sets if set_id != self.set_id)
+        total = len(sequence.get_sequence(other).beads)
+        self.assertEqual(self.sync(other, total), {'position': total, 'completed': False})
+        self.assertFalse(PrayerSession.objects.filter(user=self.user).exists())
+        self.assertEqual(self.pray_position(), self.decade.start + 4)
+
+        total = len(sequence.get_sequence(self.set_id).beads)
+        self.assertEqual(self.sync(self.set_id, total), {'position': total, 'completed': True})
+        self.assertEqual(self.sync(self.set_id, total), {'position': total, 'completed': False})
+        self.assertEqual(
+            list(PrayerSession.objects.filter(user=self.user).values_list('mystery_set_id', flat=True)),
+            [self.set_id],
+        )
+
+    def test_entering_writes_nothing(self):
+        cookie = self.client.cookies[progress.COOKIE_NAME].value
+        self.pray_position()
+        self.assertEqual(self.client.cookies[progress.COOKIE_NAME].value, cookie)
+        checkpoint = RosaryCheckpoint.objects.get(user=self.user)
+        self.assertEqual((checkpoint.mystery_set_id, checkpoint.position), (self.set_id, self.decade.start))
+
+
+class VendoredAssetsTests(RosaryTestCase):
+    ASSET = re.compile(r'(?:src|href)="([^"]+\.(?:js|css))"')
+
+    def assets(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return self.ASSET.findall(response.content.decode())
+
+    def test_pages_load_local_assets_only(self):
+        self.client.force_login(User.objects.create_user("assets"))
+        pages = {url: self.assets(reverse(url)) for url in ('home', 'heatmap', 'stats')}
+        for url, assets in pages.items():
+            for asset in assets:
+                with self.subTest(url=url, asset=asset):
+                    self.assertTrue(asset.startswith(settings.STATIC_URL))
+                    self.assertIsNotNone(finders.find(asset.removeprefix(settings.STATIC_URL)))
+        # Only the pages that draw with Leaflet or Chart.js load them.
+        loaded = {url: {asset.split('/')[-2] for asset in assets} for url, assets in pages.items()}
+        self.assertEqual(loaded['home'], {'bootstrap'})
+        self.assertEqual(loaded['heatmap'], {'bootstrap', 'leaflet', 'leaflet.heat'})
+        self.assertEqual(loaded['stats'], {'bootstrap', 'chartjs'})
+
+
+@override_settings(ROSARY_SEQUENCE_VERSION_CHECK_INTERVAL=0)
+class SequenceCacheTests(RosaryTestCase):
+    def hail_mary_texts(self):
+        set_id = sequence.get_catalog().weekdays['Monday']
+        return {bead.text for bead in sequence.get_sequence(set_id).beads if bead.name == "Hail Mary"}
+
+    def test_edit_in_another_process_drops_the_cache(self):
+        original = self.hail_mary_texts()
+        # Another worker's edit: no signal reaches this process.
+        Prayer.objects.filter(name="Hail Mary").update(text="Edited")
+        self.assertEqual(self.hail_mary_texts(), original)
+        sequence.bump_version()
+        self.assertEqual(self.hail_mary_texts(), {"Edited"})
+
+    def test_save_bumps_the_shared_version(self):
+        version = sequence.content_version()
+        Prayer.objects.get(name="Hail Mary").save()
+        self.assertEqual(sequence.content_version(), version + 1)
+
+
+class BeadStripTests(RosaryTestCase):
+    def setUp(self):
+        super().setUp()
+        rosary_extras._strips.clear()
+        catalog = sequence.get_catalog()
+        self.joyful = sequence.get_sequence(catalog.weekdays['Monday'])
+        self.sorrowful = sequence.get_sequence(catalog.weekdays['Tuesday'])
+
+    def test_cached_per_set_and_position(self):
+        strips = {
+            (compiled.set_id, position): rosary_extras.bead_strip(compiled, position)
+            for compiled in (self.joyful, self.sorrowful) for position in (0, 5)
+        }
+        self.assertEqual(len(rosary_extras._strips), 4)
+        self.assertEqual(strips[self.joyful.set_id, 5].count('dot done'), 5)
+        self.assertIn('dot current', strips[self.joyful.set_id, 5])
+        self.assertNotEqual(strips[self.joyful.set_id, 0], strips[self.joyful.set_id, 5])
+        # Same beads, different mystery titles.
+        self.assertNotEqual(strips[self.joyful.set_id, 0], strips[self.sorrowful.set_id, 0])
+
+        hits = rosary_extras._strip_stats['hits']
+        self.assertEqual(rosary_extras.bead_strip(self.joyful, 5), strips[self.joyful.set_id, 5])
+        self.assertEqual(rosary_extras._strip_stats['hits'], hits + 1)
+        self.assertEqual(len(rosary_extras._strips), 4)
+
+
+class CompletionsApiTests(RosaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("offline")
+        self.client.force_login(self.user)
+        self.set_id = sequence.get_catalog().weekdays['Monday']
+
+    def completion(self, client_id=None, **overrides):
+        return {
+            'client_id': str(client_id or uuid.uuid4()),
+            'set_id': self.set_id,
+            'completed_at': (timezone.now() - timedelta(hours=1)).isoformat(),
+            **overrides,
+        }
+
+    def upload(self, *completions, client=None):
+        return (client or self.client).post(
+            reverse('rosary_completions_api'), json.dumps({'completions': list(completions)}),
+            content_type='application/json',
+        )
+
+    def counted(self, user):
+        return sum(UserDailyPrayerCount.objects.filter(user=user).values_list('count', flat=True))
+
+    def test_retried_upload_is_counted_once(self):
+        item = self.completion()
+        self.assertEqual(self.upload(item).json()['results'], {item['client_id']: 'created'})
+        self.assertEqual(self.upload(item).json()['results'], {item['client_id']: 'duplicate'})
+        self.assertEqual(PrayerSession.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.counted(self.user), 1)
+
+    def test_bad_items_are_reported_and_the_rest_recorded(self):
+        good = self.completion()
+        unknown_set = self.completion(set_id=0)
+        naive = self.completion(completed_at='2026-01-01T10:00:00')
+        too_old = self.completion(completed_at=(timezone.now() - timedelta(days=365)).isoformat())
+        response = self.upload(good, unknown_set, naive, too_old, 'not an object', {'set_id': self.set_id})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[good['client_id']], 'created')
+        self.assertEqual(results[unknown_set['client_id']], "Unknown mystery set.")
+        self.assertIn("offset", results[naive['client_id']])
+        self.assertIn("too old", results[too_old['client_id']])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(self.counted(self.user), 1)
+
+    @override_settings(ROSARY_COMPLETIONS_MAX_BATCH=2)
+    def test_batch_size_is_capped(self):
+        response = self.upload(self.completion(), self.completion(), self.completion())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PrayerSession.objects.filter(user=self.user).exists())
+        self.assertEqual(self.upload(self.completion(), self.completion()).status_code, 200)
+
+    def test_client_ids_are_per_user(self):
+        item = self.completion()
+        other = User.objects.create_user("other")
+        other_client = self.client_class()
+        other_client.force_login(other)
+        self.assertEqual(self.upload(item).json()['results'], {item['client_id']: 'created'})
+        self.assertEqual(self.upload(item, client=other_client).json()['results'], {item['client_id']: 'created'})
+        self.assertEqual(self.counted(self.user), 1)
+        self.assertEqual(self.counted(other), 1)
+
+    def test_requires_sign_in(self):
+        self.client.logout()
+        self.assertEqual(self.upload(self.completion()).status_code, 403)
+
+
+class ConditionalGetTests(RosaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("cached")
+        self.client.force_login(self.user)
+
+    def revalidate(self, url, queries):
+        """GET ``url``, then again with its ETag, which must answer 304 in ``queries`` queries."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], etag)
+        self.assertEqual(again.content, b'')
+        return again
+
+    def test_stats_page(self):
+        rollups.record_completed_session(self.user, sequence.get_catalog().weekdays['Monday'], 0b11111)
+        # The first visit issues the CSRF cookie that the validator covers.
+        self.client.get(reverse('stats'))
+        # Session, user and one aggregate per rollup table; the rollups themselves are not read.
+        response = self.revalidate(reverse('stats'), 4)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        etag = self.client.get(reverse('stats'))['ETag']
+        rollups.record_completed_session(self.user, sequence.get_catalog().weekdays['Monday'], 0b11111)
+        self.assertEqual(self.client.get(reverse('stats'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_homepage(self):
+        self.client.logout()
+        response = self.revalidate(reverse('home'), 0)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_heatmap_tile_is_shared(self):
+        url = reverse('heatmap_tile', args=(0, 0, 0))
+        tiles.get_index().ensure_fresh()
+        response = self.revalidate(url, 0)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={views.PRESENCE_MAX_AGE}')
+        # Signed in or not, the tile does not depend on the session.
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertNotIn('Cookie', self.client.get(url).get('Vary', ''))
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("rollup")
+        self.joyful = MysterySet.objects.create(name="Joyful", days="Monday, Saturday")
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+    def session(self, day, mystery_set=None):
+        started_at = timezone.make_aware(datetime.combine(day, time(12)))
+        return PrayerSession.objects.create(
+            user=self.user, mystery_set=mystery_set, started_at=started_at, completed=True,
+        )
+
+    def counts(self):
+        return {
+            'daily': dict(DailyPrayerCount.objects.values_list('day', 'count')),
+            'user': {
+                (day, set_id): count for day, set_id, count in
+                UserDailyPrayerCount.objects.values_list('day', 'mystery_set_id', 'count')
+            },
+        }
+
+    def test_record_session(self):
+        for mystery_set in (self.joyful, None, None):
+            rollups.record_session(self.session(self.today, mystery_set))
+        self.assertEqual(self.counts(), {
+            'daily': {self.today: 3},
+            'user': {(self.today, self.joyful.pk): 1, (self.today, None): 2},
+        })
+
+    def test_one_row_without_mystery_set_per_user_and_day(self):
+        UserDailyPrayerCount.objects.create(user=self.user, day=self.today, count=1)
+        with self.assertRaises(IntegrityError):
+            UserDailyPrayerCount.objects.create(user=self.user, day=self.today, count=1)
+
+    def test_reconcile_only_reads_past_the_watermark(self):
+        self.session(self.yesterday, self.joyful)
+        self.assertEqual(rollups.reconcile(), (1, 1))
+        # Drift on a day already reconciled is left alone by the next run.
+        DailyPrayerCount.objects.filter(day=self.yesterday).update(count=7)
+        self.session(self.today)
+        self.assertEqual(rollups.reconcile(), (1, 1))
+        self.assertEqual(self.counts(), {
+            'daily': {self.yesterday: 7, self.today: 1},
+            'user': {(self.yesterday, self.joyful.pk): 1, (self.today, None): 1},
+        })
+        self.assertEqual(
+            RollupWatermark.objects.get(name=rollups.SESSION_WATERMARK).last_session_id,
+            PrayerSession.objects.latest('id').id,
+        )
+        self.assertEqual(rollups.reconcile(), (0, 0))
+
+    def test_full_reconcile_rebuilds_everything(self):
+        self.session(self.yesterday, self.joyful)
+        self.session(self.yesterday)
+        rollups.reconcile()
+        DailyPrayerCount.objects.filter(day=self.yesterday).update(count=7)
+        UserDailyPrayerCount.objects.create(user=self.user, day=self.today, count=3)
+        call_command('reconcile_rollups', '--full', '--chunk-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.counts(), {
+            'daily': {self.yesterday: 2},
+            'user': {(self.yesterday, self.joyful.pk): 1, (self.yesterday, None): 1},
+        })
+
+    def test_deleting_a_mystery_set_merges_its_counts(self):
+        for mystery_set in (self.joyful, None):
+            rollups.record_session(self.session(self.today, mystery_set))
+        self.joyful.delete()
+        self.assertEqual(self.counts()['user'], {(self.today, None): 2})
+
+
+class SeedingTests(TestCase):
+    def rollup_rows(self):
+        return (
+            sorted(UserDailyPrayerCount.objects.values_list('user_id', 'day', 'mystery_set_id', 'count')),
+            sorted(DailyPrayerCount.objects.values_list('day', 'count')),
+        )
+
+    def test_seeding_is_idempotent(self):
+        call_command('seed_rosary_data', stdout=io.StringIO())
+        counts = [model.objects.count() for model in (Prayer, MysterySet)]
+        call_command('seed_rosary_data', stdout=io.StringIO())
+        self.assertEqual([model.objects.count() for model in (Prayer, MysterySet)], counts)
+
+    def test_generated_dataset(self):
+        call_command('seed_rosary_data', stdout=io.StringIO())
+        options = ['--users', '5', '--sessions-per-user', '3', '--days', '10', '--chunk-size', '2',
+                   '--batch-size', '4']
+        call_command('generate_dataset', *options, stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='synthetic-').count(), 5)
+        self.assertEqual(PrayerActivity.objects.count(), 5)
+        self.assertEqual(PrayerSession.objects.count(), 15)
+        self.assertTrue(self.client.login(username='synthetic-000000004', password='synthetic-pass-123'))
+
+        # Re-running adds nothing, and the rollups written alongside match a rebuild.
+        call_command('generate_dataset', *options, stdout=io.StringIO())
+        self.assertEqual(PrayerSession.objects.count(), 15)
+        generated = self.rollup_rows()
+        self.assertEqual(sum(count for _, count in generated[1]), 15)
+        rollups.reconcile(full=True)
+        self.assertEqual(self.rollup_rows(), generated)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("retained")
+        self.other = User.objects.create_user("recent")
+        self.joyful = MysterySet.objects.create(name="Joyful", days="Monday, Saturday")
+        self.now = timezone.now()
+        self.old = self.now - timedelta(days=60)
+        self.month = retention.month_of(self.old)
+        PrayerActivity.objects.create(user=self.user, region="Lazio", last_active=self.now - timedelta(days=100))
+        PrayerActivity.objects.create(user=self.other, region="Texas", last_active=self.now)
+        self.sessions = [self.session(self.old, self.joyful) for _ in range(3)] + [self.session(self.old)]
+        self.recent = self.session(self.now, self.joyful)
+        rollups.reconcile()
+        # Not rolled up yet, so not compacted.
+        self.pending = self.session(self.old, self.joyful)
+
+    def session(self, started_at, mystery_set=None):
+        return PrayerSession.objects.create(
+            user=self.user, mystery_set=mystery_set, started_at=started_at, completed=True,
+        )
+
+    def summaries(self):
+        return {
+            (month, set_id): count
+            for month, set_id, count in MonthlyPrayerSummary.objects.values_list('month', 'mystery_set_id', 'count')
+        }
+
+    def retain(self, *args):
+        stdout = io.StringIO()
+        call_command('apply_retention', '--activity-days', '30', '--session-days', '30', '--chunk-size', '2',
+                     '--pause', '0', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_prune_activity(self):
+        self.assertEqual(retention.prune_activity(self.now - timedelta(days=30), chunk_size=1), 1)
+        self.assertEqual(list(PrayerActivity.objects.values_list('user_id', flat=True)), [self.other.pk])
+
+    def test_compact_sessions(self):
+        MonthlyPrayerSummary.objects.create(user=self.user, month=self.month, mystery_set=self.joyful, count=5)
+        self.assertEqual(retention.compact_sessions(self.now - timedelta(days=30), chunk_size=2), 4)
+        self.assertEqual(
+            set(PrayerSession.objects.values_list('id', flat=True)), {self.recent.pk, self.pending.pk},
+        )
+        self.assertEqual(self.summaries(), {(self.month, self.joyful.pk): 8, (self.month, None): 1})
+        # The daily rollups still count the compacted sessions.
+        self.assertEqual(sum(DailyPrayerCount.objects.values_list('count', flat=True)), 5)
+
+    def test_dry_run_changes_nothing(self):
+        output = self.retain('--dry-run')
+        self.assertIn("Would delete 1 activity row(s)", output)
+        self.assertIn("Would compact 4 session(s)", output)
+        self.assertIn("into 2 monthly summary row(s)", output)
+        self.assertIn("1 older session(s) are not rolled up yet", output)
+        self.assertEqual(PrayerActivity.objects.count(), 2)
+        self.assertEqual(PrayerSession.objects.count(), 6)
+        self.assertFalse(MonthlyPrayerSummary.objects.exists())
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = self.retain('--archive-dir', directory)
+            archived = {}
+            for name in sorted(os.listdir(directory)):
+                with gzip.open(os.path.join(directory, name), 'rt') as archive:
+                    archived[name.split('-')[0]] = [json.loads(line) for line in archive]
+        self.assertIn("Deleted 1 stale activity row(s)", output)
+        self.assertIn("Compacted 4 session(s)", output)
+        self.assertEqual([row['user_id'] for row in archived['activity']], [self.user.pk])
+        self.assertEqual([row['id'] for row in archived['sessions']], [session.pk for session in self.sessions])
+        self.assertEqual(list(archived['sessions'][0]), retention.SESSION_FIELDS)
+
+    def test_full_reconcile_refused_after_compaction(self):
+        self.retain()
+        with self.assertRaises(CommandError):
+            call_command('reconcile_rollups', '--full', stdout=io.StringIO())
+        self.assertEqual(sum(DailyPrayerCount.objects.values_list('count', flat=True)), 5)
+
+
+class GeoIPTests(RosaryTestCase):
+    def tearDown(self):
+        geo.set_resolver(None)
+
+    def test_corrupt_database_disables_lookups_once(self):
+        with tempfile.NamedTemporaryFile(suffix='.mmdb') as database:
+            database.write(random.Random(0).randbytes(4096))
+            database.flush()
+            resolver = geo.GeoIPResolver(db_path=database.name)
+            with self.assertLogs('rosary.geo', 'WARNING') as logs:
+                self.assertEqual(resolver.resolve('203.0.113.5'), geo.UNKNOWN)
+                self.assertEqual(resolver.resolve('203.0.113.6'), geo.UNKNOWN)
+        self.assertEqual(len(logs.records), 1)
+
+    def test_middleware_records_the_resolved_location(self):
+        geo.set_resolver(geo.StubResolver({'203.0.113.5': ("Lazio", 41.9, 12.5)}))
+        heartbeat.reset()  # forget users already seen by earlier tests
+        user = User.objects.create_user("located")
+        self.client.force_login(user)
+        self.client.get(reverse('home'), REMOTE_ADDR='203.0.113.5')
+        activity = PrayerActivity.objects.get(user=user)
+        self.assertEqual((activity.region, activity.lat, activity.lng), ("Lazio", 41.9, 12.5))
+
+
+class PresenceAggregatorTests(TestCase):
+    def setUp(self):
+        self.now = timezone.make_aware(datetime(2026, 3, 2, 12, 0, 30))
+        patcher = mock.patch.object(timezone, 'now', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.aggregator = presence.PresenceAggregator(horizon=10, rebuild_interval=3600)
+
+    def ago(self, minutes):
+        return self.now - timedelta(minutes=minutes)
+
+    def test_window_covers_the_last_n_minutes(self):
+        self.aggregator.record(1, "Lazio", when=self.ago(4))
+        self.aggregator.record(2, "Texas", when=self.ago(5))
+        self.aggregator.record(3, "Texas")
+        self.assertEqual(self.aggregator.counts(5), {"Lazio": 1, "Texas": 1})
+        self.assertEqual(self.aggregator.counts(6), {"Lazio": 1, "Texas": 2})
+        self.assertEqual(self.aggregator.counts(1), {"Texas": 1})
+
+    def test_user_is_counted_once_in_their_latest_minute(self):
+        self.aggregator.record(1, "Lazio", when=self.ago(3))
+        self.aggregator.record(1, "Texas")
+        # An older heartbeat arriving late changes nothing.
+        self.aggregator.record(1, "Bavaria", when=self.ago(1))
+        self.assertEqual(self.aggregator.counts(10), {"Texas": 1})
+
+    def test_buckets_expire_past_the_horizon(self):
+        self.aggregator.record(1, "Lazio")
+        self.now += timedelta(minutes=10)
+        self.assertEqual(self.aggregator.counts(10), {})
+        # The ring slot is reused for the new minute.
+        self.aggregator.record(2, "Texas")
+        self.assertEqual(self.aggregator.counts(10), {"Texas": 1})
+        self.aggregator.record(3, "Texas", when=self.ago(10))
+        self.assertEqual(self.aggregator.counts(10), {"Texas": 1})
+
+    def test_rebuild_reads_activity_and_keeps_newer_heartbeats(self):
+        for name, region, minutes in [("fresh", "Lazio", 2), ("stale", "Lazio", 30), ("moved", "Bavaria", 5)]:
+            user = User.objects.create_user(name)
+            PrayerActivity.objects.create(user=user, region=region, last_active=self.ago(minutes))
+        moved = User.objects.get(username="moved")
+        # Not written to the database yet.
+        self.aggregator.record(moved.pk, "Texas")
+        self.aggregator.rebuild()
+        self.assertEqual(self.aggregator.counts(10), {"Lazio": 1, "Texas": 1})
+        self.assertEqual(self.aggregator.counts(1), {"Texas": 1})
+
+
+class SharedPresenceTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'presence.bin')
+        self.registry = self.open_registry()
+
+    def open_registry(self):
+        registry = shared_presence.SharedPresenceRegistry(
+            horizon=5, rebuild_interval=3600, path=self.path, capacity=16, max_regions=3,
+        )
+        self.addCleanup(registry.close)
+        return registry
+
+    def test_heartbeats_are_shared_between_registries(self):
+        self.registry.record(1, "Lazio")
+        self.open_registry().record(2, "Lazio")
+        self.assertEqual(self.registry.counts(5), {"Lazio": 2})
+
+    def test_rebuild_drops_expired_users_and_regions(self):
+        now = timezone.now()
+        self.registry.record(1, "Bavaria")
+        self.registry.record(2, "Lazio", when=now - timedelta(minutes=4))
+        self.registry.record(3, "Texas", when=now - timedelta(minutes=4))
+        self.assertEqual(self.registry.counts(5), {"Bavaria": 1, "Lazio": 1, "Unknown": 1})
+        with mock.patch.object(timezone, 'now', return_value=now + timedelta(minutes=2)):
+            self.registry.rebuild()
+            self.assertEqual(self.registry.counts(5), {"Bavaria": 1})
+            # The region table was full; compaction made room again.
+            self.registry.record(4, "Texas")
+            self.assertEqual(self.registry.counts(5), {"Bavaria": 1, "Texas": 1})
+
+    def test_long_region_names_keep_their_slot(self):
+        region = "é" * 40  # 80 bytes, more than a slot holds
+        self.registry.record(1, region)
+        self.registry.record(2, region)
+        self.assertEqual(self.registry.counts(5), {"é" * 32: 2})
+        self.assertEqual(self.registry._get(shared_presence.REGIONS_USED), 2)
+
+    def test_counts_add_up_regions_with_the_same_name(self):
+        self.registry.record(1, "Lazio")
+        self.registry.record(2, "Texas")
+        with mock.patch.object(self.registry, '_region_name', return_value="Lazio"):
+            self.assertEqual(self.registry.counts(5), {"Lazio": 2})
+
+    def test_rebuild_keeps_heartbeats_recorded_while_merging(self):
+        self.registry.record(1, "Lazio")
+        other = self.open_registry()
+        merge = self.registry._merge
+
+        def merge_with_heartbeat(*args):
+            if other.counts(5)["Texas"] == 0:
+                other.record(2, "Texas")
+            return merge(*args)
+
+        with mock.patch.object(self.registry, '_merge', merge_with_heartbeat):
+            self.registry.rebuild()
+        self.assertEqual(self.registry.counts(5), {"Lazio": 1, "Texas": 1})
+
+
+@override_settings(ROSARY_HEATMAP_MAX_ZOOM=2, ROSARY_HEATMAP_TILE_BINS=2)
+class TileIndexTests(TestCase):
+    # Well inside their finest cells, so the grouping does not move them.
+    NIAMEY = (13.5, 2.1)
+    SYDNEY = (-33.9, 151.2)
+
+    def setUp(self):
+        for name, (lat, lng) in [("niamey-1", self.NIAMEY), ("niamey-2", self.NIAMEY), ("sydney", self.SYDNEY)]:
+            user = User.objects.create_user(name)
+            PrayerActivity.objects.create(user=user, region=name, lat=lat, lng=lng)
+        # Without coordinates, so not drawn.
+        PrayerActivity.objects.create(user=User.objects.create_user("unplaced"), region="Unknown")
+
+    def test_project(self):
+        self.assertEqual(tiles.project(0, 0, 2), (1, 1))
+        self.assertEqual(tiles.project(*self.NIAMEY, 4), (2, 1))
+        self.assertEqual(tiles.project(*self.SYDNEY, 4), (3, 2))
+        # Poles are clamped to the edge of the square world.
+        self.assertEqual(tiles.project(90, 180, 4), (3, 0))
+        self.assertEqual(tiles.project(-90, -180, 4), (0, 3))
+
+    def test_parent_tiles_sum_their_children(self):
+        index = tiles.get_index()
+        self.assertEqual(index.tile(0, 0, 0), {
+            'z': 0, 'x': 0, 'y': 0, 'bins': 2, 'max': 2, 'cells': [[1, 0, 2], [1, 1, 1]],
+        })
+        for z in range(3):
+            tiles_at_z = [index.tile(z, x, y) for x in range(2 ** z) for y in range(2 ** z)]
+            self.assertEqual(sum(count for tile in tiles_at_z for _, _, count in tile['cells']), 3)
+        niamey_x, niamey_y = tiles.project(*self.NIAMEY, 2 ** 2 * 2)
+        niamey = index.tile(2, niamey_x // 2, niamey_y // 2)
+        self.assertEqual(niamey['cells'], [[niamey_x % 2, niamey_y % 2, 2]])
+
+    def test_out_of_range_tiles_are_not_found(self):
+        self.assertEqual(self.client.get(reverse('heatmap_tile', args=(2, 3, 3))).status_code, 200)
+        for z, x, y in [(3, 0, 0), (1, 2, 0), (1, 0, 2), (0, 1, 0)]:
+            with self.subTest(z=z, x=x, y=y):
+                self.assertIsNone(tiles.get_index().tile(z, x, y))
+                self.assertEqual(self.client.get(reverse('heatmap_tile', args=(z, x, y))).status_code, 404)
+
+
+class BroadcasterTests(SimpleTestCase):
+    def snapshots(self, *snapshots):
+        """Patch ``build_snapshot`` to return each of ``snapshots`` in turn, then the last forever."""
+        remaining = list(snapshots)
+
+        def build_snapshot():
+            result = remaining.pop(0) if len(remaining) > 1 else remaining[0]
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        patcher = mock.patch.object(live, 'build_snapshot', build_snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def receive(self, queue):
+        return await asyncio.wait_for(queue.get(), timeout=1)
+
+    async def stop(self, broadcaster, *queues):
+        for queue in queues:
+            broadcaster.unsubscribe(queue)
+        await asyncio.wait_for(broadcaster._task, timeout=1)
+
+    async def test_snapshot_then_deltas(self):
+        self.snapshots(
+            {'active': 1, 'regions': {'Lazio': 1}},
+            {'active': 2, 'regions': {'Lazio': 1, 'Texas': 1}},
+            {'active': 1, 'regions': {'Texas': 1}},
+        )
+        broadcaster = live.Broadcaster(interval=0, queue_size=8)
+        queue = broadcaster.subscribe()
+        self.assertEqual(await self.receive(queue), live.encode_event('snapshot', {'active': 1, 'regions': {'Lazio': 1}}))
+        self.assertEqual(await self.receive(queue), live.encode_event('delta', {'active': 2, 'regions': {'Texas': 1}}))
+        self.assertEqual(await self.receive(queue), live.encode_event('delta', {'active': 1, 'regions': {'Lazio': 0}}))
+        # A later subscriber starts from the current state.
+        late = broadcaster.subscribe()
+        self.assertEqual(await self.receive(late), live.encode_event('snapshot', {'active': 1, 'regions': {'Texas': 1}}))
+        await self.stop(broadcaster, queue, late)
+
+    async def test_failed_tick_is_logged_and_retried(self):
+        self.snapshots(RuntimeError("database is locked"), {'active': 0, 'regions': {}})
+        broadcaster = live.Broadcaster(interval=0, queue_size=8)
+        with self.assertLogs('rosary.live', 'ERROR'):
+            queue = broadcaster.subscribe()
+            self.assertEqual(await self.receive(queue), live.encode_event('snapshot', {'active': 0, 'regions': {}}))
+        await self.stop(broadcaster, queue)
+
+    async def test_slow_client_is_dropped(self):
+        self.snapshots(*({'active': n, 'regions': {}} for n in range(4)))
+        broadcaster = live.Broadcaster(interval=0, queue_size=2)
+        slow = broadcaster.subscribe()
+        await asyncio.wait_for(broadcaster._task, timeout=1)  # ends once its only client is dropped
+        self.assertNotIn(slow, broadcaster._subscribers)
+        self.assertIsNone(slow.get_nowait())
+
+
+@override_settings(ROSARY_LIVE_INTERVAL=60)
+class LivePresenceTests(TestCase):
+    def setUp(self):
+        presence.reset()
+        self.addCleanup(presence.reset)
+        self.addCleanup(live.reset)
+        presence.get_aggregator().record(1, "Lazio")
+
+    def events(self):
+        response = self.client.get(reverse('live_presence'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join(response.streaming_content).decode()
+
+    def test_sync_workers_share_a_snapshot_per_tick(self):
+        snapshot = {'active': 1, 'active_regions': {'Lazio': 1}, 'regions': {'Lazio': 1}}
+        with mock.patch.object(live, 'build_snapshot', wraps=live.build_snapshot) as build:
+            first = self.events()
+            presence.get_aggregator().record(2, "Texas")
+            self.assertEqual(self.events(), first)
+        self.assertIn(live.encode_event('snapshot', snapshot), first)
+        self.assertEqual(build.call_count, 1)
+
+        live.reset()
+        self.assertIn('"active":2', self.events())
+
+    def test_deltas_carry_the_active_regions(self):
+        previous = live.build_snapshot()
+        presence.get_aggregator().record(2, "Texas")
+        presence.get_aggregator().record(1, "Bavaria")
+        delta = live.diff_snapshots(previous, live.build_snapshot())
+        self.assertEqual(delta['active'], 2)
+        self.assertEqual(delta['active_regions'], {'Lazio': 0, 'Bavaria': 1, 'Texas': 1})
+
+
+class ConvertMysteryLabelsMigrationTests(TransactionTestCase):
+    before = [('rosary', '0012_session_mystery_set')]
+    after = [('rosary', '0013_convert_mystery_labels')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        apps = self.migrate(self.before)
+        MysterySet = apps.get_model('rosary', 'MysterySet')
+        PrayerSession = apps.get_model('rosary', 'PrayerSession')
+        UserDailyPrayerCount = apps.get_model('rosary', 'UserDailyPrayerCount')
+        MonthlyPrayerSummary = apps.get_model('rosary', 'MonthlyPrayerSummary')
+        self.joyful = MysterySet.objects.create(name="Joyful", days="Monday, Saturday").pk
+        self.sorrowful = MysterySet.objects.create(name="Sorrowful", days="Tuesday, Friday").pk
+        self.user_id = apps.get_model('auth', 'User').objects.create(username="labelled").pk
+        now = timezone.now()
+        self.day, self.month = timezone.localdate(now), timezone.localdate(now).replace(day=1)
+        for label, completed in [("Joyful", True), (" joyful ", True), ("Sorrowful", False),
+                                 ("Full Rosary", True), ("Luminous", True)]:
+            PrayerSession.objects.create(user_id=self.user_id, mystery=label, started_at=now, completed=completed)
+        for label, count in [("Joyful", 2), ("JOYFUL", 3), ("Full Rosary", 1), ("Luminous", 4)]:
+            UserDailyPrayerCount.objects.create(user_id=self.user_id, day=self.day, mystery=label, count=count)
+        for label, count in [("Sorrowful", 4), ("sorrowful", 1)]:
+            MonthlyPrayerSummary.objects.create(user_id=self.user_id, month=self.month, mystery=label, count=count)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_labels_become_mystery_sets(self):
+        apps = self.migrate(self.after)
+        sessions = apps.get_model('rosary', 'PrayerSession').objects.order_by('id')
+        self.assertEqual(list(sessions.values_list('mystery_set_id', 'decades')), [
+            (self.joyful, 0b11111), (self.joyful, 0b11111), (self.sorrowful, 0),
+            (None, 0b11111), (None, 0b11111),
+        ])
+        daily = apps.get_model('rosary', 'UserDailyPrayerCount').objects
+        self.assertCountEqual(daily.values_list('mystery_set_id', 'count'), [(None, 5), (self.joyful, 5)])
+        monthly = apps.get_model('rosary', 'MonthlyPrayerSummary').objects
+        self.assertEqual(list(monthly.values_list('mystery_set_id', 'count')), [(self.sorrowful, 5)])
+
+    def test_reverse_restores_labels(self):
+        self.migrate(self.after)
+        apps = self.migrate(self.before)
+        sessions = apps.get_model('rosary', 'PrayerSession').objects.order_by('id')
+        self.assertEqual(
+            list(sessions.values_list('mystery', flat=True)),
+            ["Joyful", "Joyful", "Sorrowful", "Full Rosary", "Full Rosary"],
+        )
+        daily = apps.get_model('rosary', 'UserDailyPrayerCount').objects
+        self.assertEqual(sorted(daily.values_list('mystery', 'count')), [("Full Rosary", 5), ("Joyful", 5)])
+        monthly = apps.get_model('rosary', 'MonthlyPrayerSummary').objects
+        self.assertEqual(list(monthly.values_list('mystery', 'count')), [("Sorrowful", 5)])
+
+
+class MigrateOtherDatabaseTests(SimpleTestCase):
+    """Data migrations must only touch the database being migrated."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Added after the runner has set up the test databases, so it is left
+        # alone; queries against 'default' fail the test.
+        connections.settings['scratch'] = connections.configure_settings({
+            'default': settings.DATABASES['default'],
+            'scratch': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ''},
+        })['scratch']
+        cls.addClassCleanup(connections.settings.pop, 'scratch')
+        cls.databases = {'scratch'}
+        super().setUpClass()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings['scratch']['NAME'] = os.path.join(directory.name, 'scratch.sqlite3')
+        self.addCleanup(self.disconnect)
+
+    def disconnect(self):
+        connections['scratch'].close()
+        del connections['scratch']
+
+    def migrate(self, app_label, name):
+        executor = MigrationExecutor(connections['scratch'])
+        executor.migrate([(app_label, name)])
+        return executor.loader.project_state([(app_label, name)]).apps
+
+    def test_activity_dedupe(self):
+        apps = self.migrate('rosary', '0006_dailyprayercount_rollupwatermark_and_more')
+        user = apps.get_model('auth', 'User').objects.using('scratch').create(username="scratch")
+        activity = apps.get_model('rosary', 'PrayerActivity').objects.using('scratch')
+        now = timezone.now()
+        for minutes, region in ((5, "Texas"), (0, "Lazio")):
+            activity.create(user_id=user.pk, region=region, last_active=now - timedelta(minutes=minutes))
+        self.migrate('rosary', '0007_dedupe_prayeractivity')
+        self.assertEqual(list(activity.values_list('region', flat=True)), ["Lazio"])
+
+    def test_rollup_merge(self):
+        apps = self.migrate('rosary', '0016_contentversion')
+        user = apps.get_model('auth', 'User').objects.using('scratch').create(username="scratch")
+        counts = apps.get_model('rosary', 'UserDailyPrayerCount').objects.using('scratch')
+        for count in (2, 3):
+            counts.create(user_id=user.pk, day=date(2026, 1, 1), count=count)
+        self.migrate('rosary', '0017_unique_rollups_without_mystery_set')
+        self.assertEqual(list(counts.values_list('count', flat=True)), [5])
+
+
+@without_static_manifest
+class ReplicaRoutingTests(TransactionTestCase):
+    """Reads and writes land on the right alias once a replica is configured."""
+
+    @classmethod
+    def setUpClass(cls):
+        # A test mirror: a second connection to the test database, as the
+        # runner sets up for DATABASE_REPLICA_URL.
+        default = connections.settings['default']
+        connections.settings[routers.REPLICA] = connections.configure_settings({
+            'default': default,
+            routers.REPLICA: {**default, 'TEST': {**default['TEST'], 'MIRROR': 'default'}},
+        })[routers.REPLICA]
+        cls.addClassCleanup(connections.settings.pop, routers.REPLICA)
+        cls.addClassCleanup(cls.disconnect)
+        cls.databases = {'default', routers.REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def disconnect(cls):
+        connections[routers.REPLICA].close()
+        del connections[routers.REPLICA]
+
+    def setUp(self):
+        call_command('seed_rosary_data', stdout=io.StringIO())
+        sequence.invalidate()
+        self.addCleanup(sequence.invalidate)
+        self.user = User.objects.create_user("routed")
+        self.client.force_login(self.user)
+        self.set_id = sequence.get_catalog().weekdays['Monday']
+
+    def queries(self, url, method='get', **kwargs):
+        """The response and the SQL run on ``(default, replica)``."""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, [q['sql'] for q in primary], [q['sql'] for q in replica]
+
+    def test_reads_go_to_the_replica(self):
+        response, primary, replica = self.queries(reverse('stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('rosary_userdailyprayercount' in sql for sql in replica))
+        self.assertFalse(any('rosary_userdailyprayercount' in sql for sql in primary))
+        # The user is resolved on the primary; a new account may not have replicated yet.
+        self.assertTrue(any('auth_user' in sql for sql in primary))
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_writes_go_to_the_primary(self):
+        token = routers._use_replica.set(True)
+        try:
+            with CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+                rollups.record_completed_session(self.user, self.set_id, 0b11111)
+        finally:
+            routers._use_replica.reset(token)
+        self.assertFalse(any(sql.startswith(('INSERT', 'UPDATE')) for sql in (q['sql'] for q in replica)))
+        self.assertEqual(PrayerSession.objects.using('default').filter(user=self.user).count(), 1)
+
+    def test_writes_pin_reads_to_the_primary(self):
+        completion = {
+            'client_id': str(uuid.uuid4()), 'set_id': self.set_id,
+            'completed_at': (timezone.now() - timedelta(hours=1)).isoformat(),
+        }
+        response, primary, replica = self.queries(
+            reverse('rosary_completions_api'), 'post',
+            data=json.dumps({'completions': [completion]}), content_type='application/json',
+        )
+        self.assertEqual(response.json()['results'], {completion['client_id']: 'created'})
+        self.assertEqual(replica, [])
+        self.assertTrue(any(sql.startswith('INSERT') and 'rosary_prayersession' in sql for sql in primary))
+        pin = response.cookies[routers.PIN_COOKIE]
+        self.assertEqual(pin['max-age'], settings.ROSARY_REPLICA_PIN_SECONDS)
+        self.assertTrue(pin['httponly'])
+
+        response, primary, replica = self.queries(reverse('stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, [])
+        self.assertTrue(any('rosary_userdailyprayercount' in sql for sql in primary))
+
+
+class ExportTests(RosaryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user("exporter")
+        cls.other = User.objects.create_user("other")
+        catalog = sequence.get_catalog()
+        cls.joyful, cls.sorrowful = catalog.weekdays['Monday'], catalog.weekdays['Tuesday']
+        today = timezone.localdate()
+        cls.days = [today - timedelta(days=n) for n in (3, 1, 0)]
+        for user, day, set_id in [(cls.user, cls.days[0], cls.joyful), (cls.user, cls.days[1], cls.sorrowful),
+                                  (cls.user, cls.days[2], cls.joyful), (cls.other, cls.days[2], cls.joyful)]:
+            PrayerSession.objects.create(
+                user=user, mystery_set_id=set_id, completed=True, decades=0b11111,
+                started_at=timezone.make_aware(datetime.combine(day, time(9))),
+            )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def export(self, name='export_sessions', **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return b''.join(response.streaming_content)
+
+    def rows(self, name='export_sessions', **params):
+        return list(csv.DictReader(io.StringIO(self.export(name, **params).decode())))
+
+    def test_csv(self):
+        rows = self.rows()
+        self.assertEqual(list(rows[0]), list(export.FIELDS))
+        self.assertEqual([row['mystery_set_id'] for row in rows], [str(self.joyful), str(self.sorrowful), str(self.joyful)])
+        self.assertEqual({row['user_id'] for row in rows}, {str(self.user.pk)})
+        self.assertEqual(rows[1]['mystery_set'], sequence.get_catalog().sets[self.sorrowful])
+
+    def test_ndjson(self):
+        lines = self.export(format='ndjson').decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(list(records[0]), list(export.FIELDS))
+        self.assertEqual(records[0]['decades'], 0b11111)
+
+    def test_gzip(self):
+        response = self.client.get(reverse('export_sessions'), {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        csv_export = self.export()
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), csv_export)
+
+    def test_filters(self):
+        self.assertEqual(len(self.rows(since=self.days[1].isoformat())), 2)
+        self.assertEqual(len(self.rows(until=self.days[1].isoformat())), 2)
+        self.assertEqual(len(self.rows(since=self.days[1].isoformat(), until=self.days[1].isoformat())), 1)
+        self.assertEqual(len(self.rows(set=self.joyful)), 2)
+
+    def test_invalid_parameters(self):
+        for params in ({'format': 'xml'}, {'since': '2026-13-01'}, {'until': 'yesterday'}, {'set': '0'}, {'set': 'x'}):
+            self.assertEqual(self.client.get(reverse('export_sessions'), params).status_code, 400, params)
+
+    def test_access(self):
+        self.assertEqual(self.client.get(reverse('export_all_sessions')).status_code, 404)
+        self.client.logout()
+        self.assertRedirects(
+            self.client.get(reverse('export_sessions')), reverse('login'), fetch_redirect_response=False,
+        )
+        self.client.force_login(User.objects.create_user("staff", is_staff=True))
+        self.assertEqual(len(self.rows('export_all_sessions')), 4)
+
+    def test_rows_are_read_while_streaming(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('export_sessions'))
+        self.assertFalse([query for query in queries if 'rosary_prayersession' in query['sql']])
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(response.streaming_content)
+        self.assertTrue([query for query in queries if 'rosary_prayersession' in query['sql']])
+
+    def test_command(self):
+        stdout = io.StringIO()
+        stdout.buffer = io.BytesIO()
+        with mock.patch('sys.stdout', stdout):
+            call_command('export_sessions', '--format', 'ndjson', '--user', 'other', '--set', str(self.joyful))
+        records = [json.loads(line) for line in stdout.buffer.getvalue().decode().splitlines()]
+        self.assertEqual([record['user_id'] for record in records], [self.other.pk])
+
+
+class HeartbeatWriterTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f"beat{n}").pk for n in range(3)]
+        # Flushes are driven by the tests, not the background thread.
+        patcher = mock.patch.object(heartbeat.BufferedHeartbeatWriter, '_ensure_thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def regions(self):
+        return dict(PrayerActivity.objects.values_list('user_id', 'region'))
+
+    def dropped(self):
+        return metrics.HEARTBEATS_DROPPED._values.get((), 0)
+
+    def test_base_classes_are_abstract(self):
+        with self.assertRaises(TypeError):
+            heartbeat.HeartbeatWriter(60)
+        with self.assertRaises(TypeError):
+            geo.CachingResolver()
+
+    def test_sync_writer_skips_fresh_users(self):
+        writer = heartbeat.SyncHeartbeatWriter(min_interval=60)
+        self.assertTrue(writer.record(self.users[0], "Lazio"))
+        self.assertFalse(writer.record(self.users[0], "Texas"))
+        self.assertEqual(self.regions(), {self.users[0]: "Lazio"})
+
+    def test_buffered_writer_writes_on_flush(self):
+        writer = heartbeat.BufferedHeartbeatWriter(min_interval=0, flush_interval=3600, batch_size=100)
+        writer.record(self.users[0], "Lazio")
+        writer.record(self.users[0], "Texas")
+        writer.record(self.users[1], "Lazio")
+        self.assertEqual(self.regions(), {})
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(self.regions(), {self.users[0]: "Texas", self.users[1]: "Lazio"})
+
+    def test_failed_flush_is_retried(self):
+        writer = heartbeat.BufferedHeartbeatWriter(min_interval=0, flush_interval=3600, batch_size=100)
+        writer.record(self.users[0], "Lazio")
+        writer.record(self.users[1], "Lazio")
+        with mock.patch.object(heartbeat, 'write_heartbeats', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                writer.flush()
+        writer.record(self.users[1], "Texas")  # newer than the failed batch
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(self.regions(), {self.users[0]: "Lazio", self.users[1]: "Texas"})
+
+    def test_buffer_is_bounded_while_writes_fail(self):
+        writer = heartbeat.BufferedHeartbeatWriter(
+            min_interval=0, flush_interval=3600, batch_size=100, max_pending=2,
+        )
+        dropped = self.dropped()
+        writer.record(self.users[0], "Lazio", when=timezone.now() - timedelta(minutes=1))
+        writer.record(self.users[1], "Lazio")
+        writer.record(self.users[2], "Lazio")
+        self.assertEqual(self.dropped(), dropped + 1)
+
+        def fail_while_a_heartbeat_arrives(*args):
+            writer.record(self.users[2], "Texas")
+            raise OperationalError("database is locked")
+
+        with mock.patch.object(heartbeat, 'write_heartbeats', side_effect=fail_while_a_heartbeat_arrives):
+            with self.assertRaises(OperationalError):
+                writer.flush()
+        # The failed batch went back under the newer heartbeat; the oldest one made way.
+        self.assertEqual(self.dropped(), dropped + 2)
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(self.regions(), {self.users[1]: "Lazio", self.users[2]: "Texas"})
+
+
+@override_settings(ROSARY_METRICS_SAMPLE_RATE=1)
+class MetricsTests(SimpleTestCase):
+    def test_unknown_methods_share_a_label(self):
+        request = SimpleNamespace(method='BREW', resolver_match=None)
+        stats, token = metrics.start_request()
+        metrics.finish_request(request, SimpleNamespace(status_code=405), 0, stats, token)
+        self.assertIn(('<unresolved>', 'other'), metrics.REQUEST_SECONDS._series)
+        self.assertNotIn(('<unresolved>', 'BREW'), metrics.REQUEST_SECONDS._series)
+
+    def test_nested_renders_are_counted_once(self):
+        def template(name, render):
+            return metrics.TimedTemplate(SimpleNamespace(template=SimpleNamespace(name=name), render=render))
+
+        inner = template('rosary/partials/nested.html', lambda context, request: '')
+        outer = template('rosary/nested.html', lambda context, request: inner.render())
+        stats, token = metrics.start_request()
+        try:
+            # outer starts, inner starts, inner ends, outer ends
+            with mock.patch.object(metrics.time, 'perf_counter', side_effect=[0.0, 1.0, 2.0, 3.0]):
+                outer.render()
+        finally:
+            metrics._current.reset(token)
+        self.assertEqual(stats.template_seconds, 3.0)
+        self.assertNotIn(('rosary/partials/nested.html',), metrics.TEMPLATE_SECONDS._series)
+
+
+class WarmUpTests(RosaryTestCase):
+    def test_caches_are_populated(self):
+        loader = engines.all()[0].engine.template_loaders[0]
+        loader.reset()
+        with mock.patch.object(connections, 'close_all'):
+            results = warmup.warm_up()
+        self.assertIs(warmup.results, results)
+        self.assertEqual([name for name, seconds in results.items() if seconds is None], [])
+        self.assertEqual(sequence.stats()['size'], len(sequence.get_catalog().sets))
+        self.assertIn('rosary/home.html', loader.get_template_cache)
+
+    def test_entry_modules_warm_up(self):
+        for module in ('prayer_site.wsgi', 'prayer_site.asgi'):
+            with self.subTest(module=module), mock.patch.object(warmup, 'warm_up') as warm_up:
+                sys.modules.pop(module, None)
+                self.addCleanup(sys.modules.pop, module, None)
+                importlib.import_module(module)
+                warm_up.assert_called_once_with()
+
+
+class DatabaseTuningTests(SimpleTestCase):
+    SQLITE = 'django.db.backends.sqlite3'
+    POSTGRES = 'django.db.backends.postgresql'
+
+    def test_sqlite_connections_run_the_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = db_tuning.tune({'ENGINE': self.SQLITE, 'NAME': os.path.join(directory, 'tuned.sqlite3')},
+                                      sqlite={'mmap_size': 1 << 20, 'cache_size': -2000})
+            wrapper = SQLiteDatabaseWrapper(
+                connections.configure_settings({'default': settings.DATABASES['default'], 'tuned': database})['tuned'],
+                'tuned',
+            )
+            try:
+                with wrapper.cursor() as cursor:
+                    pragmas = {}
+                    for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size'):
+                        cursor.execute(f"PRAGMA {pragma}")
+                        pragmas[pragma] = cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'mmap_size': 1 << 20, 'cache_size': -2000,
+        })
+
+    def test_configured_options_win(self):
+        database = db_tuning.tune({'ENGINE': self.SQLITE, 'OPTIONS': {'timeout': 1}}, sqlite={})
+        self.assertEqual(database['OPTIONS']['timeout'], 1)
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(db_tuning.tune({'ENGINE': self.SQLITE}, sqlite=None)['OPTIONS'], {})
+
+    def test_postgres_pool(self):
+        database = {'ENGINE': self.POSTGRES, 'CONN_MAX_AGE': 600}
+        with mock.patch.object(db_tuning, 'pool_available', return_value=True), \
+                mock.patch.object(db_tuning, 'postgres_pool_options', return_value={'max_size': 4}) as options:
+            pooled = db_tuning.tune(database, postgres_pool={'max_size': 4})
+        options.assert_called_once_with(max_size=4)
+        self.assertEqual((pooled['OPTIONS'], pooled['CONN_MAX_AGE']), ({'pool': {'max_size': 4}}, 0))
+
+        with mock.patch.object(db_tuning, 'pool_available', return_value=False):
+            persistent = db_tuning.tune(database, postgres_pool={'max_size': 4})
+        self.assertEqual((persistent['CONN_MAX_AGE'], persistent['CONN_HEALTH_CHECKS']), (600, True))
+        self.assertNotIn('pool', persistent['OPTIONS'])
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'slow.ndjson')
+
+    def log_query(self, **overrides):
+        with self.settings(ROSARY_SLOW_QUERY_MS=0.000001, ROSARY_SLOW_QUERY_LOG=self.path, **overrides):
+            User.objects.filter(username='secret-value').exists()
+
+    def test_params_are_redacted_and_file_is_private(self):
+        self.log_query()
+        entries = slow_queries.read_log(self.path)
+        self.assertTrue(entries)
+        self.assertNotIn('secret-value', json.dumps(entries))
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_params_logged_when_enabled(self):
+        self.log_query(ROSARY_SLOW_QUERY_LOG_PARAMS=True)
+        self.assertIn('secret-value', json.dumps(slow_queries.read_log(self.path)))
+
+    def test_symlink_is_not_followed(self):
+        target = self.path + '.target'
+        open(target, 'w').close()
+        os.symlink(target, self.path)
+        with self.assertLogs('rosary.slow_queries', 'WARNING'):
+            self.log_query()
+        self.assertEqual(os.path.getsize(target), 0)
@@ -0,0 +1,145 @@
+"""
+Heatmap tiles: live activity binned per zoom level.
+
+Activity is counted on the Web Mercator tiles Leaflet uses. Each 256px tile
+is split into ``ROSARY_HEATMAP_TILE_BINS`` x ``ROSARY_HEATMAP_TILE_BINS``
+cells, and a tile at zoom ``z`` holds the counts of its four children at
+``z + 1`` merged, so the levels form a quadtree down to
+``ROSARY_HEATMAP_MAX_ZOOM``. A tile response lists at most bins² cells,
+however many people are in it, and the map only asks for the tiles in view.
+
+The pyramid is rebuilt from ``PrayerActivity`` at most every
+``ROSARY_HEATMAP_REBUILD_INTERVAL`` seconds. The database groups the
+heartbeats of the window into cells the size of the finest level, so the
+rebuild handles one row per occupied cell rather than one per user. Activity
+without coordinates is not drawn.
+"""
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F
+from django.db.models.functions import Floor
+from django.utils import timezone
+
+from . import metrics, presence
+from .models import PrayerActivity
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798  # where Web Mercator is square
+
+
+def project(lat, lng, cells):
+    """Web Mercator position of a coordinate on a world of ``cells`` x ``cells`` cells."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180) / 360 * cells
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * cells
+    return min(int(x), cells - 1), min(int(y), cells - 1)
+
+
+class TileIndex:
+    def __init__(self, max_zoom=8, bins=32, rebuild_interval=30, window_minutes=15):
+        if bins & (bins - 1) or not 1 <= bins <= TILE_SIZE:
+            raise ValueError("Tile bins must be a power of two no larger than the tile size.")
+        self.max_zoom = max_zoom
+        self.bins = bins
+        self.rebuild_interval = rebuild_interval
+        self.window_minutes = window_minutes
+        # Per zoom: {(x, y): [[i, j, count], ...]}, and the busiest cell to scale intensity.
+        self._levels = ([{}] * (max_zoom + 1), [0] * (max_zoom + 1))
+        self._rebuild_lock = threading.Lock()
+        self._rebuilt_at = None
+
+    def tile(self, z, x, y):
+        """``{'z', 'x', 'y', 'bins', 'max', 'cells'}`` for a tile, or None outside the pyramid."""
+        if not 0 <= z <= self.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        self.ensure_fresh()
+        tiles, peaks = self._levels
+        return {
+            'z': z, 'x': x, 'y': y,
+            'bins': self.bins,
+            'max': peaks[z],
+            'cells': tiles[z].get((x, y), []),
+        }
+
+    def ensure_fresh(self):
+        rebuilt_at = self._rebuilt_at
+        if rebuilt_at is not None and time.monotonic() - rebuilt_at < self.rebuild_interval:
+            return
+        if self._rebuild_lock.acquire(blocking=rebuilt_at is None):
+            try:
+                if self._rebuilt_at == rebuilt_at:
+                    self.rebuild()
+            finally:
+                self._rebuild_lock.release()
+
+    def _occupied_cells(self):
+        """``(lat, lng, count)`` per occupied cell of the finest level, grouped by the database."""
+        # One finest cell is ``step`` degrees wide, and its height in degrees
+        # shrinks with cos(latitude); quarter-height rows stay finer than the
+        # cells they feed up to 75 degrees.
+        step = 360 / (2 ** self.max_zoom * self.bins)
+        row_step = step / 4
+        since = timezone.now() - timedelta(minutes=self.window_minutes)
+        rows = (
+            PrayerActivity.objects
+            .filter(last_active__gte=since, lat__isnull=False, lng__isnull=False)
+            .annotate(row=Floor(F('lat') / row_step), column=Floor(F('lng') / step))
+            .values_list('row', 'column')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for row, column, count in rows.iterator():
+            yield (row + 0.5) * row_step, (column + 0.5) * step, count
+
+    def rebuild(self):
+        started = time.perf_counter()
+        cells = 2 ** self.max_zoom * self.bins
+        level = Counter()
+        for lat, lng, count in self._occupied_cells():
+            level[project(lat, lng, cells)] += count
+
+        tiles, peaks = [None] * (self.max_zoom + 1), [0] * (self.max_zoom + 1)
+        for z in range(self.max_zoom, -1, -1):
+            by_tile = defaultdict(list)
+            for (cx, cy), count in sorted(level.items()):
+                by_tile[cx // self.bins, cy // self.bins].append([cx % self.bins, cy % self.bins, count])
+            tiles[z] = dict(by_tile)
+            peaks[z] = max(level.values(), default=0)
+            parent = Counter()
+            for (cx, cy), count in level.items():
+                parent[cx >> 1, cy >> 1] += count
+            level = parent
+
+        self._levels = (tiles, peaks)
+        self._rebuilt_at = time.monotonic()
+        metrics.HEATMAP_BUILD_SECONDS.observe(time.perf_counter() - started)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TileIndex(
+                    max_zoom=settings.ROSARY_HEATMAP_MAX_ZOOM,
+                    bins=settings.ROSARY_HEATMAP_TILE_BINS,
+                    rebuild_interval=settings.ROSARY_HEATMAP_REBUILD_INTERVAL,
+                    window_minutes=presence.HEATMAP_WINDOW_MINUTES,
+                )
+    return _index
+
+
+def reset():
+    global _index
+    with _index_lock:
+        _index = None
@@ -7,11 +7,21 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('active/', views.active_users, name='active_users'),
     path('stats/', views.stats_page, name='stats'),
-    path('map/data/', views.prayer_heatmap_data, name='heatmap_data'),
+    path('map/tiles/<int:z>/<int:x>/<int:y>.json', views.heatmap_tile, name='heatmap_tile'),
     path('map/', views.heatmap_page, name='heatmap'),
+    path('live/presence/', views.live_presence, name='live_presence'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('start/', views.rosary_start, name='rosary_start'),
     path('pray/', views.rosary_intro, name='rosary_intro'),
     path('pray/flow/', views.rosary_flow, name='rosary_flow'),
+    path('pray/live/', views.rosary_pray, name='rosary_pray'),
+    path('api/sequence/<int:set_id>/', views.rosary_sequence_api, name='rosary_sequence_api'),
+    path('api/progress/', views.rosary_progress_api, name='rosary_progress_api'),
+    path('api/completions/', views.rosary_completions_api, name='rosary_completions_api'),
+    path('manifest.webmanifest', views.web_manifest, name='web_manifest'),
+    path('sw.js', views.service_worker, name='service_worker'),
+    path('export/sessions/', views.export_sessions, name='export_sessions'),
+    path('export/sessions/all/', views.export_all_sessions, name='export_all_sessions'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('logout/', LogoutView.as_view(next_page='home'), name='logout'),
 ]
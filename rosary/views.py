@@ -1,14 +1,93 @@
+import hashlib
+import hmac
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, Http404
+from django.templatetags.static import static
+from django.urls import reverse
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control
+from django.utils.text import compress_sequence
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import condition, require_POST
 from django.contrib.auth.forms import UserCreationForm
-from django.db.models import Count
-from django.db.models.functions import TruncDate
-from .models import (
-    PrayerActivity, PrayerSession, MysterySet,
-    Prayer, Mystery, DecadeStep, PrayerSequence, PrayerSequenceStep
-)
+from django.conf import settings
+from django.db import router
+from django.db.models import Count, Max, Sum
+from .models import DailyPrayerCount, PrayerSession, UserDailyPrayerCount
+from . import export, live, metrics, presence, rollups, sequence, tiles
+from .progress import RosaryProgress
+from .routers import pin_to_primary, reads_from_replica
+
+SEQUENCE_MAX_AGE = 300
+# Lets a reverse proxy answer heatmap polling bursts; presence moves by the minute.
+PRESENCE_MAX_AGE = 10
+
+# Invalidates page validators when a new release is deployed.
+_BOOT_ID = uuid.uuid4().hex
+
+
+def _digest(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+def _presence_counts(request, window):
+    """Counts for ``window``, read once per request by the validator and the view."""
+    counts = request.__dict__.setdefault('_presence_counts', {})
+    if window not in counts:
+        counts[window] = presence.get_aggregator().counts(window)
+    return counts[window]
+
+def _page_etag(request, *args, **kwargs):
+    """Validator for pages whose only per-visitor content is the navbar: the
+    user's name and, when signed in, the logout form's CSRF token."""
+    if not request.user.is_authenticated:
+        return _digest(settings.ROSARY_RELEASE or _BOOT_ID)
+    csrf_secret = request.META.get('CSRF_COOKIE')
+    if not csrf_secret:
+        # Rendering will issue a new CSRF cookie, which a 304 cannot carry.
+        return None
+    return _digest(settings.ROSARY_RELEASE or _BOOT_ID, request.user.pk, csrf_secret)
+
+def _active_users_etag(request):
+    page = _page_etag(request)
+    if page is None:
+        return None
+    return _digest(page, sorted(_presence_counts(request, presence.ACTIVE_WINDOW_MINUTES).items()))
+
+def _heatmap_tile(request, z, x, y):
+    """The tile for this request, looked up once by the validator and the view."""
+    if not hasattr(request, '_heatmap_tile'):
+        request._heatmap_tile = tiles.get_index().tile(z, x, y)
+    return request._heatmap_tile
+
+def _heatmap_tile_etag(request, z, x, y):
+    tile = _heatmap_tile(request, z, x, y)
+    return _digest(tile['max'], tile['cells']) if tile else None
+
+def _stats_since():
+    return timezone.localdate() - timezone.timedelta(days=settings.ROSARY_STATS_DAYS)
 
+def _stats_etag(request):
+    page = _page_etag(request)
+    if page is None or not request.user.is_authenticated:
+        return None
+    since = _stats_since()
+    versions = [
+        queryset.aggregate(updated=Max('updated_at'), rows=Count('id'))
+        for queryset in (
+            UserDailyPrayerCount.objects.filter(user=request.user),
+            DailyPrayerCount.objects.filter(day__gte=since),
+        )
+    ]
+    return _digest(page, since, versions)
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_page_etag)
 def homepage(request):
     return render(request, 'rosary/home.html')
 
@@ -22,52 +101,69 @@ def register(request):
         form = UserCreationForm()
     return render(request, 'rosary/register.html', {'form': form})
 
+@reads_from_replica
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_active_users_etag)
 def active_users(request):
-    window = timezone.now() - timezone.timedelta(minutes=10)
-    recent = PrayerActivity.objects.filter(last_active__gte=window)
+    counts = _presence_counts(request, presence.ACTIVE_WINDOW_MINUTES)
     return render(request, 'rosary/active.html', {
-        'count': recent.count(),
-        'regions': recent.values_list('region', flat=True).distinct(),
+        'count': sum(counts.values()),
+        'regions': sorted(counts),
     })
 
+@reads_from_replica
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_stats_etag)
 def stats_page(request):
     if not request.user.is_authenticated:
         return redirect('login')
 
-    user_sessions = PrayerSession.objects.filter(user=request.user)
-    prayers_by_day = user_sessions.annotate(day=TruncDate('started_at')).values('day').annotate(count=Count('id'))
-    prayers_by_mystery = user_sessions.values('mystery').annotate(count=Count('id'))
-    global_stats = PrayerSession.objects.annotate(day=TruncDate('started_at')).values('day').annotate(count=Count('id'))
+    since = _stats_since()
+    user_rollups = UserDailyPrayerCount.objects.filter(user=request.user)
+    prayers_by_day = user_rollups.filter(day__gte=since).values('day').annotate(count=Sum('count')).order_by('day')
+    prayers_by_set = user_rollups.values_list('mystery_set').annotate(count=Sum('count')).order_by('mystery_set')
+    set_names = sequence.get_catalog().sets
+    global_stats = DailyPrayerCount.objects.filter(day__gte=since).values('day', 'count').order_by('day')
 
     context = {
         'user_days': list(prayers_by_day),
-        'user_mysteries': list(prayers_by_mystery),
+        'user_mysteries': [
+            {'mystery_set': set_id, 'name': set_names.get(set_id, "Rosary"), 'count': count}
+            for set_id, count in prayers_by_set
+        ],
         'global_days': list(global_stats),
     }
     return render(request, 'rosary/stats.html', context)
 
-def prayer_heatmap_data(request):
-    recent = PrayerActivity.objects.filter(
-        last_active__gte=timezone.now() - timezone.timedelta(minutes=15)
-    )
-
-    region_coords = {
-        'California': [36.7783, -119.4179],
-        'England': [52.3555, -1.1743],
-        'Ontario': [51.2538, -85.3232],
-        'Nigeria': [9.0820, 8.6753],
-        'Unknown': [0, 0],
-    }
-
-    data = []
-    for region, count in recent.values_list('region').annotate(count=Count('region')):
-        coords = region_coords.get(region, [0, 0])
-        data.append({'lat': coords[0], 'lng': coords[1], 'count': count})
+@reads_from_replica
+@cache_control(public=True, max_age=PRESENCE_MAX_AGE)
+@condition(etag_func=_heatmap_tile_etag)
+def heatmap_tile(request, z, x, y):
+    tile = _heatmap_tile(request, z, x, y)
+    if tile is None:
+        raise Http404("No such tile")
+    return JsonResponse(tile, json_dumps_params={'separators': (',', ':')})
 
-    return JsonResponse(data, safe=False)
+async def live_presence(request):
+    if isinstance(request, ASGIRequest):
+        stream = live.event_stream(live.get_broadcaster(), settings.ROSARY_LIVE_KEEPALIVE)
+    else:
+        # A sync worker cannot hold the connection open; send one snapshot and
+        # let EventSource reconnect after the retry delay.
+        snapshot = await sync_to_async(live.latest_snapshot)()
+        stream = [
+            f"retry: {settings.ROSARY_LIVE_RETRY_MS}\n\n",
+            live.encode_event('snapshot', snapshot),
+        ]
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_page_etag)
 def heatmap_page(request):
-    return render(request, 'rosary/heatmap.html')
+    return render(request, 'rosary/heatmap.html', {'tile_max_zoom': settings.ROSARY_HEATMAP_MAX_ZOOM})
 
 def dashboard(request):
     if request.method == 'POST':
@@ -76,103 +172,270 @@ def dashboard(request):
 
 def rosary_start(request):
     weekday = timezone.now().strftime('%A')
-    try:
-        mystery_set = MysterySet.objects.get(days__icontains=weekday)
-    except MysterySet.DoesNotExist:
-        mystery_set = None
+    mystery_set_id = sequence.mystery_set_for_day(weekday)
 
-    if mystery_set:
-        request.session['mystery_set_id'] = mystery_set.id
-        return redirect('rosary_intro')
+    if mystery_set_id:
+        response = redirect('rosary_pray')
+        # Today's rosary already under way is resumed, not restarted.
+        if not RosaryProgress.load(request).resumes(mystery_set_id):
+            RosaryProgress(mystery_set_id).save(request, response)
+        return response
     else:
         return render(request, 'rosary/missing_mystery.html', {'day': weekday})
 
 def rosary_intro(request):
-    request.session['rosary_progress'] = 0
-    return redirect('rosary_flow')
+    response = redirect('rosary_flow')
+    progress = RosaryProgress.load(request)
+    if not progress.active:
+        RosaryProgress(progress.mystery_set_id, 0).save(request, response)
+    return response
 
 def rosary_flow(request):
-    if 'rosary_progress' not in request.session:
+    progress = RosaryProgress.load(request)
+    if not progress.active:
         return redirect('dashboard')
 
-    steps = build_full_rosary_sequence(request)
-    current_index = request.session.get('rosary_progress', 0)
+    compiled = sequence.get_sequence(progress.mystery_set_id)
+    current_index = progress.position
 
-    if current_index >= len(steps):
+    if current_index >= len(compiled.beads):
         if request.user.is_authenticated:
-            mystery_set_id = request.session.get('mystery_set_id')
-            mystery_label = "Full Rosary"
-            PrayerSession.objects.create(
-                user=request.user,
-                mystery=mystery_label,
-                completed=True
+            rollups.record_completed_session(
+                request.user, progress.mystery_set_id, compiled.decades_prayed(current_index),
             )
-        del request.session['rosary_progress']
-        return render(request, 'rosary/complete.html')
+        response = render(request, 'rosary/complete.html')
+        if request.user.is_authenticated:
+            pin_to_primary(response)
+        progress.finish(request, response)
+        return response
 
-    current_step = steps[current_index]
-    prayer = current_step["prayer"]
+    current_step = compiled.beads[current_index]
 
     if request.method == 'POST':
-        request.session['rosary_progress'] = current_index + 1
-        return redirect('rosary_flow')
-
-    # Group decades for display
-    decades = []
-    current_decade = []
-    current_label = None
-    for bead in steps:
-        if bead["part"].startswith("mystery-"):
-            if bead["mystery_title"] != current_label:
-                if current_decade:
-                    decades.append((current_label, current_decade))
-                current_decade = []
-                current_label = bead["mystery_title"]
-            current_decade.append(bead)
-    if current_decade:
-        decades.append((current_label, current_decade))
+        response = redirect('rosary_flow')
+        RosaryProgress(progress.mystery_set_id, current_index + 1).save(request, response)
+        return response
 
     return render(request, 'rosary/step_by_step.html', {
-        'step': prayer,
-        'part': current_step['part'],
-        'mystery_title': current_step['mystery_title'],
+        'step': current_step,
+        'part': current_step.part,
+        'mystery_title': current_step.mystery_title,
         'current_index': current_index + 1,
-        'total_steps': len(steps),
-        'beads': steps,
-        'decades': decades,
+        'total_steps': len(compiled.beads),
+        'sequence': compiled,
+        'position': current_index,
     })
 
-def build_full_rosary_sequence(request):
-    sequence = []
-
-    intro = PrayerSequence.objects.get(name="Introductory Prayers")
-    for step in intro.steps.all():
-        for _ in range(step.repeat):
-            sequence.append({
-                "prayer": step.prayer,
-                "part": "intro",
-                "mystery_title": None
-            })
-
-    mystery_set_id = request.session.get('mystery_set_id')
-    mysteries = Mystery.objects.filter(set_id=mystery_set_id).order_by('id')
-
-    for idx, mystery in enumerate(mysteries, start=1):
-        for step in mystery.steps.all():
-            for _ in range(step.repeat):
-                sequence.append({
-                    "prayer": step.prayer,
-                    "part": f"mystery-{idx}",
-                    "mystery_title": mystery.title
-                })
-
-    conclusion = PrayerSequence.objects.get(name="Concluding Prayers")
-    for step in conclusion.steps.all():
-        for _ in range(step.repeat):
-            sequence.append({
-                "prayer": step.prayer,
-                "part": "conclusion",
-                "mystery_title": None
-            })
-
-    return sequence
+def rosary_pray(request):
+    progress = RosaryProgress.load(request)
+    mystery_set_id = progress.mystery_set_id
+    if mystery_set_id not in sequence.get_catalog().sets:
+        return redirect('dashboard')
+    # Nothing is written here: pray.js reports progress from the first bead it moves past.
+    position = 0
+    if progress.active:
+        position = min(progress.position, len(sequence.get_sequence(mystery_set_id).beads) - 1)
+    return render(request, 'rosary/pray.html', {
+        'rosary_config': {
+            'setId': mystery_set_id,
+            'position': position,
+            'sequenceUrl': reverse('rosary_sequence_api', args=[mystery_set_id]),
+            'progressUrl': reverse('rosary_progress_api'),
+            # Offline, the cached page prays today's set and queues the completion.
+            'sequenceUrls': {
+                set_id: reverse('rosary_sequence_api', args=[set_id]) for set_id in sequence.get_catalog().sets
+            },
+            'weekdaySets': sequence.get_catalog().weekdays,
+            'completionsUrl': reverse('rosary_completions_api') if request.user.is_authenticated else None,
+            'completionsBatch': settings.ROSARY_COMPLETIONS_MAX_BATCH,
+        },
+    })
+
+def _sequence_etag(request, set_id):
+    if set_id not in sequence.get_catalog().sets:
+        return None
+    return sequence.get_sequence(set_id).etag
+
+@condition(etag_func=_sequence_etag)
+def rosary_sequence_api(request, set_id):
+    if set_id not in sequence.get_catalog().sets:
+        raise Http404("Unknown mystery set")
+    response = HttpResponse(sequence.get_sequence(set_id).payload, content_type='application/json')
+    patch_cache_control(response, public=True, max_age=SEQUENCE_MAX_AGE)
+    return response
+
+@require_POST
+def rosary_progress_api(request):
+    try:
+        data = json.loads(request.body)
+        set_id = int(data['set_id'])
+        position = int(data['position'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with integer set_id and position.'}, status=400)
+    if set_id not in sequence.get_catalog().sets:
+        raise Http404("Unknown mystery set")
+
+    compiled = sequence.get_sequence(set_id)
+    total = len(compiled.beads)
+    if position < total:
+        progress = RosaryProgress(set_id, max(position, 0))
+        response = JsonResponse({'position': progress.position, 'completed': False})
+        progress.save(request, response)
+        return response
+
+    # Completion is recorded once per started rosary of this set; retries find
+    # no progress, and a rosary of another set under way is left alone.
+    progress = RosaryProgress.load(request)
+    completed = progress.resumes(set_id)
+    response = JsonResponse({'position': total, 'completed': completed})
+    if completed:
+        if request.user.is_authenticated:
+            rollups.record_completed_session(request.user, set_id, compiled.decades_prayed(total))
+            pin_to_primary(response)
+        progress.finish(request, response)
+    return response
+
+def _parse_completion(item, now):
+    """``(client_id, set_id, completed_at)`` from one uploaded completion; raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("Expected an object.")
+    client_id = uuid.UUID(str(item.get('client_id')))
+    set_id = int(item.get('set_id'))
+    if set_id not in sequence.get_catalog().sets:
+        raise ValueError("Unknown mystery set.")
+    completed_at = parse_datetime(str(item.get('completed_at')))
+    if completed_at is None or timezone.is_naive(completed_at):
+        raise ValueError("completed_at must be an ISO 8601 time with an offset.")
+    if completed_at < now - timezone.timedelta(days=settings.ROSARY_COMPLETIONS_MAX_AGE_DAYS):
+        raise ValueError("Completion is too old to record.")
+    return client_id, set_id, min(completed_at, now)
+
+@require_POST
+def rosary_completions_api(request):
+    """Record rosaries completed offline, uploaded as ``{"completions": [{"client_id",
+    "set_id", "completed_at"}, ...]}``. Each result is final: "created", "duplicate"
+    for a ``client_id`` already recorded, or why it was rejected."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Sign in to record completions.'}, status=403)
+    try:
+        completions = json.loads(request.body)['completions']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with a list of completions.'}, status=400)
+    if not isinstance(completions, list) or len(completions) > settings.ROSARY_COMPLETIONS_MAX_BATCH:
+        return JsonResponse(
+            {'error': f'Expected at most {settings.ROSARY_COMPLETIONS_MAX_BATCH} completions.'}, status=400,
+        )
+
+    now = timezone.now()
+    results, recorded = {}, set()
+    for item in completions:
+        try:
+            client_id, set_id, completed_at = _parse_completion(item, now)
+        except (ValueError, TypeError) as exc:
+            if isinstance(item, dict) and item.get('client_id'):
+                results[str(item['client_id'])] = str(exc)
+            continue
+        compiled = sequence.get_sequence(set_id)
+        session = rollups.record_completed_session(
+            request.user, set_id, compiled.decades_prayed(len(compiled.beads)),
+            started_at=completed_at, client_id=client_id,
+        )
+        results[str(client_id)] = 'created' if session else 'duplicate'
+        recorded.add(set_id)
+
+    response = JsonResponse({'results': results})
+    if 'created' in results.values():
+        pin_to_primary(response)
+    progress = RosaryProgress.load(request)
+    if progress.active and progress.mystery_set_id in recorded:
+        progress.finish(request, response)
+    return response
+
+def _offline_assets():
+    """What the service worker stores on install for praying offline."""
+    return [
+        static('rosary/vendor/bootstrap/bootstrap.min.css'),
+        static('rosary/vendor/bootstrap/bootstrap.min.js'),
+        static('rosary/pray.js'),
+        static('rosary/icon.svg'),
+        *(reverse('rosary_sequence_api', args=[set_id]) for set_id in sequence.get_catalog().sets),
+    ]
+
+@cache_control(no_cache=True)
+def service_worker(request):
+    assets = _offline_assets()
+    # Content-addressed: hashed static names and sequence ETags.
+    version = _digest(assets, [sequence.get_sequence(set_id).etag for set_id in sequence.get_catalog().sets])
+    prayer_paths = [reverse(name) for name in ('rosary_start', 'rosary_intro', 'rosary_flow', 'rosary_pray')]
+    return render(request, 'rosary/sw.js', {
+        'version': version[:16],
+        'assets': json.dumps(assets),
+        'static_url': settings.STATIC_URL,
+        'pray_url': reverse('rosary_pray'),
+        'prayer_paths': json.dumps(prayer_paths),
+    }, content_type='application/javascript')
+
+@cache_control(public=True, max_age=SEQUENCE_MAX_AGE)
+def web_manifest(request):
+    return JsonResponse({
+        'name': 'Rosary Prayer',
+        'short_name': 'Rosary',
+        'start_url': reverse('rosary_start'),
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': '#ffffff',
+        'theme_color': '#212529',
+        'icons': [{'src': static('rosary/icon.svg'), 'sizes': 'any', 'type': 'image/svg+xml'}],
+    }, content_type='application/manifest+json')
+
+def _metrics_allowed(request):
+    token = settings.ROSARY_METRICS_TOKEN
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+    return request.user.is_staff
+
+@never_cache
+def metrics_view(request):
+    if not settings.ROSARY_METRICS_ENABLED or not _metrics_allowed(request):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _export_response(request, name, user=None):
+    """Stream sessions as ``?format=csv|ndjson``, filtered by ``?since=`` and ``?until=``
+    (YYYY-MM-DD, inclusive) and ``?set=`` (mystery set id), and compressed when ``?gzip=1``."""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.CONTENT_TYPES:
+        expected = ', '.join(export.CONTENT_TYPES)
+        return JsonResponse({'error': f"Unknown format; expected one of {expected}."}, status=400)
+    try:
+        since = export.parse_day(request.GET.get('since'))
+        until = export.parse_day(request.GET.get('until'))
+        set_id = export.parse_set(request.GET.get('set'))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    # Bind the database now: the rows are read after the view has returned.
+    queryset = export.sessions(user, since, until, set_id).using(router.db_for_read(PrayerSession))
+    chunks = export.stream(queryset, fmt)
+    filename = f"{name}.{fmt}"
+    if request.GET.get('gzip') == '1':
+        response = StreamingHttpResponse(compress_sequence(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@never_cache
+@reads_from_replica
+def export_sessions(request):
+    if not request.user.is_authenticated:
+        return redirect('login')
+    return _export_response(request, 'prayer-sessions', user=request.user)
+
+@never_cache
+@reads_from_replica
+def export_all_sessions(request):
+    if not request.user.is_staff:
+        raise Http404
+    return _export_response(request, 'prayer-sessions-all')
@@ -0,0 +1,95 @@
+"""
+Start-up warm-up.
+
+``warm_up`` primes the per-process caches that requests would otherwise
+build lazily: the URL resolver, the compiled rosary sequences, the GeoIP
+reader, the static manifest and every template. The WSGI and ASGI entry
+modules call it once the application is loaded, so it runs under any server:
+under gunicorn in the master when the app is preloaded, so forked workers
+inherit the warm state, and otherwise in each worker. gunicorn.conf.py logs
+the timings. Database connections opened along the way are closed again, so
+no socket is shared across the fork.
+
+It is not run from ``AppConfig.ready()``: Django warns about queries made
+before the app registry is ready, and management commands and the test
+runner, which also call ``ready()``, would pay for caches they never use.
+
+Each step is timed and a failing step is logged and skipped.
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import reverse
+
+from . import geo, sequence
+
+logger = logging.getLogger(__name__)
+
+
+def warm_urls():
+    reverse('home')
+
+
+def warm_sequences():
+    for set_id in sequence.get_catalog().sets:
+        sequence.get_sequence(set_id)
+
+
+def warm_geoip():
+    resolver = geo.get_resolver()
+    if hasattr(resolver, 'open'):
+        resolver.open()
+
+
+def warm_static():
+    staticfiles_storage.url('rosary/pray.js')
+
+
+def warm_templates():
+    root = Path(apps.get_app_config('rosary').path) / 'templates'
+    for path in sorted(root.rglob('*.html')):
+        get_template(path.relative_to(root).as_posix())
+
+
+STEPS = [
+    ('urls', warm_urls),
+    ('sequences', warm_sequences),
+    ('geoip', warm_geoip),
+    ('static', warm_static),
+    ('templates', warm_templates),
+]
+
+
+# Timings of this process's last warm-up, for the server to log.
+results = None
+
+
+def warm_up():
+    """Run every step and return ``{step: seconds}``; failed steps map to None."""
+    global results
+    results = {}
+    started = time.perf_counter()
+    for name, step in STEPS:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %r failed", name)
+            results[name] = None
+        else:
+            results[name] = time.perf_counter() - step_started
+    connections.close_all()
+    results['total'] = time.perf_counter() - started
+    return results
+
+
+def format_timings(results):
+    return ', '.join(
+        f"{name}={'failed' if seconds is None else f'{seconds * 1000:.1f}ms'}"
+        for name, seconds in results.items()
+    )